@@ -1,18 +1,23 @@
 """
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version: 1.17
+@version: 1.20
 
 Library of tools for date time processing used in general by KV
 
 Update:  2024-06-06;kv - added try/except on datetime_from_str
+Update:  2026-10-17;kv - datetime_from_str format table compiled once, DatetimeParser fast path and cache
+Update:  2026-10-17;kv - datetime64_column - convert a column of strings to numpy datetime64 in one pass
+Update:  2026-10-17;kv - timezone cache (get_timezone) and utc offset transition table (utc_offset)
 
 """
 
 from __future__ import print_function
 
 # import os
+import re
 import datetime
+from collections import OrderedDict
 from dateutil import tz  ## python-dateutil
 from dateutil.zoneinfo import get_zonefile_instance
 from datetime import tzinfo
@@ -28,8 +33,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 # set the module version number
-AppVersion = "1.17"
-__version__ = "1.17"
+AppVersion = "1.20"
+__version__ = "1.20"
 
 
 def current_timezone_string() -> tzinfo | None:
@@ -43,6 +48,117 @@ def current_timezone_string() -> tzinfo | None:
     return local_tzname
 
 
+# timezone objects by name - resolved once
+_timezone_cache: dict = dict()
+
+# utc offset transition tables by (zone name, year)
+_transition_cache: dict = dict()
+
+
+def get_timezone(name: str | None = None) -> tzinfo | None:
+    """
+    tz.gettz with the zone object kept by name - a zone is only resolved once
+
+    Inputs:
+        name - str - timezone name (None - the system timezone)
+    Returns:
+        tzinfo or None when the name is not a timezone (None is not cached)
+    """
+    zone = _timezone_cache.get(name)
+    if zone is None:
+        zone = tz.gettz(name)
+        if zone is not None:
+            _timezone_cache[name] = zone
+    return zone
+
+
+def _offset_at(utc_dt: datetime.datetime, zone: tzinfo):
+    # (utc offset seconds, dst flag) of a naive utc datetime in zone
+    local = utc_dt.replace(tzinfo=tz.UTC).astimezone(zone)
+    return int(local.utcoffset().total_seconds()), bool(local.dst())
+
+
+def utc_offset_transitions(name: str, year: int) -> list:
+    """
+    Table of the utc offset periods of a timezone for a year - built once per zone and year
+
+    The zone is sampled once a day (in utc) and each change is narrowed down to the second.
+
+    Inputs:
+        name - str - timezone name
+        year - int - the year
+    Returns:
+        list of (local_start, local_end, offset_seconds, is_dst) - the naive local wall clock
+        range covered by each offset - a wall clock time in a fall back fold is in two periods
+        and one in a spring forward gap is in none
+    """
+    key = (name, year)
+    table = _transition_cache.get(key)
+    if table is not None:
+        return table
+
+    zone = get_timezone(name)
+    if zone is None:
+        raise ValueError(f"Unable to convert timezone string to timezone: {name}")
+
+    # utc instants where the offset changes - a couple of days either side of the year so edges are covered
+    oneday = datetime.timedelta(days=1)
+    start = datetime.datetime(year, 1, 1) - 2 * oneday
+    end = datetime.datetime(year + 1, 1, 1) + 2 * oneday
+    periods = [(start, _offset_at(start, zone))]
+    day = start
+    while day < end:
+        current = _offset_at(day + oneday, zone)
+        if current != periods[-1][1]:
+            # bisect the day to the second of the change
+            low, high = 0, 86400
+            while high - low > 1:
+                mid = (low + high) // 2
+                if _offset_at(day + datetime.timedelta(seconds=mid), zone) == current:
+                    high = mid
+                else:
+                    low = mid
+            periods.append((day + datetime.timedelta(seconds=high), current))
+        day += oneday
+
+    table = []
+    for idx, (utc_start, (offset, is_dst)) in enumerate(periods):
+        utc_end = periods[idx + 1][0] if idx + 1 < len(periods) else end
+        shift = datetime.timedelta(seconds=offset)
+        table.append((utc_start + shift, utc_end + shift, offset, is_dst))
+    _transition_cache[key] = table
+    return table
+
+
+def utc_offset(dt: datetime.datetime, name: str, is_dst: bool | None = False) -> datetime.timedelta:
+    """
+    utc offset of a naive local datetime in a timezone - looked up in utc_offset_transitions
+
+    Inputs:
+        dt - datetime - naive local (wall clock) time
+        name - str - timezone name
+        is_dst - bool - which offset a time in a fall back fold or spring forward gap gets
+            False (the pytz localize default) - standard time, True - daylight time
+            None - raise ValueError
+    Returns:
+        timedelta - the utc offset
+    """
+    table = utc_offset_transitions(name, dt.year)
+    matches = [x for x in table if x[0] <= dt < x[1]]
+    if not matches:
+        # spring forward gap - the periods either side of it
+        idx = max(idx for idx, x in enumerate(table) if x[1] <= dt)
+        matches = table[idx : idx + 2]
+    if len(matches) == 1:
+        return datetime.timedelta(seconds=matches[0][2])
+    if is_dst is None:
+        raise ValueError(f"Ambiguous or non-existent time in {name}: {dt}")
+    for period in matches:
+        if period[3] == is_dst:
+            return datetime.timedelta(seconds=period[2])
+    return datetime.timedelta(seconds=matches[0][2])
+
+
 def datetime2utcdatetime(
     dt: datetime.datetime, default_tz: tzinfo | None = None, no_tz: bool = False
 ) -> datetime.datetime:
@@ -77,9 +193,9 @@ def datetime2utcdatetime(
     if default_tz is None:
         # if we did not set the timezone in the parameters,
         # then use the timezone of the object or system timezone if the object is naive
-        default_tz = tz.gettz() if not dt_tz else dt_tz
+        default_tz = get_timezone() if not dt_tz else dt_tz
     else:
-        default_tz = tz.gettz(default_tz)
+        default_tz = get_timezone(default_tz)
 
     # check to see we have a valid timezone
     if not default_tz:
@@ -100,7 +216,8 @@ def datetime2utcdatetime(
     return utc_datetime
 
 
-# extract out a datetime value from a string if possible
+# list of different dateformats we convert and the proper data conversion string for that match
+# compiled once - order matters, the first regex that matches picks the format
 # formats currently supported:
 #  mm-dd-yy
 #  mm-dd-yyyy
@@ -120,6 +237,152 @@ def datetime2utcdatetime(
 #
 # and allow a Z to be on the end of this string that we will strip out
 #
+DATETIME_FORMATS = (
+    (re.compile(r"\d{1,2}/\d{1,2}/\d{2}$"), "%m/%d/%y"),
+    (re.compile(r"\d{1,2}/\d{1,2}/\d{4}$"), "%m/%d/%Y"),
+    (re.compile(r"\d{1,2}-\d{1,2}-\d{2}$"), "%m-%d-%y"),
+    (re.compile(r"\d{1,2}-\d{1,2}-\d{4}$"), "%m-%d-%Y"),
+    (
+        re.compile(r"\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2}$"),
+        "%Y-%m-%dT%H:%M:%S",
+    ),
+    (
+        re.compile(r"\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2}\.\d+$"),
+        "%Y-%m-%dT%H:%M:%S.%f",
+    ),
+    (
+        re.compile(r"\d{4}-\d{1,2}-\d{1,2}\s\d{1,2}:\d{1,2}:\d{1,2}$"),
+        "%Y-%m-%d %H:%M:%S",
+    ),
+    (
+        re.compile(r"\d{4}-\d{1,2}-\d{1,2}\s\d{1,2}:\d{1,2}$"),
+        "%Y-%m-%d %H:%M",
+    ),
+    (re.compile(r"\d{4}-\d{1,2}-\d{1,2}$"), "%Y-%m-%d"),
+    (re.compile(r"^\d{8}$"), "%Y%m%d"),
+    (re.compile(r"\d{1,2}-.{3}-\d{4}\s\d{2}:\d{2}"), "%d-%b-%Y %H:%M"),
+    (re.compile(r"\d{1,2}-.{3}-\d{4}"), "%d-%b-%Y"),
+    (re.compile(r"\d{1,2}-.{3}-\d{2}\s\d{2}:\d{2}"), "%d-%b-%y %H:%M"),
+    (re.compile(r"\d{1,2}-.{3}-\d{2}"), "%d-%b-%y"),
+    (
+        re.compile(r"\d{1,2}/\d{1,2}/\d{4}\s\s\d{2}:\d{2}:\d{2} [A|P]M"),
+        "%m/%d/%Y  %I:%M:%S %p",
+    ),
+    (
+        re.compile(r"\d{1,2}/\d{1,2}/\d{4}\s\d{2}:\d{2}:\d{2} [A|P]M"),
+        "%m/%d/%Y %I:%M:%S %p",
+    ),
+    (
+        re.compile(r"\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{1,2}$"),
+        "%m/%d/%Y %H:%M",
+    ),
+)
+
+
+class DatetimeParser:
+    """
+    datetime_from_str with state kept between calls - create one per hot loop (call site)
+
+    Keeps the index of the format that matched last and tries it first - a file
+    or column is almost always one format so most calls are one regex and one
+    strptime.  The result is only used when strptime succeeds, otherwise we
+    fall back to the full table walk, so the result is the same as walking
+    the table in order.
+
+    cache_size - int - when > 0 keep a bounded LRU cache of string -> datetime
+        (useful when the same strings repeat - dates in a stays file, xls columns)
+    """
+
+    def __init__(self, cache_size: int = 0):
+        self.last = 0
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        # statistics - fast path hits and cache hits
+        self.fast_hits = 0
+        self.cache_hits = 0
+
+    def __call__(
+        self,
+        value: Any,
+        skipblank: bool = False,
+        force_conversion: bool = False,
+        disp_msg: bool = False,
+    ):
+        """
+        Same inputs and returns as datetime_from_str
+        """
+        # strings are the common case - check for them first
+        if not isinstance(value, str):
+            # if we passed in datetime we are done already
+            if isinstance(value, datetime.datetime):
+                return value
+            # skip blank - empty value
+            if skipblank and not value:
+                return value
+            # we only convert strings so we return the value when it is not a string
+            if not force_conversion:
+                return value
+            raise Exception("Unable to convert to date time:[{}]".format(value))
+
+        # if we enabled skip blank - check for empty value
+        if skipblank and not value.strip():
+            return value
+
+        # check the cache
+        if self.cache_size:
+            result = self.cache.get(value)
+            if result is not None:
+                self.cache.move_to_end(value)
+                self.cache_hits += 1
+                return result
+
+        result = self._convert(value, disp_msg)
+
+        # save in the cache and drop the oldest entry when full
+        if self.cache_size:
+            self.cache[value] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    def _convert(self, orig_value: str, disp_msg: bool):
+        # strip the Z on the end before processing
+        value = orig_value
+        if value and value[-1] in "Zz":
+            value = value[:-1]
+
+        # fast path - the format that matched last time
+        redate, datefmt = DATETIME_FORMATS[self.last]
+        if redate.match(value):
+            try:
+                result = datetime.datetime.strptime(value, datefmt)
+                self.fast_hits += 1
+                return result
+            except ValueError:
+                pass
+
+        # step through each RE and if we find a match see if we can convert the string
+        for idx, (redate, datefmt) in enumerate(DATETIME_FORMATS):
+            if redate.match(value):
+                try:
+                    result = datetime.datetime.strptime(value, datefmt)
+                except Exception as e:
+                    if disp_msg:
+                        print("-" * 40)
+                        print("datetime_from_str - conversion error:")
+                        print(f"    value..:  {value}")
+                        print(f"    datefmt:  {datefmt}")
+                    raise e
+                self.last = idx
+                return result
+
+        raise Exception("Unable to convert to date time:[{}]".format(orig_value))
+
+
+# parser used by datetime_from_str - shared fast path, no cache
+_default_parser = DatetimeParser()
+
+
 def datetime_from_str(
     value: Any,
     skipblank: bool = False,
@@ -129,6 +392,54 @@ def datetime_from_str(
     """
     Take in Any value (but process only strings) and attempt to convert it to a datetime object if possible
 
+    Inputs:
+        value - Any - the value passed in
+            if datetime already - just return it
+            if a string - try to convert it to datetime
+            anything else - return the value or error out based on the flags below
+        skipblank - bool - if enabed, and the value is blank/empty - then skip the conversion and do not error out
+        force_conversion - bool - if enabled, if we are unasble to convert - fail
+        disp_msg - bool -  if enabled, display messages as processing - to enable interactive debugging
+    Returns:
+        value - the value or the datetime equivalent of the value
+
+    Hot loops should create their own DatetimeParser (own last matched format and optional cache)
+    """
+    return _default_parser(value, skipblank, force_conversion, disp_msg)
+
+
+# extract out a datetime value from a string if possible
+# formats currently supported:
+#  mm-dd-yy
+#  mm-dd-yyyy
+#  mm/dd/yy
+#  mm/dd/yyyy
+#  YYYY-MM-DDTHH:MM:SS
+#  YYYY-MM-DDTHH:MM:SS.mmmmm
+#  YYYY-MM-DD HH:MM:SS
+#  YYYY-MM-DD HH:MM
+#  YYYY-MM-DD
+#  YYYYMMDD
+#  DD-MMM-YYYY HH:MM
+#  DD-MMM-YYYY
+#  MM/DD/YYYY  HH:MM:SS AM/PM - 12/10/2025  11:31:00 PM
+#  MM/DD/YYYY HH:MM:SS AM/PM - 12/10/2025 11:31:00 PM
+#
+#
+# and allow a Z to be on the end of this string that we will strip out
+#
+def datetime_from_str_legacy(
+    value: Any,
+    skipblank: bool = False,
+    force_conversion: bool = False,
+    disp_msg: bool = False,
+):
+    """
+    Original datetime_from_str - recompiles the format table on every call - kept for comparison
+    (villastartup.bench_datetime_from_str) - use datetime_from_str
+
+    Take in Any value (but process only strings) and attempt to convert it to a datetime object if possible
+
     Inputs:
         value - Any - the value passed in
             if datetime already - just return it
@@ -228,6 +539,183 @@ def datetime_from_str(
     raise Exception("Unable to convert to date time:[{}]".format(orig_value))
 
 
+# fixed width numeric fields datetime64_column converts without strptime (directive: width)
+DATETIME64_FIELDS = {"Y": 4, "y": 2, "m": 2, "d": 2, "H": 2, "M": 2, "S": 2}
+
+
+def detect_datetime_format(values, sample_size: int = 20) -> str | None:
+    """
+    Pick the DATETIME_FORMATS format for a column of strings from a sample of its values
+
+    Inputs:
+        values - sequence of str - the column
+        sample_size - int - number of non blank values spread across the column we test
+    Returns:
+        datefmt - the strptime format most of the sample converts with (None if none convert)
+    """
+    filled = [x for x in values if isinstance(x, str) and x.strip()]
+    if not filled:
+        return None
+    step = max(1, len(filled) // sample_size)
+    counts: dict = dict()
+    for value in filled[::step][:sample_size]:
+        if value[-1] in "Zz":
+            value = value[:-1]
+        for redate, datefmt in DATETIME_FORMATS:
+            if redate.match(value):
+                try:
+                    datetime.datetime.strptime(value, datefmt)
+                except ValueError:
+                    break
+                counts[datefmt] = counts.get(datefmt, 0) + 1
+                break
+    if not counts:
+        return None
+    return max(counts, key=counts.get)
+
+
+def _datetime64_layout(datefmt: str):
+    # fixed width layout of a zero padded numeric format:  width, [(directive, start, width)], [(pos, char)]
+    # None when the format has a directive we do not convert here (%b, %p, %f ...)
+    fields = []
+    literals = []
+    pos = 0
+    idx = 0
+    while idx < len(datefmt):
+        if datefmt[idx] == "%":
+            directive = datefmt[idx + 1 : idx + 2]
+            if directive not in DATETIME64_FIELDS:
+                return None
+            fields.append((directive, pos, DATETIME64_FIELDS[directive]))
+            pos += DATETIME64_FIELDS[directive]
+            idx += 2
+        else:
+            literals.append((pos, datefmt[idx]))
+            pos += 1
+            idx += 1
+    directives = [x[0] for x in fields]
+    if len(set(directives)) != len(directives) or not ({"Y", "y"} & set(directives)):
+        return None
+    return pos, fields, literals
+
+
+def _datetime64_from_layout(codes, layout, unit: str):
+    # convert a (values x width) array of character codes laid out as layout - (datetime64 array, ok mask)
+    import numpy as np
+
+    width, fields, literals = layout
+    ok = np.ones(len(codes), dtype=bool)
+    for pos, char in literals:
+        ok &= codes[:, pos] == ord(char)
+    parts = {"m": 1, "d": 1, "H": 0, "M": 0, "S": 0}
+    for directive, start, size in fields:
+        # one digit column at a time - value = value * 10 + digit
+        value = np.zeros(len(codes), dtype=np.int64)
+        for pos in range(start, start + size):
+            digit = codes[:, pos].astype(np.int64) - 48
+            ok &= (digit >= 0) & (digit <= 9)
+            value = value * 10 + digit
+        parts[directive] = value
+    if "y" in parts:
+        # strptime rule - 69..99 are 1900s, 00..68 are 2000s
+        parts["Y"] = np.where(parts["y"] < 69, 2000, 1900) + parts["y"]
+    month = np.asarray(parts["m"]) + np.zeros(len(codes), dtype=np.int64)
+    ok &= (month >= 1) & (month <= 12) & (parts["Y"] >= 1)
+    month = np.where(ok, month, 1)
+    months = (np.where(ok, parts["Y"], 1970) - 1970) * 12 + month - 1
+    month_start = months.astype("datetime64[M]").astype("datetime64[D]")
+    month_days = ((months + 1).astype("datetime64[M]").astype("datetime64[D]") - month_start).astype(np.int64)
+    day = np.asarray(parts["d"])
+    ok &= (day >= 1) & (day <= month_days)
+    ok &= (np.asarray(parts["H"]) < 24) & (np.asarray(parts["M"]) < 60) & (np.asarray(parts["S"]) < 60)
+    seconds = np.asarray(parts["H"]) * 3600 + np.asarray(parts["M"]) * 60 + np.asarray(parts["S"])
+    converted = (month_start + (day - 1)).astype(f"datetime64[{unit}]") + (seconds * np.timedelta64(1, "s")).astype(f"timedelta64[{unit}]")
+    converted[~ok] = np.datetime64("NaT")
+    return converted, ok
+
+
+def datetime64_from_codes(codes, datefmt: str, unit: str = "s"):
+    """
+    Convert fixed width date strings already held as a (values x width) array of character
+    codes (bytes of a file as uint8, unicode code points) - the array pass of datetime64_column
+
+    Inputs:
+        codes - numpy 2d int array - one row per value, width = the width of datefmt
+        datefmt - str - zero padded numeric strptime format (%Y %y %m %d %H %M %S and literals)
+        unit - str - numpy datetime64 unit of the result
+    Returns:
+        (dates, ok) - numpy datetime64[unit] array (NaT where not ok), numpy bool array true where converted
+    """
+    layout = _datetime64_layout(datefmt)
+    if layout is None:
+        raise ValueError(f"Not a fixed width numeric date format: {datefmt}")
+    if codes.shape[1] != layout[0]:
+        raise ValueError(f"Width {codes.shape[1]} does not match the date format {datefmt}")
+    return _datetime64_from_layout(codes, layout, unit)
+
+
+def datetime64_column(
+    values,
+    datefmt: str | None = None,
+    sample_size: int = 20,
+    unit: str = "s",
+):
+    """
+    Convert a whole column of date strings to a numpy datetime64 array in one pass
+
+    The format is detected once from a sample (detect_datetime_format) unless passed in.
+    Zero padded numeric formats (%Y %y %m %d %H %M %S and literal characters) are converted
+    with array arithmetic on the characters - no strptime per value.  Values that do not
+    fit the layout (other formats, unpadded or odd values) are converted one at a time
+    with a DatetimeParser.  Values that do not convert are NaT and flagged in the error mask
+    rather than raising.
+
+    Inputs:
+        values - sequence of str - the column (villatemps.txt datetime, pool_temps.csv now_str, stays.txt date)
+        datefmt - str - strptime format of the column (None - detect it)
+        sample_size - int - number of values used to detect the format
+        unit - str - numpy datetime64 unit of the result
+    Returns:
+        (dates, errors) - numpy datetime64[unit] array, numpy bool array true where the value did not convert
+    """
+    import numpy as np
+
+    arr = np.asarray(values, dtype=str)
+    count = len(arr)
+    dates = np.full(count, np.datetime64("NaT"), dtype=f"datetime64[{unit}]")
+    done = np.zeros(count, dtype=bool)
+    if not count:
+        return dates, done
+
+    if datefmt is None:
+        datefmt = detect_datetime_format(arr.tolist(), sample_size)
+    layout = _datetime64_layout(datefmt) if datefmt else None
+
+    if layout and arr.dtype.itemsize // 4 >= layout[0]:
+        width = layout[0]
+        rows = np.flatnonzero(np.char.str_len(arr) == width)
+        # unicode code points - one row per value
+        codes = np.ascontiguousarray(arr[rows]).view("<u4").reshape(len(rows), -1)[:, :width]
+        converted, ok = _datetime64_from_layout(codes, layout, unit)
+        dates[rows[ok]] = converted[ok]
+        done[rows[ok]] = True
+
+    # values the array pass did not convert - one at a time - the column format then any format
+    parser = DatetimeParser()
+    errors = np.zeros(count, dtype=bool)
+    for idx in np.flatnonzero(~done):
+        value = str(arr[idx])
+        try:
+            try:
+                converted = datetime.datetime.strptime(value, datefmt)
+            except (TypeError, ValueError):
+                converted = parser(value, force_conversion=True)
+            dates[idx] = np.datetime64(converted, unit)
+        except Exception:
+            errors[idx] = True
+    return dates, errors
+
+
 # extract out a datetime value with timezone from a string if possible
 # formats currently supported:
 #     YYYY-MM-DD HH:MM:SS[+-]HHHH
@@ -369,7 +857,7 @@ def valid_tz_string(tzstr: str) -> bool:
     """
     Ability to test if a tzstring is a valid tz string
     """
-    if tz.gettz(tzstr):
+    if get_timezone(tzstr):
         return True
     return False
 
@@ -3,13 +3,10 @@ import os.path
 import base64
 from email.message import EmailMessage
 
-import google.auth
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
+# credentials and services are shared with the calendar (see kvgoogleauth.py)
+import kvgoogleauth
 
 '''
 
@@ -28,7 +25,7 @@ pip install --upgrade google-api-python-client google-auth-httplib2 google-auth-
 
 @author:  Ken Venner
 @contact: ken@vennerllc.com
-@version:  1.04
+@version:  1.06
 
 
 Created:  2024-02-18;kv
@@ -37,13 +34,13 @@ Version:  2024-02-18;kv
 '''
 
 # If modifying these scopes, delete the file token.json.
-SCOPES = [
-    "https://www.googleapis.com/auth/gmail.readonly"
-    , "https://www.googleapis.com/auth/gmail.send"
-]
+SCOPES = kvgoogleauth.GMAIL_SCOPES
 
 # version number
-AppVersion = '1.04'
+AppVersion = '1.06'
+
+# seconds we wait on the gmail api before giving up on a request
+HTTP_TIMEOUT = kvgoogleauth.HTTP_TIMEOUT
 
 
 def convert_email_to_filename(email_addr, file_ext='json'):
@@ -79,31 +76,9 @@ def google_creds_from_json(scopes=None, file_token_json=None, file_credentials_j
     # if we don't have scopes - we error out
     if not scopes:
         scopes = SCOPES
-    if not file_token_json:
-        file_token_json = 'token.json'
-    if not file_credentials_json:
-        file_credentials_json = 'credentials.json'
-
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists(file_token_json):
-        creds = Credentials.from_authorized_user_file(file_token_json, scopes)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                file_credentials_json, scopes
-            )
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open(file_token_json, "w") as token:
-            token.write(creds.to_json())
-
-    return creds
+
+    # loaded (and refreshed when expired) once per process - see kvgoogleauth.py
+    return kvgoogleauth.load_credentials(scopes, file_token_json, file_credentials_json)
 
 
 def gmail_refresh_token_take_no_action(email_from, scopes=None, file_token_json=None, file_credentials_json=None):
@@ -119,6 +94,45 @@ def gmail_refresh_token_take_no_action(email_from, scopes=None, file_token_json=
     # creds, _ = google.auth.default()
 
 
+def gmail_service(email_from, scopes=None, file_token_json=None, file_credentials_json=None, timeout=HTTP_TIMEOUT):
+    """ authorized gmail service for email_from - built once per process and reused
+        every message sent with it shares the same credentials and http connection
+
+        timeout - seconds before a request to the gmail api fails (so a slow endpoint can not hang the caller)
+    """
+    # determien the token.json file
+    if not file_token_json:
+        file_token_json = convert_email_to_filename(email_from)
+
+    # built once per process from the bundled discovery document - see kvgoogleauth.py
+    return kvgoogleauth.get_service("gmail", "v1", scopes or SCOPES, file_token_json, file_credentials_json, timeout)
+
+
+def gmail_send_service_message(service, email_from, email_to, email_subject, email_body):
+    """ send a message with a service from gmail_service - returns the message object
+        errors are raised (HttpError, socket errors) so the caller can retry
+    """
+    message = EmailMessage()
+
+    message.set_content(email_body)
+
+    message["To"] = email_to
+    message["From"] = email_from
+    message["Subject"] = email_subject
+
+    # encoded message
+    encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+    create_message = {"raw": encoded_message}
+    # pylint: disable=E1101
+    return (
+        service.users()
+        .messages()
+        .send(userId="me", body=create_message)
+        .execute()
+    )
+
+
 def gmail_send_simple_message(email_from, email_to, email_subject, email_body, scopes=None, file_token_json=None,
                               file_credentials_json=None):
     """Create and send an email message
@@ -139,35 +153,10 @@ def gmail_send_simple_message(email_from, email_to, email_subject, email_body, s
     file_credentials_json - the filename holding the OATH app approval credentials (default:  credentials.json)
 
     """
-    # determien the token.json file
-    if not file_token_json:
-        file_token_json = convert_email_to_filename(email_from)
-
-    # set the credentials
-    creds = google_creds_from_json(scopes, file_token_json, file_credentials_json)
-    # creds, _ = google.auth.default()
-
     try:
-        service = build("gmail", "v1", credentials=creds)
-        message = EmailMessage()
-
-        message.set_content(email_body)
-
-        message["To"] = email_to
-        message["From"] = email_from
-        message["Subject"] = email_subject
-
-        # encoded message
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-
-        create_message = {"raw": encoded_message}
-        # pylint: disable=E1101
-        send_message = (
-            service.users()
-            .messages()
-            .send(userId="me", body=create_message)
-            .execute()
-        )
+        # the service (and its credentials) are built on the first message and reused
+        service = gmail_service(email_from, scopes, file_token_json, file_credentials_json)
+        send_message = gmail_send_service_message(service, email_from, email_to, email_subject, email_body)
         print(f'Message Id: {send_message["id"]}')
     except HttpError as error:
         print(f"An error occurred: {error}")
@@ -0,0 +1,165 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+kvgoogleauth.py - one place to load google credentials and build api services
+
+Used by kvgmailsendsimple.py (gmail) and villacalendar.py (calendar):
+
+  credentials - loaded from a json token file once per process and token
+                file, refreshed only when expired and saved back as json
+                (the calendar token.pickle of earlier versions is converted
+                to json the first time it is seen).  When a caller needs a
+                scope the token was not granted, the browser flow is run
+                once for every scope so one token file can serve both apis.
+  services    - built once per process, api and token file from the
+                discovery documents bundled with google-api-python-client
+                (static_discovery) - nothing is fetched to build them
+
+Point gmail and calendar at the same token file and a run that does both
+makes one credential refresh.
+
+    service = kvgoogleauth.get_service('gmail', 'v1', kvgoogleauth.GMAIL_SCOPES, 'token.json')
+
+'''
+import os
+import threading
+import logging
+
+import kvutil
+
+# google clients - only imported when we build a service
+googleapiclient_discovery = kvutil.lazy_import('googleapiclient.discovery')
+google_auth_oauthlib_flow = kvutil.lazy_import('google_auth_oauthlib.flow')
+google_auth_requests = kvutil.lazy_import('google.auth.transport.requests')
+google_oauth2_credentials = kvutil.lazy_import('google.oauth2.credentials')
+google_auth_httplib2 = kvutil.lazy_import('google_auth_httplib2')
+httplib2 = kvutil.lazy_import('httplib2')
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# scopes of the apis we use
+GMAIL_SCOPES = [
+    'https://www.googleapis.com/auth/gmail.readonly',
+    'https://www.googleapis.com/auth/gmail.send',
+]
+CALENDAR_SCOPES = ['https://www.googleapis.com/auth/calendar']
+
+# default files - the account token and the OATH app credentials
+TOKEN_JSON = 'token.json'
+CREDENTIALS_JSON = 'credentials.json'
+
+# seconds we wait on a google api before giving up on a request
+HTTP_TIMEOUT = 30
+
+# loaded credentials - token filename -> credentials
+_credentials = dict()
+# built services - (api, version, token filename) -> service
+_services = dict()
+# the outbox worker thread and the main thread can both ask for a service
+_lock = threading.RLock()
+
+# what this process did - refreshes, browser flows and services built
+stats = {'refresh': 0, 'flow': 0, 'build': 0}
+
+
+def save_credentials(creds, file_token_json):
+    '''
+    save the credentials as json - temp file and rename so readers never see a partial file
+    '''
+    tmp_filename = file_token_json + '.tmp'
+    with open(tmp_filename, 'w') as t:
+        t.write(creds.to_json())
+    os.replace(tmp_filename, file_token_json)
+
+
+def import_pickle_token(pickle_filename, file_token_json):
+    '''
+    convert a token.pickle of earlier versions to the json token file - returns True when converted
+    '''
+    if not pickle_filename or not os.path.exists(pickle_filename) or os.path.exists(file_token_json):
+        return False
+    import pickle
+
+    with open(pickle_filename, 'rb') as t:
+        creds = pickle.load(t)
+    save_credentials(creds, file_token_json)
+    logger.info('import_pickle_token:converted:%s:to:%s', pickle_filename, file_token_json)
+    return True
+
+
+def load_credentials(scopes=None, file_token_json=None, file_credentials_json=None, pickle_filename=None):
+    '''
+    credentials for the token file - loaded and refreshed once per process
+
+    scopes - scopes the caller needs - the browser flow is run when the token does not have them
+    pickle_filename - token.pickle of earlier versions - converted when the token file does not exist
+    '''
+    file_token_json = file_token_json or TOKEN_JSON
+    file_credentials_json = file_credentials_json or CREDENTIALS_JSON
+    scopes = list(scopes or [])
+
+    with _lock:
+        creds = _credentials.get(file_token_json)
+        if creds is None:
+            import_pickle_token(pickle_filename, file_token_json)
+            if os.path.exists(file_token_json):
+                # scopes saved in the file are the ones granted
+                creds = google_oauth2_credentials.Credentials.from_authorized_user_file(file_token_json)
+
+        need_flow = creds is None or bool(creds.scopes and not creds.has_scopes(scopes))
+        if not need_flow and not creds.valid:
+            if creds.expired and creds.refresh_token:
+                logger.info('load_credentials:refreshing:%s', file_token_json)
+                creds.refresh(google_auth_requests.Request())
+                stats['refresh'] += 1
+                save_credentials(creds, file_token_json)
+            else:
+                need_flow = True
+
+        if need_flow:
+            # ask for everything this token already has and what the caller needs
+            all_scopes = sorted(set(scopes) | set((creds.scopes if creds else None) or []))
+            logger.info('load_credentials:browser flow:%s:scopes:%s', file_token_json, all_scopes)
+            flow = google_auth_oauthlib_flow.InstalledAppFlow.from_client_secrets_file(file_credentials_json, all_scopes)
+            creds = flow.run_local_server(port=0)
+            stats['flow'] += 1
+            save_credentials(creds, file_token_json)
+
+        _credentials[file_token_json] = creds
+        return creds
+
+
+def get_service(api, version, scopes=None, file_token_json=None, file_credentials_json=None, timeout=HTTP_TIMEOUT,
+                pickle_filename=None):
+    '''
+    api service (gmail v1, calendar v3) - built once per process and token file from the bundled discovery document
+    every request made with it shares the credentials and http connection
+    '''
+    file_token_json = file_token_json or TOKEN_JSON
+    key = (api, version, file_token_json)
+    with _lock:
+        if key not in _services:
+            creds = load_credentials(scopes, file_token_json, file_credentials_json, pickle_filename)
+            http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=timeout))
+            _services[key] = googleapiclient_discovery.build(api, version, http=http, static_discovery=True,
+                                                             cache_discovery=False)
+            stats['build'] += 1
+            logger.info('get_service:built:%s:%s:%s', api, version, file_token_json)
+        return _services[key]
+
+
+def clear_cache():
+    '''
+    forget the credentials and services of this process
+    '''
+    with _lock:
+        _credentials.clear()
+        _services.clear()
+
+
+# eof
@@ -1,7 +1,7 @@
 """
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version: 1.101
+@version: 1.104
 
 Library of tools used in general by KV
 """
@@ -13,6 +13,7 @@ import os
 import datetime
 import pprint
 import time
+import contextlib
 
 # moved datetime processing to its own module
 import kvdate
@@ -38,8 +39,8 @@ debug_file = False
 logger = logging.getLogger(__name__)
 
 # set the module version number
-AppVersion = "1.101"
-__version__ = "1.101"
+AppVersion = "1.104"
+__version__ = "1.104"
 HELP_KEYS = (
     "help",
     "helpall",
@@ -1418,6 +1419,89 @@ def filename_copy(src_filename: str, dst_filename: str) -> None:
     os.system(cmd)
 
 
+@contextlib.contextmanager
+def file_lock(fileobj, exclusive: bool = True):
+    """
+    hold an advisory lock on an open file object for the life of the with block
+
+    uses fcntl.flock on linux/mac and msvcrt.locking on windows (exclusive only)
+    other processes using file_lock on the same file wait until the lock is released
+
+        with open(filename, "a") as t, kvutil.file_lock(t):
+            t.write(data)
+    """
+    if os.name == "nt":
+        import msvcrt
+
+        # windows locks a byte range - lock the first byte of the file
+        pos = fileobj.tell()
+        fileobj.seek(0)
+        msvcrt.locking(fileobj.fileno(), msvcrt.LK_LOCK, 1)
+        fileobj.seek(pos)
+        try:
+            yield fileobj
+        finally:
+            fileobj.flush()
+            fileobj.seek(0)
+            msvcrt.locking(fileobj.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(fileobj.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield fileobj
+        finally:
+            fileobj.flush()
+            fcntl.flock(fileobj.fileno(), fcntl.LOCK_UN)
+
+
+class LazyModule(object):
+    """
+    stand-in for a module that is imported the first time one of its attributes is used
+
+    created through lazy_import - see that routine
+    """
+
+    def __init__(self, name: str) -> None:
+        object.__setattr__(self, "_lazy_name", name)
+        object.__setattr__(self, "_lazy_module", None)
+
+    def _lazy_load(self) -> Any:
+        module = object.__getattribute__(self, "_lazy_module")
+        if module is None:
+            import importlib
+
+            module = importlib.import_module(object.__getattribute__(self, "_lazy_name"))
+            object.__setattr__(self, "_lazy_module", module)
+        return module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._lazy_load(), attr)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        setattr(self._lazy_load(), attr, value)
+
+    def __repr__(self) -> str:
+        return "<LazyModule %s>" % object.__getattribute__(self, "_lazy_name")
+
+
+def lazy_import(name: str) -> Any:
+    """
+    return a module that is not imported until it is first used
+
+    used for heavy dependencies (google clients, openpyxl/xlrd/xlwt, matplotlib)
+    so runs that never touch them do not pay to import them at startup
+
+        kvgmailsendsimple = kvutil.lazy_import("kvgmailsendsimple")
+        get_column_letter = kvutil.lazy_import("openpyxl.utils").get_column_letter  # <- imports now
+
+    a module that is already imported is returned as is
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
 def filename_unique(
     filename: str | None = None,
     filename_href: dict | None = None,
@@ -1728,6 +1812,61 @@ def scriptinfo():
     When running code compiled by py2exe or cx_freeze, "source" contains
     the name of the originating Python script.
     If compiled by PyInstaller, "source" contains no meaningful information.
+
+    Same result as scriptinfo_inspect but does not build inspect.stack() (which reads
+    the source of every frame) - the script comes from __main__.__file__ / sys.argv[0]
+    and we only walk the frames when there is no script file (-c, interactive, or
+    a tool installed under sys.exec_prefix such as pytest)
+    """
+    trc = getattr(sys.modules.get("__main__"), "__file__", None) or ""
+    if not trc and sys.argv and sys.argv[0] not in ("", "-c", "-m"):
+        trc = sys.argv[0]
+    if not trc or trc.startswith("<") or trc.upper().startswith(sys.exec_prefix.upper()):
+        trc = _scriptinfo_outer_frame(sys._getframe(0))
+
+    # check if we have been compiled
+    if getattr(sys, "frozen", False):
+        scriptdir, scriptname = os.path.split(sys.executable)
+        return {"dir": scriptdir, "name": scriptname, "source": trc}
+
+    # from here on, we are in the interpreted case
+    scriptdir, trc = os.path.split(trc)
+    # if trc did not contain directory information,
+    # the current working directory is what we need
+    if not scriptdir:
+        scriptdir = os.getcwd()
+
+    return {"name": trc, "source": trc, "dir": scriptdir}
+
+
+def _scriptinfo_outer_frame(frame) -> str:
+    """
+    filename of the outermost frame that is not a system call (same rule as scriptinfo_inspect)
+    """
+    trc = ""
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith("<") and not filename.upper().startswith(sys.exec_prefix.upper()):
+            trc = filename
+        frame = frame.f_back
+    return trc
+
+
+def scriptinfo_inspect():
+    """
+    Returns a dictionary with information about the running top level Python
+    script:
+    ---------------------------------------------------------------------------
+    dir:    directory containing script or compiled executable
+    name:   name of script or executable
+    source: name of source code file
+    ---------------------------------------------------------------------------
+    "name" and "source" are identical if and only if running interpreted code.
+    When running code compiled by py2exe or cx_freeze, "source" contains
+    the name of the originating Python script.
+    If compiled by PyInstaller, "source" contains no meaningful information.
+
+    Original implementation (walks inspect.stack()) - kept to compare against scriptinfo
     """
 
     import os
@@ -1,18 +1,21 @@
 """
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version: 1.43
+@version: 1.45
 
 Library of tools used to process XLS/XLSX files
 """
 
-import openpyxl  # xlsx (read/write)
+import kvutil
+
+# excel libraries are imported the first time they are used
+openpyxl = kvutil.lazy_import("openpyxl")  # xlsx (read/write)
 
 # comment out below if we are XLSX ONLY
-import xlrd  # xls (read)
-import xlwt  # xls (write)
-from xlutils.copy import (
-    copy as xl_copy,
+xlrd = kvutil.lazy_import("xlrd")  # xls (read)
+xlwt = kvutil.lazy_import("xlwt")  # xls (write)
+xlutils_copy = kvutil.lazy_import(
+    "xlutils.copy"
 )  # xls(read copy over tool to enalve write)/ pip install xlutils
 
 import os  # determine if a file exists
@@ -34,7 +37,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 # global variables
-AppVersion = "1.43"
+AppVersion = "1.45"
 
 # set to true in kvxlsx.py
 XLSXONLY = False
@@ -295,6 +298,11 @@ def strip_xls_illegal_chars(value: str, debug: bool = False) -> str:
         return value
 
 
+# string dates in a column repeat and share a format - own parser with a bounded cache
+XLDATE_CACHE_SIZE = 4096
+_xldate_parser = kvdate.DatetimeParser(cache_size=XLDATE_CACHE_SIZE)
+
+
 def xldate_to_datetime(
     xldate: str | int | float, skipblank: bool = False
 ) -> datetime.datetime | Any:
@@ -316,7 +324,7 @@ def xldate_to_datetime(
             "converting xldate string to date using kvdate.datetime_from_str:%s",
             xldate,
         )
-        return kvdate.datetime_from_str(xldate, skipblank)
+        return _xldate_parser(xldate, skipblank)
     elif isinstance(xldate, (int, float)):
         # int - use the defined math to convert
         logger.debug("converting xldate float to date:%s", xldate)
@@ -3348,7 +3356,7 @@ def writelist2xls(
                     print("need to remove:", sheetname)
 
             # copy over
-            wb = xl_copy(wbin)
+            wb = xlutils_copy.copy(wbin)
             if debug:
                 print("Copy read in data to write out work book")
 
@@ -3379,7 +3387,7 @@ def writelist2xls(
 
                 # read in and copy
                 wbin = xlrd.open_workbook(xlsfile, formatting_info=True)
-                wb = xl_copy(wbin)
+                wb = xlutils_copy.copy(wbin)
                 wb_sheets = wb._Workbook__worksheets
 
                 if debug:
@@ -1,7 +1,7 @@
 '''
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version:  1.13
+@version:  1.22
 
 Take the output from "screenlogic > output.txt" 
 and parse that data and create append the output
@@ -10,13 +10,20 @@ to the output filename
 '''
 import os.path
 import os
+import sys
 import logging
-import re
 import datetime
 import kvutil
-import kvgmailsendsimple
+# gmail clients are only imported when we send a message
+kvgmailsendsimple = kvutil.lazy_import('kvgmailsendsimple')
 import kvdate
-# import poolapi
+import villaoccupancy
+import poolparse
+import poolstate
+import villanotify
+import villaoutbox
+# controller client is only imported when we talk to the pool directly
+poolscreenlogic = kvutil.lazy_import('poolscreenlogic')
 
 # CONSTANTS
 DAY_SECONDS = 60 * 60 * 24
@@ -52,7 +59,7 @@ logger = logging.getLogger(__name__)
 # application variables
 optiondictconfig = {
     'AppVersion' : {
-        'value': '1.13',
+        'value': '1.22',
         'description' : 'defines the version number for the app',
     },
     'debug' : {
@@ -78,22 +85,53 @@ optiondictconfig = {
         'value' : '192.168.8.141',
         'description' : 'IP address of the pool controller',
     },
+    'pool_port' : {
+        'value' : 80,
+        'type' : 'int',
+        'description' : 'port of the pool controller',
+    },
     'input_filename' : {
         'value' : 'output.txt',
         'description' : 'defines the name of the file generated from screenlogic',
     },
+    'output_layout' : {
+        'value' : 'auto',
+        'description' : 'defines the screenlogic output layout (poolparse.POOL_LAYOUTS name) - auto picks the layout that finds every field',
+    },
     'pool_filename' : {
         'value' : 'pool_temps.csv',
         'description' : 'defines the name of the file that holds the temperature readings',
     },
+    'state_filename' : {
+        'value' : 'pool_state.json',
+        'description' : 'defines the name of the file that holds the pool/spa heater states and the messages sent (see poolstate.py)',
+    },
+    'notify_state_filename' : {
+        'value' : 'pool_notify.json',
+        'description' : 'defines the name of the file that holds when each message was last sent and the messages held for a digest (see villanotify.py)',
+    },
+    'notify_digest_minutes' : {
+        'value' : 0,
+        'type' : 'int',
+        'description' : 'defines the minutes messages are held and sent together as one digest (0 - the messages of a run are sent together at the end of the run)',
+    },
+    'outbox_filename' : {
+        'value' : 'villa_outbox.json',
+        'description' : 'defines the file that holds the messages waiting to be sent by the outbox worker (see villaoutbox.py) - blank sends each message during the run',
+    },
+    'outbox_wait_seconds' : {
+        'value' : 20,
+        'type' : 'int',
+        'description' : 'defines the seconds we wait at the end of the run for the outbox worker - messages not sent stay queued for the next run',
+    },
     'pool_heater_filename' : {
         'value' : 'pool_heater.lck',
-        'description' : 'defines the name of the file that says we sent a message about pool heater being on',
+        'description' : 'defines the name of the lock file earlier versions used for the pool heater being on - imported into state_filename',
     },
     'pool_missing_filename' : {
 #        'value' : 'pool_missing.lck',
         'value' : None,  # not set - we want to alert spa team not pool team
-        'description' : 'defines the name of the file that says we sent a message about pool settings not being read',
+        'description' : 'defines if we message the pool team about pool settings not being read (and the lock file earlier versions used - imported into state_filename)',
     },
     'pool_heater_off_filename' : {
         'value' : 'pool_heater_off.lck',
@@ -122,11 +160,11 @@ optiondictconfig = {
     },
     'spa_heater_filename' : {
         'value' : 'spa_heater.lck',
-        'description' : 'defines the name of the file that says we sent a message about pool heater being on',
+        'description' : 'defines the name of the lock file earlier versions used for the spa heater being on - imported into state_filename',
     },
     'spa_missing_filename' : {
         'value' : 'spa_missing.lck',
-        'description' : 'defines the name of the file that says we sent a message about pool settings not being read',
+        'description' : 'defines if we message the spa team about pool settings not being read (and the lock file earlier versions used - imported into state_filename)',
     },
     'spa_heater_off_filename' : {
         'value' : 'spa_heater_off.lck',
@@ -174,6 +212,9 @@ optiondictconfig = {
 now = datetime.datetime.now()
 now_str = now.strftime('%Y-%m-%d:%H:%M:%S')
 
+# notification hub of this run (villanotify.py) - None sends each message as it is created
+hub = None
+
 
 
 def check_file_writable(fnm):
@@ -199,22 +240,14 @@ def read_pool_heater_allowable_file(input_file):
     if file exists, read in the file and convert each line to a date and build a list of dates
     that we will not flag the pool is enabled and attempt to turn it off
     '''
-    pool_heater_allowed = []
-    pool_heater_invalid_dates = []
-
     # no file - so no inputs
     if not os.path.exists(input_file):
         logger.info(input_file + ' not found')
-        return pool_heater_allowed, pool_heater_invalid_dates
+        return villaoccupancy.OccupancyIndex(), []
 
-    # get the file read in the lines and convert the string to date
-    with open(input_file, 'r') as file:
-        # Read each line in the file
-        for idx, line in enumerate(file):
-            try:
-                pool_heater_allowed.append(kvdate.datetime_from_str(line.strip()).date())
-            except Exception as e:
-                pool_heater_invalid_dates.append(f'{idx+1}|{line.strip()}|{e}')
+    # compiled date index (see villaoccupancy.py) - supports: date in pool_heater_allowed
+    pool_heater_allowed = villaoccupancy.load_dates_index(input_file)
+    pool_heater_invalid_dates = pool_heater_allowed.invalid
 
     logger.info(str(len(pool_heater_allowed)) + ' dates allowed to have pool enabled')
     return pool_heater_allowed, pool_heater_invalid_dates
@@ -248,101 +281,35 @@ def save_data_to_output(now_str, output_file, result_values, result_keys):
         logger.info('Appended record to: %s ', output_file)
         
     
-def read_parse_output_pool(input_file, output_file):
+def read_parse_output_pool(input_file, output_file, layout='auto'):
+    '''
+    parse the screenlogic output file (see poolparse.py) and save the results
 
-    # Using readlines()
-    file1 = open(input_file, 'r')
-    Lines = file1.readlines()
+    returns dict of the pool and spa settings - None when the file is too short
+    or a field is missing (the missing fields are logged)
+    '''
+    with open(input_file, 'r') as file1:
+        text = file1.read()
 
     # logging
+    line_count = len(text.splitlines())
     logger.info('Read in pool data from:  %s', input_file)
-    logger.info('Lines in this file:  %d', len(Lines))
+    logger.info('Lines in this file:  %d', line_count)
 
     # if the lines is not greater than 20 we did not get valid run
-    if len(Lines) < 20:
+    if line_count < 20:
         logger.info('Insufficient lines created - unable to parse file - EXITTING')
         return
-    
-    # Debugging
-    # print(Lines)
-    
-    # count on lines
-    count = 0
-    
-    # Strips the newline character
-    for line in Lines:
-        count += 1
-
-        # debugging
-        # print("Line{}: {}".format(count, line.strip()))
-
-        m = re.search('Pool temperature is last\s+(\d+)', line)
-        
-        # print( count, m, line )
-        if m:
-            pool_temp_last = m.group(1)
-            # print( pool_temp_last  )
-            
-            
-        m = re.search('Pool Heat Set Point:\s+(\d+)', line)
-
-        # print( count, m, line )
-        if m:
-            pool_temp_set = m.group(1)
-            # print( pool_temp_set )
-
-        m = re.search('Pool Heat:\s+(.+)', line)
-
-        # print( count, m, line )
-        if m:
-            pool_heat_set = m.group(1)
-            # print( pool_heat_set )
-
-
-        m = re.search('Pool Heat Mode:\s+(.+)', line)
-
-        # print( count, m, line )
-        if m:
-            pool_heat_mode = m.group(1)
-            # print( pool_heat_mode)
-
-
-        m = re.search('Spa temperature is last\s+(\d+)', line)
-
-        # print( count, m, line )
-        if m:
-            spa_temp_last = m.group(1)
-            # print( spa_temp_last )
-
 
-        m = re.search('Spa Heat Set Point:\s+(\d+)', line)
-
-        # print( count, m, line )
-        if m:
-            spa_temp_set = m.group(1)
-            # print( spa_temp_set )
-
-        m = re.search('Spa Heat:\s+(.+)', line)
-
-        # print( count, m, line )
-        if m:
-            spa_heat_set = m.group(1)
-            # print( spa_heat_set )
-        
-
-        m = re.search('Spa Heat Mode:\s+(.+)', line)
-
-        # print( count, m, line )
-        if m:
-            spa_heat_mode = m.group(1)
-            # print( spa_heat_mode )
+    # one pass over the file - stops once every field is found
+    pool_settings, missing, layout = poolparse.parse_pool_output(text, layout)
+    if missing:
+        logger.error('Fields not found in:  %s:layout:%s:missing:%s', input_file, layout, ','.join(missing))
+        return
 
-    
     # call routine to save out the results
-    result_keys = ['pool_temp_last','pool_temp_set','pool_heat_set','pool_heat_mode',
-                   'spa_temp_last','spa_temp_set','spa_heat_set','spa_heat_mode']
-    result_values = [pool_temp_last, pool_temp_set, pool_heat_set, pool_heat_mode,
-                     spa_temp_last, spa_temp_set, spa_heat_set, spa_heat_mode]
+    result_keys = poolparse.POOL_FIELDS
+    result_values = [pool_settings[x] for x in result_keys]
     save_data_to_output(now_str, output_file, result_values, result_keys)
     
 
@@ -354,45 +321,102 @@ def read_parse_output_pool(input_file, output_file):
         logger.info('Removed input file:  %s', input_file)
 
     # return what we just read in
-    return {
-        'pool_temp_last': pool_temp_last,
-        'pool_temp_set': pool_temp_set,
-        'pool_heat_set': pool_heat_set,
-        'pool_heat_mode': pool_heat_mode,
-        'spa_temp_last': spa_temp_last,
-        'spa_temp_set': spa_temp_set,
-        'spa_heat_set': spa_heat_set,
-        'spa_heat_mode': spa_heat_mode
-    }
-
-
-def read_direct_output_pool(ip, output_file):
+    return {x: pool_settings[x] for x in result_keys}
+
+
+def read_direct_output_pool(ip, output_file, port=80):
     '''
-    Read pool settings directly and save to output file
+    Read pool settings directly from the controller (poolscreenlogic.py) and save to output file
+
+    returns dict of the pool and spa settings - None when the controller could not be read
     '''
 
-    # read using the library
+    # read using the library - one connection for pool and spa
     try:
-        # result_values, result_keys = poolapi.main(ip)
-        print('ken')
+        pool_settings = poolscreenlogic.read_pool_settings(ip, port)
     except Exception as e:
         logger.info('Could not read values - EXITTING')
         logger.error(e)
+        return
         
     # save the results to the output file
+    result_keys = poolparse.POOL_FIELDS
+    result_values = [pool_settings[x] for x in result_keys]
     save_data_to_output(now_str, output_file, result_values, result_keys)
 
     # return dictoinary
     return dict(zip(result_keys, result_values))
 
-    
-def message_on_pool_state_change(pool_settings, optiondict, pool_heater_allowed):
+
+def turn_off_heat(optiondict, body):
+    '''
+    set the pool or spa heat mode to off on the controller - only when we talk to it directly
+    '''
+    if not (optiondict['direct_connect'] and optiondict['pool_ip']):
+        return False
+    try:
+        poolscreenlogic.set_heat_mode(optiondict['pool_ip'], body, poolscreenlogic.HEAT_MODE_OFF, optiondict['pool_port'])
+    except Exception as e:
+        logger.error('Could not turn off %s heat: %s', body, e)
+        return False
+    logger.info('Turned off %s heat', body)
+    return True
+
+def send_message(optiondict, team, key, subject, body, suppress_seconds=0):
+    '''
+    message the pool or spa team - published to the hub when we have one
+    key - names the event (pool_heater_on, spa_turn_off, ...) for dedupe and suppression
+    returns dict with the id of the message (the key when published to the hub)
+    '''
+    if hub is not None:
+        return hub.publish(key, subject, body, optiondict[team+'_email_from'], optiondict[team+'_email_to'], suppress_seconds)
+    return kvgmailsendsimple.gmail_send_simple_message(
+        optiondict[team+'_email_from'],
+        optiondict[team+'_email_to'],
+        subject,
+        body,
+        optiondict['scopes'],
+        optiondict['file_token_json'],
+        optiondict['file_credentials_json']
+    )
+
+def clear_messages(*keys):
+    '''
+    the condition behind these messages ended - the next one is sent right away
+    '''
+    if hub is not None:
+        hub.clear(*keys)
+
+def record_pool_state(state, pool_settings):
+    '''
+    record what we read this run - controller reading/missing and the pool/spa heater on/off
+    '''
+    state.set_state('controller', 'reading' if pool_settings else 'missing')
+    if pool_settings:
+        state.set_state('pool_heater', 'off' if pool_settings['pool_heat_mode'] == 'Off' else 'on')
+        state.set_state('spa_heater', 'off' if pool_settings['spa_heat_mode'] == 'Off' else 'on')
+
+
+def import_lock_files(state, optiondict):
+    '''
+    first run with a state file - carry over the lock files of earlier versions
+    '''
+    return poolstate.import_lock_files(
+        state,
+        devices={'pool_heater': (optiondict['pool_heater_filename'], 'on'),
+                 'spa_heater': (optiondict['spa_heater_filename'], 'on')},
+        alerts={'pool_missing': optiondict['pool_missing_filename'],
+                'spa_missing': optiondict['spa_missing_filename']})
+
+
+def message_on_pool_state_change(pool_settings, optiondict, pool_heater_allowed, state):
     ''' create an email when the state changes on pool heater
-    using a lock file to capture what the state currently is
+    using the state file (poolstate.py) to capture what the state was on the last run
 
     pool_settings - dict of values read in 
     optiondict - the options dictionary
-    pool_heater_invalid_dates - list of dates the pool is enabled to be on
+    pool_heater_allowed - list of dates the pool is enabled to be on
+    state - poolstate.PoolState of this run (record_pool_state already called)
 
     '''
 
@@ -406,13 +430,10 @@ def message_on_pool_state_change(pool_settings, optiondict, pool_heater_allowed)
             # we are not alerting on pool issues
             return
         
-        # check to see if thereis a pool not woking lock file
-        if os.path.isfile(optiondict['pool_missing_filename']):
-            # check the age/duraction of this file to see if we should send again
-            pool_days, pool_seconds = modification_days_and_seconds(optiondict['pool_missing_filename'])        
-
+        # check to see if we already sent the not reading message
+        if state.last_alert('pool_missing'):
             # if we have not met the next notification window - skip
-            if pool_seconds < FOUR_HOUR_SECONDS:
+            if state.alert_age('pool_missing') < FOUR_HOUR_SECONDS:
                 # take no action yet
                 return
 
@@ -421,44 +442,35 @@ def message_on_pool_state_change(pool_settings, optiondict, pool_heater_allowed)
             
         # create message that we are not currently reading pool settings
         # send message that heater is ON
-        msgid = kvgmailsendsimple.gmail_send_simple_message(
-            optiondict['pool_email_from'],
-            optiondict['pool_email_to'],
+        msgid = send_message(
+            optiondict, 'pool', 'pool_missing',
             optiondict['pool_email_subject']+'Not Reading Pool Settings',
-            optiondict['pool_email_body']+'Not Reading Pool Settings',
-            optiondict['scopes'],
-            optiondict['file_token_json'],
-            optiondict['file_credentials_json']
+            optiondict['pool_email_body']+'Not Reading Pool Settings'
         )
 
-        # create the lock file
-        with open(optiondict['pool_missing_filename'], 'w') as lock_file:
-            lock_file.write('Not Reading Pool Settings')
+        # remember when we sent it
+        state.record_alert('pool_missing', msgid['id'])
 
         # log message
-        logger.info('Not reading pool settings - sent message: %s and created file: %s', msgid['id'], optiondict['pool_missing_filename'])
+        logger.info('Not reading pool settings - sent message: %s', msgid['id'])
 
         # return - we have nothing to process
         return
-    elif optiondict['pool_missing_filename'] and os.path.exists(optiondict['pool_missing_filename']):
-        # we are getting data and we have a lock file that must now be removed
+    elif optiondict['pool_missing_filename'] and state.last_alert('pool_missing'):
+        # we are getting data and we told them we were not - clear the alert
 
         # send message that heater is off
-        msgid = kvgmailsendsimple.gmail_send_simple_message(
-            optiondict['pool_email_from'],
-            optiondict['pool_email_to'],
+        msgid = send_message(
+            optiondict, 'pool', 'pool_reading',
             optiondict['pool_email_subject']+'NOW Reading Pool Settings',
-            optiondict['pool_email_body']+'NOW Reading Pool Settings',
-            optiondict['scopes'],
-            optiondict['file_token_json'],
-            optiondict['file_credentials_json']
+            optiondict['pool_email_body']+'NOW Reading Pool Settings'
         )
 
-        # remove the lock file
-        os.remove(optiondict['pool_missing_filename'])
-        
+        # clear the not reading alert
+        state.clear_alert('pool_missing')
+
         # log message
-        logger.info('NOW reading pool settings - sent message: %s and removed file: %s', msgid['id'], optiondict['pool_missing_filename'])
+        logger.info('NOW reading pool settings - sent message: %s', msgid['id'])
         
     # is it ok to have the pool on
     if datetime.datetime.now().date() in pool_heater_allowed:
@@ -467,122 +479,103 @@ def message_on_pool_state_change(pool_settings, optiondict, pool_heater_allowed)
         pool_ok = '\nThe pool is NOT supposed to be on - automation should shut it off'
 
     # POOL
-    if os.path.isfile(optiondict['pool_heater_filename']):
-        # if there is a lock file - capture the informatoin about this lock file
-        pool_days, pool_seconds = modification_days_and_seconds(optiondict['pool_heater_filename'])        
+    if state.was('pool_heater') == 'on':
+        # the heater was on at the last run - how long it has been on
+        pool_days, pool_seconds = divmod(int(state.duration('pool_heater')), DAY_SECONDS)
 
         # and the pool heater is not ON message
-        # that the pool heater turned off and remove the lock file
+        # that the pool heater turned off
         if pool_settings['pool_heat_mode'] == 'Off':
             # send message that heater is off
-            msgid = kvgmailsendsimple.gmail_send_simple_message(
-                optiondict['pool_email_from'],
-                optiondict['pool_email_to'],
+            msgid = send_message(
+                optiondict, 'pool', 'pool_heater_off',
                 optiondict['pool_email_subject']+'OFF',
-                optiondict['pool_email_body']+'OFF',
-                optiondict['scopes'],
-                optiondict['file_token_json'],
-                optiondict['file_credentials_json']
+                optiondict['pool_email_body']+'OFF'
             )
 
-            # remove the lock file
-            os.remove(optiondict['pool_heater_filename'])
+            # remember when we sent it - the heater reminders start over the next time it is on
+            state.record_alert('pool_heater', msgid['id'], state='off')
+            clear_messages('pool_over_max', 'pool_turn_off')
 
             # log message
-            logger.info('Pool heater off - sent message: %s and removed file: %s', msgid['id'], optiondict['pool_heater_filename'])
+            logger.info('Pool heater off - sent message: %s - was on for %d minutes', msgid['id'], (state.now - state.device('pool_heater')['previous_since']) // 60)
 
         elif pool_days and pool_seconds < FIFTEEN_MIN_SECONDS:
-            # we have a lock file and we have had this lock file exist for more than a day
+            # the heater has been on for more than a day
             # we are greater than a day and less then the first 15 minutes of that next day
             # we should send another message about the duratoin of this being on
             # send message that heater is off
-            msgid = kvgmailsendsimple.gmail_send_simple_message(
-                optiondict['pool_email_from'],
-                optiondict['pool_email_to'],
+            msgid = send_message(
+                optiondict, 'pool', 'pool_still_on',
                 optiondict['pool_email_subject']+'STILL ON - DAY ' + str(pool_days),
-                'Pool Heater continues to be on' + pool_ok,
-                optiondict['scopes'],
-                optiondict['file_token_json'],
-                optiondict['file_credentials_json']
+                'Pool Heater continues to be on' + pool_ok
             )
 
             # log message
-            logger.info('Pool heater still ON [%s] days - sent message: %s and removed file: %s',
-                        pool_days, msgid['id'], optiondict['pool_heater_filename'])
+            logger.info('Pool heater still ON [%s] days - sent message: %s', pool_days, msgid['id'])
         elif pool_settings['pool_temp_set'] and float(pool_settings['pool_temp_set']) > MAX_POOL_TEMP:
             # SETTING GREATER THAN MAX
             # check to see if the pool setting exceeds our max
-            msgid = kvgmailsendsimple.gmail_send_simple_message(
-                optiondict['pool_email_from'],
-                optiondict['pool_email_to'],
+            msgid = send_message(
+                optiondict, 'pool', 'pool_over_max',
                 optiondict['pool_email_subject']+'SET OVER THE MAX SETTING:  ' + str(MAX_POOL_TEMP),
                 'Pool Heater set to a temp ' + pool_settings['pool_temp_set'] + ' that is over MAX SETTING:  ' + str(MAX_POOL_TEMP) + pool_ok,
-                optiondict['scopes'],
-                optiondict['file_token_json'],
-                optiondict['file_credentials_json']
+                suppress_seconds=FOUR_HOUR_SECONDS
             )
 
             # log message
-            logger.info('Pool heater set over max [%s/%s] days - sent message: %s and removed file: %s',
-                        pool_settings['pool_temp_set'], str(MAX_POOL_TEMP), msgid['id'], optiondict['pool_heater_filename'])
+            logger.info('Pool heater set over max [%s/%s] - sent message: %s',
+                        pool_settings['pool_temp_set'], str(MAX_POOL_TEMP), msgid['id'])
             
     else:
 
-        # if there is NO lock file
+        # the heater was not on at the last run
 
         # and the pool heater is ON message
-        # that the pool heater is now ON and create a lock file.
+        # that the pool heater is now ON
         if pool_settings['pool_heat_mode'] != 'Off':
             # send message that heater is ON
-            msgid = kvgmailsendsimple.gmail_send_simple_message(
-                optiondict['pool_email_from'],
-                optiondict['pool_email_to'],
+            msgid = send_message(
+                optiondict, 'pool', 'pool_heater_on',
                 optiondict['pool_email_subject']+'ON',
-                optiondict['pool_email_body']+'ON' + pool_ok,
-                optiondict['scopes'],
-                optiondict['file_token_json'],
-                optiondict['file_credentials_json']
+                optiondict['pool_email_body']+'ON' + pool_ok
             )
 
-            # create the lock file
-            with open(optiondict['pool_heater_filename'], 'w') as lock_file:
-                lock_file.write('Pool ON')
+            # remember when we sent it
+            state.record_alert('pool_heater', msgid['id'], state='on')
 
             # log message
-            logger.info('Pool heater ON - sent message: %s and created file: %s', msgid['id'], optiondict['pool_heater_filename'])
+            logger.info('Pool heater ON - sent message: %s', msgid['id'])
             
             # SETTING GREATER THAN MAX - only check when we just turned on the heat
             if pool_settings['pool_temp_set'] and float(pool_settings['pool_temp_set']) > MAX_POOL_TEMP:
                 # check to see if the pool setting exceeds our max
-                msgid = kvgmailsendsimple.gmail_send_simple_message(
-                    optiondict['pool_email_from'],
-                    optiondict['pool_email_to'],
+                msgid = send_message(
+                    optiondict, 'pool', 'pool_over_max',
                     optiondict['pool_email_subject']+'SET OVER THE MAX SETTING:  ' + str(MAX_POOL_TEMP),
                     'Pool Heater set to a temp ' + pool_settings['pool_temp_set'] + ' that is over MAX SETTING:  ' + str(MAX_POOL_TEMP) + pool_ok,
-                    optiondict['scopes'],
-                    optiondict['file_token_json'],
-                    optiondict['file_credentials_json']
+                    suppress_seconds=FOUR_HOUR_SECONDS
                 )
                 
                 # log message
-                logger.info('Pool heater set over max [%s/%s] days - sent message: %s and removed file: %s',
-                            pool_settings['pool_temp_set'], str(MAX_POOL_TEMP), msgid['id'], optiondict['pool_heater_filename'])
+                logger.info('Pool heater set over max [%s/%s] - sent message: %s',
+                            pool_settings['pool_temp_set'], str(MAX_POOL_TEMP), msgid['id'])
                 
-                # if we have the ability turn off the heat
-                if optiondict['pool_ip']:
-                    print('ken')
-                    # poolapi.set_pool_temp(ip=optiondict['pool_ip'], desired_temp=MAX_POOL_TEMP)
+                # the controller client only sets the heat mode - the set point is left as is
+                logger.info('Pool heater set over max - no set point change made - set point stays at %s',
+                            pool_settings['pool_temp_set'])
 
     # return back the message id or none
     return msgid
     
-def message_on_pool_turn_off(pool_settings, pool_heater_allowed, pool_heater_invalid_dates, optiondict):
+def message_on_pool_turn_off(pool_settings, pool_heater_allowed, pool_heater_invalid_dates, optiondict, state):
     ''' create an email when we are creating a file that will turn off the pool
 
     pool_settings - dict of values read in
     pool_heater_allowed - list of datetime values where the pool can be on
     pool_heater_invalid_dates - list of strings and row numbers where we could not convert the string to a date
     optiondict - the options dictionary
+    state - poolstate.PoolState of this run
 
     check to see if we have invalid date in the import file and message
     check to see if the list of valid dates for the pool to be on is today and if so - don't turn it off
@@ -592,16 +585,15 @@ def message_on_pool_turn_off(pool_settings, pool_heater_allowed, pool_heater_inv
     msgid = None
 
     ### invalid dates in read file
-    if pool_heater_invalid_dates:
+    if not pool_heater_invalid_dates:
+        clear_messages('pool_invalid_dates')
+    else:
         # send message that heater is ON
-        msgid = kvgmailsendsimple.gmail_send_simple_message(
-            optiondict['pool_email_from'],
-            optiondict['pool_email_to'],
+        msgid = send_message(
+            optiondict, 'pool', 'pool_invalid_dates',
             optiondict['pool_email_subject']+'Invalid date lines in file',
             'Unable to convert following lines in file to datetime strings:\n' + '\n'.join(pool_heater_invalid_dates),
-            optiondict['scopes'],
-            optiondict['file_token_json'],
-            optiondict['file_credentials_json']
+            suppress_seconds=DAY_SECONDS
         )
        
     ### NO DATA READ - POOL
@@ -624,26 +616,24 @@ def message_on_pool_turn_off(pool_settings, pool_heater_allowed, pool_heater_inv
     # the pool heater is ON message
     # create the file to have it turned off and message
     # that we are turning off the pool heater
-    if pool_settings['pool_heat_mode'] != 'Off':
+    if pool_settings['pool_heat_mode'] == 'Off':
+        clear_messages('pool_turn_off')
+    else:
         # send message that heater is ON
-        msgid = kvgmailsendsimple.gmail_send_simple_message(
-            optiondict['pool_email_from'],
-            optiondict['pool_email_to'],
+        msgid = send_message(
+            optiondict, 'pool', 'pool_turn_off',
             optiondict['pool_email_subject']+'Being Turned OFF',
             optiondict['pool_email_body']+'Being Turned OFF',
-            optiondict['scopes'],
-            optiondict['file_token_json'],
-            optiondict['file_credentials_json']
+            suppress_seconds=FOUR_HOUR_SECONDS
         )
 
-        # create the lock file
+        # create the file that has the pool turned off (read by the pool automation)
         with open(optiondict['pool_heater_off_filename'], 'w') as lock_file:
             lock_file.write('Pool ON being turned OFF')
+        state.record_alert('pool_heater_off', msgid['id'])
 
         # if we hvae the ability turn off the heat
-        if optiondict['pool_ip']:
-            print('ken')
-            # poolapi.set_heat_mode_pool(ip=optiondict['pool_ip'], mode=0)
+        turn_off_heat(optiondict, 'pool')
 
             
         # log message
@@ -653,12 +643,13 @@ def message_on_pool_turn_off(pool_settings, pool_heater_allowed, pool_heater_inv
     # return back the message id or none
     return msgid
     
-def message_on_spa_state_change(pool_settings, optiondict):
+def message_on_spa_state_change(pool_settings, optiondict, state):
     ''' create an email when the state changes on spa heater
-    using a lock file to capture what the state currently is
+    using the state file (poolstate.py) to capture what the state was on the last run
 
     pool_settings - dict of values read in 
     optiondict - the options dictionary
+    state - poolstate.PoolState of this run (record_pool_state already called)
 
     '''
 
@@ -670,13 +661,10 @@ def message_on_spa_state_change(pool_settings, optiondict):
             # we are not alerting on spa issues
             return
 
-        # check to see if thereis a pool not woking lock file
-        if os.path.isfile(optiondict['spa_missing_filename']):
-            # check the age/duraction of this file to see if we should send again
-            spa_days, spa_seconds = modification_days_and_seconds(optiondict['spa_missing_filename'])        
-
+        # check to see if we already sent the not reading message
+        if state.last_alert('spa_missing'):
             # if we have not met the next notification window - skip
-            if spa_seconds < FOUR_HOUR_SECONDS:
+            if state.alert_age('spa_missing') < FOUR_HOUR_SECONDS:
                 # take no action yet
                 return
 
@@ -686,143 +674,117 @@ def message_on_spa_state_change(pool_settings, optiondict):
 
         # create message that we are not currently reading pool settings
         # send message that heater is ON
-        msgid = kvgmailsendsimple.gmail_send_simple_message(
-            optiondict['spa_email_from'],
-            optiondict['spa_email_to'],
+        msgid = send_message(
+            optiondict, 'spa', 'spa_missing',
             optiondict['spa_email_subject']+'Not Reading Pool Settings',
-            optiondict['spa_email_body']+'Not Reading Pool Settings',
-            optiondict['scopes'],
-            optiondict['file_token_json'],
-            optiondict['file_credentials_json']
+            optiondict['spa_email_body']+'Not Reading Pool Settings'
         )
         
-        # create the lock file
-        with open(optiondict['spa_missing_filename'], 'w') as lock_file:
-            lock_file.write('Not Reading Pool Settings')
-            
+        # remember when we sent it
+        state.record_alert('spa_missing', msgid['id'])
+
         # log message
-        logger.info('Not reading pool settings - sent message: %s and created file: %s', msgid['id'], optiondict['spa_missing_filename'])
+        logger.info('Not reading pool settings - sent message: %s', msgid['id'])
 
         # return - we have nothing to process
         return
-    elif optiondict['spa_missing_filename'] and os.path.exists(optiondict['spa_missing_filename']):
-        # we are getting data and we have a lock file that must now be removed
+    elif optiondict['spa_missing_filename'] and state.last_alert('spa_missing'):
+        # we are getting data and we told them we were not - clear the alert
 
         # send message that heater is off
-        msgid = kvgmailsendsimple.gmail_send_simple_message(
-            optiondict['spa_email_from'],
-            optiondict['spa_email_to'],
+        msgid = send_message(
+            optiondict, 'spa', 'spa_reading',
             optiondict['spa_email_subject']+'NOW Reading Pool Settings',
-            optiondict['spa_email_body']+'NOW Reading Pool Settings',
-            optiondict['scopes'],
-            optiondict['file_token_json'],
-            optiondict['file_credentials_json']
+            optiondict['spa_email_body']+'NOW Reading Pool Settings'
         )
 
-        # remove the lock file
-        os.remove(optiondict['spa_missing_filename'])
+        # clear the not reading alert
+        state.clear_alert('spa_missing')
 
         # log message
-        logger.info('NOW reading pool settings - sent message: %s and removed file: %s', msgid['id'], optiondict['spa_missing_filename'])
+        logger.info('NOW reading pool settings - sent message: %s', msgid['id'])
         
             
     # SPA
-    if os.path.isfile(optiondict['spa_heater_filename']):
-        # if there is a lock file - capture the informatoin about this lock file
-        spa_days, spa_seconds = modification_days_and_seconds(optiondict['spa_heater_filename'])
+    if state.was('spa_heater') == 'on':
+        # the heater was on at the last run - how long it has been on
+        spa_days, spa_seconds = divmod(int(state.duration('spa_heater')), DAY_SECONDS)
         
         # and the spa heater is not ON message
-        # that the spa heater turned off and remove the lock file
+        # that the spa heater turned off
         if pool_settings['spa_heat_mode'] == 'Off':
             # send message that heater is off
-            msgid = kvgmailsendsimple.gmail_send_simple_message(
-                optiondict['spa_email_from'],
-                optiondict['spa_email_to'],
+            msgid = send_message(
+                optiondict, 'spa', 'spa_heater_off',
                 optiondict['spa_email_subject']+'OFF',
-                optiondict['spa_email_body']+'OFF',
-                optiondict['scopes'],
-                optiondict['file_token_json'],
-                optiondict['file_credentials_json']
+                optiondict['spa_email_body']+'OFF'
             )
 
-            # remove the lock file
-            os.remove(optiondict['spa_heater_filename'])
+            # remember when we sent it - the heater reminders start over the next time it is on
+            state.record_alert('spa_heater', msgid['id'], state='off')
+            clear_messages('spa_turn_off')
 
             # log message
-            logger.info('SPA heater off - sent message: %s and removed file: %s', msgid['id'], optiondict['spa_heater_filename'])
+            logger.info('SPA heater off - sent message: %s - was on for %d minutes', msgid['id'], (state.now - state.device('spa_heater')['previous_since']) // 60)
 
-        elif optiondict['spa_heater_off_filename'] and optiondict['spa_heater_off_hours'] and spa_seconds > optiondict['spa_heater_off_hours'] * 60 * 60:
+        elif optiondict['spa_heater_off_filename'] and optiondict['spa_heater_off_hours'] and state.duration('spa_heater') > optiondict['spa_heater_off_hours'] * 60 * 60:
             # we have a desire to turn off the spa because we defined two variable - filename and hours
             # and the spa has been on longer than that defined max time
             # so generate the file that causes the spa to be disabled
             # and send message that we are going to turn off the spa
             
             # send message that heater is ON
-            msgid = kvgmailsendsimple.gmail_send_simple_message(
-                optiondict['spa_email_from'],
-                optiondict['spa_email_to'],
+            msgid = send_message(
+                optiondict, 'spa', 'spa_turn_off',
                 optiondict['spa_email_subject']+'Being Turned OFF',
                 optiondict['spa_email_body']+'Being Turned OFF',
-                optiondict['scopes'],
-                optiondict['file_token_json'],
-                optiondict['file_credentials_json']
+                suppress_seconds=FOUR_HOUR_SECONDS
             )
 
-            # create the lock file
+            # create the file that has the spa turned off (read by the pool automation)
             with open(optiondict['spa_heater_off_filename'], 'w') as lock_file:
                 lock_file.write('SPA ON being turned OFF')
+            state.record_alert('spa_heater_off', msgid['id'])
 
             # if we hvae the ability turn off the heat
-            if optiondict['pool_ip']:
-                print('ken')
-                # poolapi.set_heat_mode_spa(ip=optiondict['pool_ip'], mode=0)
+            turn_off_heat(optiondict, 'spa')
 
             # log message
             logger.info('SPA heater on too long turning off SPA - sent message: %s and created file: %s', msgid['id'], optiondict['spa_heater_off_filename'])
             
         elif spa_days and spa_seconds < FIFTEEN_MIN_SECONDS:
-            # we have a lock file and we have had this lock file exist for more than a day
+            # the heater has been on for more than a day
             # we are greater than a day and less then the first 15 minutes of that next day
             # we should send another message about the duratoin of this being on
             # send message that heater is off
-            msgid = kvgmailsendsimple.gmail_send_simple_message(
-                optiondict['spa_email_from'],
-                optiondict['spa_email_to'],
+            msgid = send_message(
+                optiondict, 'spa', 'spa_still_on',
                 optiondict['spa_email_subject']+'STILL ON - DAY ' + str(spa_days),
-                'SPA Heater continues to be on',
-                optiondict['scopes'],
-                optiondict['file_token_json'],
-                optiondict['file_credentials_json']
+                'SPA Heater continues to be on'
             )
 
             # log message
-            logger.info('SPA heater still ON [%s] days - sent message: %s and removed file: %s',
-                        spa_days, msgid['id'], optiondict['spa_heater_filename'])
+            logger.info('SPA heater still ON [%s] days - sent message: %s', spa_days, msgid['id'])
             
     else:
 
-        # if there is NO lock file
+        # the heater was not on at the last run
 
         # and the spa heater is ON message
-        # that the spa heater is now ON and create a lock file.
+        # that the spa heater is now ON
         if pool_settings['spa_heat_mode'] != 'Off':
             # send message that heater is ON
-            msgid = kvgmailsendsimple.gmail_send_simple_message(
-                optiondict['spa_email_from'],
-                optiondict['spa_email_to'],
+            msgid = send_message(
+                optiondict, 'spa', 'spa_heater_on',
                 optiondict['spa_email_subject']+'ON',
-                optiondict['spa_email_body']+'ON',
-                optiondict['scopes'],
-                optiondict['file_token_json'],
-                optiondict['file_credentials_json']
+                optiondict['spa_email_body']+'ON'
             )
 
-            # create the lock file
-            with open(optiondict['spa_heater_filename'], 'w') as lock_file:
-                lock_file.write('SPA ON')
+            # remember when we sent it
+            state.record_alert('spa_heater', msgid['id'], state='on')
 
             # log message
-            logger.info('SPA heater ON - sent message: %s and created file: %s', msgid['id'], optiondict['spa_heater_filename'])
+            logger.info('SPA heater ON - sent message: %s', msgid['id'])
 
 
     # return back the message id or none
@@ -840,15 +802,33 @@ if __name__ == '__main__':
     # print header to show what is going on (convert this to a kvutil function:  kvutil.loggingStart(logger,optiondict))
     kvutil.loggingAppStart( logger, optiondict, kvutil.scriptinfo()['name'] )
 
-    # refresh the token - always do this as we don't always send an email
-    kvgmailsendsimple.gmail_refresh_token_take_no_action(
-            optiondict['pool_email_from'],
-            optiondict['scopes'],
-            optiondict['file_token_json'],
-            optiondict['file_credentials_json']
-    )
-    # log message
-    logger.info('Refreshed the gmail token')
+    if optiondict['outbox_filename']:
+        # messages are saved to the outbox and sent by a worker thread - a slow gmail never holds up the pool
+        # the worker refreshes the token first - always do this as we don't always send an email
+        outbox = villaoutbox.Outbox(optiondict['outbox_filename'])
+        worker = villaoutbox.start_worker(
+            outbox,
+            villaoutbox.gmail_send(optiondict['scopes'], optiondict['file_token_json'], optiondict['file_credentials_json']),
+            prepare=lambda: kvgmailsendsimple.gmail_service(
+                optiondict['pool_email_from'],
+                optiondict['scopes'],
+                optiondict['file_token_json'],
+                optiondict['file_credentials_json']
+            )
+        )
+        sender = outbox.sender()
+    else:
+        # refresh the token - always do this as we don't always send an email
+        kvgmailsendsimple.gmail_refresh_token_take_no_action(
+                optiondict['pool_email_from'],
+                optiondict['scopes'],
+                optiondict['file_token_json'],
+                optiondict['file_credentials_json']
+        )
+        # log message
+        logger.info('Refreshed the gmail token')
+        worker = None
+        sender = villanotify.gmail_sender(optiondict['scopes'], optiondict['file_token_json'], optiondict['file_credentials_json'])
         
     # process the pool file
     logger.info( "Call read and save pool data function" )
@@ -857,21 +837,33 @@ if __name__ == '__main__':
             logger.error('Direct connect enabled - no pool_ip defined')
             sys.exit(1)
 
-        pool_settings = read_direct_output_pool(optiondict['pool_ip'], optiondict['pool_filename'])
+        pool_settings = read_direct_output_pool(optiondict['pool_ip'], optiondict['pool_filename'], optiondict['pool_port'])
     else:
-        pool_settings = read_parse_output_pool(optiondict['input_filename'], optiondict['pool_filename'])
+        pool_settings = read_parse_output_pool(optiondict['input_filename'], optiondict['pool_filename'], optiondict['output_layout'])
 
     # POOL - capture valid dates for pool to be enabled
     pool_heater_allowed, pool_heater_invalid_dates = read_pool_heater_allowable_file(optiondict['pool_heater_allowed_filename'])
 
-    # POOL - determine if we need to message people
-    message_on_pool_state_change(pool_settings, optiondict, pool_heater_allowed)
-    
-    # SPA determine if we need to message people
-    message_on_spa_state_change(pool_settings, optiondict)
-    
-    # POOL - generate file to turn off pool
-    message_on_pool_turn_off(pool_settings, pool_heater_allowed, pool_heater_invalid_dates, optiondict)
+    # messages of this run go through the hub - sent together (or held for a digest) when we are done
+    # load the state of the last run - saved once when we are done - overlapping runs wait their turn
+    with villanotify.open_hub(optiondict['notify_state_filename'], sender, digest_seconds=optiondict['notify_digest_minutes']*60) as hub, \
+         poolstate.open_state(optiondict['state_filename']) as state:
+        if state.new:
+            import_lock_files(state, optiondict)
+        record_pool_state(state, pool_settings)
+
+        # POOL - determine if we need to message people
+        message_on_pool_state_change(pool_settings, optiondict, pool_heater_allowed, state)
+
+        # SPA determine if we need to message people
+        message_on_spa_state_change(pool_settings, optiondict, state)
+
+        # POOL - generate file to turn off pool
+        message_on_pool_turn_off(pool_settings, pool_heater_allowed, pool_heater_invalid_dates, optiondict, state)
+
+    # give the outbox worker a little time to send what this run queued
+    if worker is not None:
+        worker.stop(optiondict['outbox_wait_seconds'])
 
 # eof
 
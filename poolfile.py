@@ -1,7 +1,7 @@
 '''
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version:  1.13
+@version:  1.15
 
 Utility used to readn and write files from 
 
@@ -11,6 +11,7 @@ import os
 import logging
 import datetime
 import kvdate
+import villaoccupancy
 
 ### GLOBAL VARIABLES AND CONVERSIONS ###
 
@@ -20,22 +21,14 @@ def read_pool_heater_allowable_file(input_file, logger):
     if file exists, read in the file and convert each line to a date and build a list of dates
     that we will not flag the pool is enabled and attempt to turn it off
     '''
-    pool_heater_allowed = []
-    pool_heater_invalid_dates = []
-
     # no file - so no inputs
     if not os.path.exists(input_file):
         logger.info(input_file + ' not found')
-        return pool_heater_allowed, pool_heater_invalid_dates
-
-    # get the file read in the lines and convert the string to date
-    with open(input_file, 'r') as file:
-        # Read each line in the file
-        for idx, line in enumerate(file):
-            try:
-                pool_heater_allowed.append(kvdate.datetime_from_str(line.strip()).date())
-            except Exception as e:
-                pool_heater_invalid_dates.append(f'{idx+1}|{line.strip()}|{e}')
+        return villaoccupancy.OccupancyIndex(), []
+
+    # compiled date index (see villaoccupancy.py) - supports: date in pool_heater_allowed
+    pool_heater_allowed = villaoccupancy.load_dates_index(input_file)
+    pool_heater_invalid_dates = pool_heater_allowed.invalid
 
     logger.info(str(len(pool_heater_allowed)) + ' dates allowed to have pool enabled')
     return pool_heater_allowed, pool_heater_invalid_dates
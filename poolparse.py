@@ -0,0 +1,201 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Parse the output of "screenlogic > output.txt" into the pool and spa settings
+
+Each output layout is a table of (field, label pattern).  The table is
+compiled once into one pattern with a named group per field so the file
+is scanned a single time - the scan stops as soon as every field is
+found (the first occurrence of a field is used).  Fields that are not
+in the output are returned as a list instead of failing later.
+
+    values, missing, layout = poolparse.parse_pool_output(text)
+
+A new screenlogic output version is supported by adding its table to
+POOL_LAYOUTS - layout='auto' uses the first layout (newest first) that
+finds every field.
+
+    python poolparse.py bench_runs=2000      # benchmark against the per line re.search loop
+
+'''
+import re
+import glob
+import time
+
+import kvutil
+
+# set the module version number
+AppVersion = '1.00'
+
+# fields read from the output - in the order saved to pool_temps.csv
+POOL_FIELDS = ['pool_temp_last', 'pool_temp_set', 'pool_heat_set', 'pool_heat_mode',
+               'spa_temp_last', 'spa_temp_set', 'spa_heat_set', 'spa_heat_mode']
+
+# output layouts - name -> (field, regex with one capture group) - newest layout first
+#   spacing after a label does not cross the end of the line ([^\S\n] is \s without newline)
+POOL_LAYOUTS = {
+    'v1': (
+        ('pool_temp_last', r'Pool temperature is last[^\S\n]+(\d+)'),
+        ('pool_temp_set', r'Pool Heat Set Point:[^\S\n]+(\d+)'),
+        ('pool_heat_set', r'Pool Heat:[^\S\n]+(.+)'),
+        ('pool_heat_mode', r'Pool Heat Mode:[^\S\n]+(.+)'),
+        ('spa_temp_last', r'Spa temperature is last[^\S\n]+(\d+)'),
+        ('spa_temp_set', r'Spa Heat Set Point:[^\S\n]+(\d+)'),
+        ('spa_heat_set', r'Spa Heat:[^\S\n]+(.+)'),
+        ('spa_heat_mode', r'Spa Heat Mode:[^\S\n]+(.+)'),
+    ),
+}
+
+# compiled layouts - name -> (pattern, fields)
+_compiled_layouts = dict()
+
+
+def compile_layout(name):
+    '''
+    one pattern for the layout - each label becomes an alternative with a named group for its field
+    '''
+    compiled = _compiled_layouts.get(name)
+    if compiled is None:
+        table = POOL_LAYOUTS[name]
+        # the label group is unnamed - turn it into the named field group
+        pattern = '|'.join('(?:%s)' % label.replace('(', '(?P<%s>' % field, 1) for field, label in table)
+        compiled = (re.compile(pattern), [field for field, _ in table])
+        _compiled_layouts[name] = compiled
+    return compiled
+
+
+def parse_layout(text, name):
+    '''
+    scan the text once with a layout - returns (values dict, missing field list)
+    '''
+    pattern, fields = compile_layout(name)
+    values = dict()
+    for m in pattern.finditer(text):
+        field = m.lastgroup
+        if field not in values:
+            values[field] = m.group(field)
+            # stop once every field is found
+            if len(values) == len(fields):
+                break
+    return values, [x for x in fields if x not in values]
+
+
+def parse_pool_output(text, layout='auto'):
+    '''
+    parse screenlogic output
+
+    text - the file contents
+    layout - POOL_LAYOUTS name or auto (first layout that finds every field - else the one missing the fewest)
+
+    returns (values dict, missing field list, layout name used)
+    '''
+    if layout != 'auto':
+        values, missing = parse_layout(text, layout)
+        return values, missing, layout
+    best = None
+    for name in POOL_LAYOUTS:
+        values, missing = parse_layout(text, name)
+        if not missing:
+            return values, missing, name
+        if best is None or len(missing) < len(best[1]):
+            best = (values, missing, name)
+    return best
+
+
+def parse_pool_lines_legacy(lines):
+    '''
+    the original per line parser - eight re.search calls per line, the last occurrence wins
+    kept as the reference for the tests and benchmark - returns values dict (missing fields absent)
+    '''
+    values = dict()
+    for line in lines:
+        m = re.search(r'Pool temperature is last\s+(\d+)', line)
+        if m:
+            values['pool_temp_last'] = m.group(1)
+        m = re.search(r'Pool Heat Set Point:\s+(\d+)', line)
+        if m:
+            values['pool_temp_set'] = m.group(1)
+        m = re.search(r'Pool Heat:\s+(.+)', line)
+        if m:
+            values['pool_heat_set'] = m.group(1)
+        m = re.search(r'Pool Heat Mode:\s+(.+)', line)
+        if m:
+            values['pool_heat_mode'] = m.group(1)
+        m = re.search(r'Spa temperature is last\s+(\d+)', line)
+        if m:
+            values['spa_temp_last'] = m.group(1)
+        m = re.search(r'Spa Heat Set Point:\s+(\d+)', line)
+        if m:
+            values['spa_temp_set'] = m.group(1)
+        m = re.search(r'Spa Heat:\s+(.+)', line)
+        if m:
+            values['spa_heat_set'] = m.group(1)
+        m = re.search(r'Spa Heat Mode:\s+(.+)', line)
+        if m:
+            values['spa_heat_mode'] = m.group(1)
+    return values
+
+
+def bench_parse(filenames, runs=1000):
+    '''
+    time the legacy and compiled parsers over the sample files - returns dict of microseconds per file
+    '''
+    texts = []
+    for filename in filenames:
+        with open(filename, 'r') as t:
+            texts.append(t.read())
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        for text in texts:
+            parse_pool_lines_legacy(text.splitlines(keepends=True))
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        for text in texts:
+            parse_pool_output(text)
+    compiled = time.perf_counter() - start
+
+    count = runs * len(texts)
+    return {'files': len(texts), 'legacy_us': legacy / count * 1e6, 'compiled_us': compiled / count * 1e6}
+
+
+# ---------------------------------------------------------------------------
+if __name__ == '__main__':
+    # application variables
+    optiondictconfig = {
+        'AppVersion' : {
+            'value' : AppVersion,
+            'description' : 'defines the version number for the app',
+        },
+        'debug' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we are running in debug mode',
+        },
+        'sample_glob' : {
+            'value' : 'fixtures/screenlogic_*.txt',
+            'description' : 'defines the recorded screenlogic output files parsed by the benchmark',
+        },
+        'bench_runs' : {
+            'value' : 1000,
+            'type'  : 'int',
+            'description' : 'defines the number of times each sample file is parsed',
+        },
+    }
+
+    # capture the command line
+    optiondict = kvutil.kv_parse_command_line( optiondictconfig, debug=False )
+
+    filenames = sorted(glob.glob(optiondict['sample_glob']))
+    for filename in filenames:
+        with open(filename, 'r') as t:
+            values, missing, layout = parse_pool_output(t.read())
+        print(filename, ':layout:', layout, ':missing:', missing or 'none')
+    result = bench_parse(filenames, optiondict['bench_runs'])
+    print('Files:', result['files'], 'legacy us/file: %.1f' % result['legacy_us'], 'compiled us/file: %.1f' % result['compiled_us'])
+
+# eof
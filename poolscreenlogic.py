@@ -0,0 +1,311 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+asyncio client for the Pentair ScreenLogic protocol spoken by the pool controller (pool_ip)
+
+Reads the pool and spa temperatures, set points and heat modes in one
+connection and sets the heat mode of a body - replaces running the
+screenlogic command line, writing output.txt and parsing it (poolparse.py).
+
+Every message is an 8 byte little endian header - message id (H), message
+code (H), payload length (I) - followed by the payload.  Strings are a
+length (I) followed by the bytes padded to a 4 byte boundary.  A session is:
+
+    CONNECTSERVERHOST\\r\\n\\r\\n     - raw text that opens the session
+    challenge (14 -> 15)          - the controller answers with its mac address
+    local login (27 -> 28)
+    pool status (12526 -> 12527)  - air temp, bodies (pool/spa), circuits, chemistry
+    set heat mode (12538 -> 12539)
+
+    settings = poolscreenlogic.read_pool_settings('192.168.8.141')
+    poolscreenlogic.set_heat_mode('192.168.8.141', 'pool', poolscreenlogic.HEAT_MODE_OFF)
+
+poolscreenlogicsim.py has a local controller to test against.
+
+'''
+import struct
+import asyncio
+import logging
+
+import kvutil
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# controller port and the text that opens a session
+SCREENLOGIC_PORT = 80
+CONNECT_STRING = b'CONNECTSERVERHOST\r\n\r\n'
+
+# message header - message id, message code, payload length
+HEADER_FMT = '<HHI'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+
+# message codes - the answer is the request code + 1
+CODE_CHALLENGE = 14
+CODE_LOGIN = 27
+CODE_POOL_STATUS = 12526
+CODE_SET_HEAT_MODE = 12538
+
+# error answers
+CODE_ERRORS = {
+    13: 'login rejected',
+    30: 'unknown request',
+    31: 'bad parameter',
+}
+
+# login constants
+LOGIN_SCHEMA = 348
+LOGIN_CONNECTION_TYPE = 0
+LOGIN_CLIENT_VERSION = 'Android'
+LOGIN_PASSWORD = '0000000000000000'
+LOGIN_PID = 2
+
+# bodies of water - body type in the status and the set heat mode request
+BODY_TYPES = {'pool': 0, 'spa': 1}
+
+# heat modes (set and reported) and heat status (what is running now)
+HEAT_MODE_OFF = 0
+HEAT_MODES = {0: 'Off', 1: 'Solar', 2: 'Solar Preferred', 3: 'Heater', 4: "Don't Change"}
+HEAT_STATUS = {0: 'Off', 1: 'Solar', 2: 'Heater', 3: 'Both'}
+
+
+class ScreenLogicError(Exception):
+    '''
+    the controller answered with an error, an unexpected message or closed the connection
+    '''
+    pass
+
+
+def encode_string(value):
+    '''
+    length (I) and the bytes padded to a 4 byte boundary
+    '''
+    data = value.encode('utf-8')
+    return struct.pack('<I', len(data)) + data + b'\x00' * (-len(data) % 4)
+
+
+def decode_string(payload, offset=0):
+    '''
+    string at offset - returns (string, offset after the padding)
+    '''
+    (length,) = struct.unpack_from('<I', payload, offset)
+    offset += 4
+    value = payload[offset:offset + length].decode('utf-8')
+    return value, offset + length + (-length % 4)
+
+
+def encode_message(code, payload=b'', message_id=0):
+    return struct.pack(HEADER_FMT, message_id, code, len(payload)) + payload
+
+
+async def read_message(reader):
+    '''
+    next message - returns (message id, code, payload)
+    '''
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+        message_id, code, length = struct.unpack(HEADER_FMT, header)
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError as e:
+        raise ScreenLogicError('connection closed by the controller') from e
+    return message_id, code, payload
+
+
+def login_payload():
+    return (struct.pack('<II', LOGIN_SCHEMA, LOGIN_CONNECTION_TYPE) + encode_string(LOGIN_CLIENT_VERSION)
+            + encode_string(LOGIN_PASSWORD) + struct.pack('<I', LOGIN_PID))
+
+
+def decode_pool_status(payload):
+    '''
+    pool status answer - returns dict:
+        air_temp
+        bodies - dict body type -> {current_temp, heat_status, heat_set_point, cool_set_point, heat_mode}
+        circuits - dict circuit id -> state
+        ph, orp, saturation, salt_ppm
+    '''
+    offset = 0
+    ok, freeze_mode, remotes, pool_delay, spa_delay, cleaner_delay = struct.unpack_from('<IBBBBB', payload, offset)
+    # 3 unused bytes follow the delays
+    offset += 12
+    air_temp, body_count = struct.unpack_from('<iI', payload, offset)
+    offset += 8
+    bodies = dict()
+    for _ in range(min(body_count, len(BODY_TYPES))):
+        body_type, current_temp, heat_status, heat_set_point, cool_set_point, heat_mode = struct.unpack_from('<Iiiiii', payload, offset)
+        offset += 24
+        bodies[body_type] = {'current_temp': current_temp, 'heat_status': heat_status, 'heat_set_point': heat_set_point,
+                             'cool_set_point': cool_set_point, 'heat_mode': heat_mode}
+    (circuit_count,) = struct.unpack_from('<I', payload, offset)
+    offset += 4
+    circuits = dict()
+    for _ in range(circuit_count):
+        circuit_id, state = struct.unpack_from('<II', payload, offset)
+        # color set, position, stagger and delay bytes follow
+        offset += 12
+        circuits[circuit_id] = state
+    ph, orp, saturation, salt = struct.unpack_from('<iiii', payload, offset)
+    return {'ok': ok, 'freeze_mode': freeze_mode, 'air_temp': air_temp, 'bodies': bodies, 'circuits': circuits,
+            'ph': ph / 100.0, 'orp': orp, 'saturation': saturation / 100.0, 'salt_ppm': salt * 50}
+
+
+def encode_pool_status(air_temp, bodies, circuits=None, ph=7.4, orp=700, saturation=0.0, salt_ppm=3100):
+    '''
+    build a pool status answer - the inverse of decode_pool_status (used by the simulator)
+    '''
+    payload = struct.pack('<IBBBBB3x', 1, 0, 0, 0, 0, 0) + struct.pack('<iI', air_temp, len(bodies))
+    for body_type, body in sorted(bodies.items()):
+        payload += struct.pack('<Iiiiii', body_type, body['current_temp'], body['heat_status'], body['heat_set_point'],
+                               body['cool_set_point'], body['heat_mode'])
+    circuits = circuits or dict()
+    payload += struct.pack('<I', len(circuits))
+    for circuit_id, state in sorted(circuits.items()):
+        payload += struct.pack('<IIBBBB', circuit_id, state, 0, 0, 0, 0)
+    payload += struct.pack('<iiiiiii', round(ph * 100), orp, round(saturation * 100), salt_ppm // 50, 0, 0, 0)
+    return payload
+
+
+def pool_settings_from_status(status):
+    '''
+    the pool_settings dict pool.py works with (poolparse.POOL_FIELDS - string values like the parsed output)
+    '''
+    settings = dict()
+    for name, body_type in BODY_TYPES.items():
+        body = status['bodies'][body_type]
+        settings[name + '_temp_last'] = str(body['current_temp'])
+        settings[name + '_temp_set'] = str(body['heat_set_point'])
+        settings[name + '_heat_set'] = HEAT_STATUS.get(body['heat_status'], str(body['heat_status']))
+        settings[name + '_heat_mode'] = HEAT_MODES.get(body['heat_mode'], str(body['heat_mode']))
+    return settings
+
+
+class ScreenLogicClient(object):
+    '''
+    one connection to the controller
+
+        async with ScreenLogicClient(ip) as client:
+            status = await client.get_status()
+            await client.set_heat_mode('spa', HEAT_MODE_OFF)
+    '''
+
+    def __init__(self, ip, port=SCREENLOGIC_PORT, timeout=10.0):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.mac = None
+        self.message_id = 0
+
+    async def connect(self):
+        '''
+        open the connection, answer the challenge and log in
+        '''
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.ip, self.port), self.timeout)
+        try:
+            self.writer.write(CONNECT_STRING)
+            payload = await self.request(CODE_CHALLENGE)
+            self.mac, _ = decode_string(payload)
+            await self.request(CODE_LOGIN, login_payload())
+        except BaseException:
+            await self.close()
+            raise
+        logger.debug('connect:logged in:%s:%s:mac:%s', self.ip, self.port, self.mac)
+        return self
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = self.reader = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def request(self, code, payload=b''):
+        '''
+        send a request and return the payload of its answer
+        '''
+        self.message_id = (self.message_id + 1) % 0x10000
+        self.writer.write(encode_message(code, payload, self.message_id))
+        await self.writer.drain()
+        _, answer_code, answer = await asyncio.wait_for(read_message(self.reader), self.timeout)
+        if answer_code != code + 1:
+            raise ScreenLogicError('request %d answered with %d (%s)' % (code, answer_code, CODE_ERRORS.get(answer_code, 'unexpected')))
+        return answer
+
+    async def get_status(self):
+        return decode_pool_status(await self.request(CODE_POOL_STATUS, struct.pack('<I', 0)))
+
+    async def set_heat_mode(self, body, mode):
+        '''
+        body - pool or spa, mode - HEAT_MODES key
+        '''
+        await self.request(CODE_SET_HEAT_MODE, struct.pack('<III', 0, BODY_TYPES[body], mode))
+
+
+async def async_read_pool_settings(ip, port=SCREENLOGIC_PORT, timeout=10.0):
+    async with ScreenLogicClient(ip, port, timeout) as client:
+        return pool_settings_from_status(await client.get_status())
+
+
+async def async_set_heat_mode(ip, body, mode, port=SCREENLOGIC_PORT, timeout=10.0):
+    async with ScreenLogicClient(ip, port, timeout) as client:
+        await client.set_heat_mode(body, mode)
+
+
+def read_pool_settings(ip, port=SCREENLOGIC_PORT, timeout=10.0):
+    '''
+    pool and spa settings in one connection - dict of poolparse.POOL_FIELDS
+    '''
+    return asyncio.run(async_read_pool_settings(ip, port, timeout))
+
+
+def set_heat_mode(ip, body, mode, port=SCREENLOGIC_PORT, timeout=10.0):
+    '''
+    set the heat mode of the pool or spa
+    '''
+    asyncio.run(async_set_heat_mode(ip, body, mode, port, timeout))
+
+
+# ---------------------------------------------------------------------------
+if __name__ == '__main__':
+    # application variables
+    optiondictconfig = {
+        'AppVersion' : {
+            'value' : AppVersion,
+            'description' : 'defines the version number for the app',
+        },
+        'debug' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we are running in debug mode',
+        },
+        'pool_ip' : {
+            'value' : '192.168.8.141',
+            'description' : 'IP address of the pool controller',
+        },
+        'pool_port' : {
+            'value' : SCREENLOGIC_PORT,
+            'type'  : 'int',
+            'description' : 'port of the pool controller',
+        },
+    }
+
+    # capture the command line
+    optiondict = kvutil.kv_parse_command_line( optiondictconfig, debug=False )
+
+    for key, value in read_pool_settings(optiondict['pool_ip'], optiondict['pool_port']).items():
+        print(key, ':', value)
+
+# eof
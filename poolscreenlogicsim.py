@@ -0,0 +1,154 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Local stand-in for the ScreenLogic pool controller (see poolscreenlogic.py)
+
+Answers the connect string, challenge, login, pool status and set heat mode
+messages over tcp on localhost from an in memory pool and spa.  The server
+runs its own event loop in a thread so code that calls the synchronous
+poolscreenlogic functions (pool.py) can be tested against it.  Heat mode
+changes are applied to the in memory bodies so later reads see them, and
+latency, a rejected login or a dropped connection can be injected.
+
+    with ScreenLogicSimulator() as sim:
+        settings = poolscreenlogic.read_pool_settings('127.0.0.1', sim.port)
+
+'''
+import copy
+import struct
+import asyncio
+import threading
+import logging
+
+import poolscreenlogic as sl
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# the controller we stand in for
+SIM_MAC = '00-C0-33-31-A7-12'
+
+# pool off, spa heating
+DEFAULT_BODIES = {
+    sl.BODY_TYPES['pool']: {'current_temp': 74, 'heat_status': 0, 'heat_set_point': 80, 'cool_set_point': 100, 'heat_mode': 0},
+    sl.BODY_TYPES['spa']: {'current_temp': 99, 'heat_status': 2, 'heat_set_point': 102, 'cool_set_point': 104, 'heat_mode': 3},
+}
+DEFAULT_CIRCUITS = {500: 1, 501: 0, 502: 0, 503: 0, 505: 1}
+
+
+class ScreenLogicSimulator(object):
+    '''
+    in memory pool controller served over tcp on localhost
+    '''
+
+    def __init__(self, bodies=None, air_temp=61, latency=0.0, port=0):
+        self.bodies = copy.deepcopy(bodies or DEFAULT_BODIES)
+        self.circuits = dict(DEFAULT_CIRCUITS)
+        self.air_temp = air_temp
+        self.latency = latency
+        self.port = port
+        # error injection
+        self.reject_login = False
+        self.drop_after = None
+        # connections opened and every request handled - message code
+        self.connections = 0
+        self.calls = []
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.server = self.loop.run_until_complete(self.start_server())
+            self.port = self.server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.shutdown())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        logger.debug('start:listening:%d', self.port)
+        return self
+
+    async def start_server(self):
+        return await asyncio.start_server(self.handle, '127.0.0.1', self.port)
+
+    async def shutdown(self):
+        # connections still open (a slow answer) are cancelled before the loop closes
+        tasks = [x for x in asyncio.all_tasks() if x is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.server.close()
+        await self.server.wait_closed()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def call_counts(self):
+        return {code: self.calls.count(code) for code in set(self.calls)}
+
+    def answer(self, code, payload):
+        '''
+        the answer (code, payload) to a request
+        '''
+        if code == sl.CODE_CHALLENGE:
+            return code + 1, sl.encode_string(SIM_MAC)
+        if code == sl.CODE_LOGIN:
+            if self.reject_login:
+                return 13, b''
+            return code + 1, b''
+        if code == sl.CODE_POOL_STATUS:
+            return code + 1, sl.encode_pool_status(self.air_temp, self.bodies, self.circuits)
+        if code == sl.CODE_SET_HEAT_MODE:
+            if len(payload) != 12:
+                return 31, b''
+            _, body_type, mode = struct.unpack('<III', payload)
+            if body_type not in self.bodies or mode not in sl.HEAT_MODES:
+                return 31, b''
+            self.bodies[body_type]['heat_mode'] = mode
+            self.bodies[body_type]['heat_status'] = 0 if mode == sl.HEAT_MODE_OFF else 2
+            return code + 1, b''
+        return 30, b''
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            connect = await reader.readexactly(len(sl.CONNECT_STRING))
+            if connect != sl.CONNECT_STRING:
+                return
+            while True:
+                message_id, code, payload = await sl.read_message(reader)
+                self.calls.append(code)
+                if self.drop_after is not None and len(self.calls) > self.drop_after:
+                    return
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                answer_code, answer = self.answer(code, payload)
+                writer.write(sl.encode_message(answer_code, answer, message_id))
+                await writer.drain()
+        except (sl.ScreenLogicError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# eof
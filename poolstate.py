@@ -0,0 +1,192 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Persistent state for pool.py - replaces the pool/spa lock files
+
+pool.py used the presence and mtime of lock files (pool_heater.lck,
+spa_heater.lck, pool_missing.lck, spa_missing.lck) to remember what it
+saw on the last run and when it last sent a message.  Each run now loads
+one json file (pool_state.json), works on it in memory and saves it once:
+
+  devices - name -> state, since (when it moved to this state), previous,
+            previous_since and checked (last run that saw it)
+  alerts  - name -> at (when sent), msgid and any detail the caller adds
+
+Times are seconds since the epoch.  The file is read and written while
+holding a lock on pool_state.json.lck, so overlapping runs take turns, and it
+is written to a temp file and renamed so a reader never sees a partial
+file.  If the run fails part way nothing is saved.
+
+    with poolstate.open_state('pool_state.json') as state:
+        previous = state.set_state('spa_heater', 'on')
+        if state.changed('spa_heater'):
+            state.record_alert('spa_heater', msgid)
+
+'''
+import os
+import json
+import time
+import contextlib
+import logging
+
+import kvutil
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# layout version saved in the file
+STATE_VERSION = 1
+
+# extension of the lock file kept next to the state file
+LOCK_EXT = '.lck'
+
+
+def read_state(filename):
+    '''
+    read the state file - None when missing or unreadable
+    '''
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'r') as t:
+            data = json.load(t)
+    except (OSError, ValueError) as e:
+        logger.warning('read_state:unable to read:%s:%s', filename, e)
+        return None
+    if data.get('version') != STATE_VERSION:
+        logger.warning('read_state:unknown version:%s:%s', filename, data.get('version'))
+        return None
+    return data
+
+
+def write_state(filename, data):
+    '''
+    save the state - temp file and rename so readers never see a partial file
+    '''
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as t:
+        json.dump(data, t, indent=1, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+
+class PoolState(object):
+    '''
+    device states and alerts for one run - now is the run time used for every change
+    '''
+
+    def __init__(self, data=None, now=None):
+        self.now = time.time() if now is None else now
+        self.data = data or {'version': STATE_VERSION, 'devices': dict(), 'alerts': dict()}
+        # true when the file did not exist (or could not be read)
+        self.new = data is None
+        self.dirty = self.new
+
+    def device(self, name):
+        return self.data['devices'].get(name)
+
+    def state(self, name, default=None):
+        rec = self.device(name)
+        return rec['state'] if rec else default
+
+    def set_state(self, name, state, since=None):
+        '''
+        record the state seen this run - returns the state before this run (None when new)
+        since - when the state started (default: now) - used when importing
+        '''
+        rec = self.device(name)
+        self.dirty = True
+        if rec and rec['state'] == state:
+            rec['checked'] = self.now
+            return state
+        self.data['devices'][name] = {
+            'state': state,
+            'since': self.now if since is None else since,
+            'checked': self.now,
+            'previous': rec['state'] if rec else None,
+            'previous_since': rec['since'] if rec else None,
+        }
+        return rec['state'] if rec else None
+
+    def changed(self, name):
+        '''
+        true when the device moved to its state in this run
+        '''
+        rec = self.device(name)
+        return bool(rec) and rec['since'] == self.now
+
+    def was(self, name, default=None):
+        '''
+        the state before this run
+        '''
+        rec = self.device(name)
+        if not rec:
+            return default
+        if self.changed(name):
+            return rec['previous'] if rec['previous'] is not None else default
+        return rec['state']
+
+    def duration(self, name):
+        '''
+        seconds the device has been in its state - 0 when unknown
+        '''
+        rec = self.device(name)
+        return self.now - rec['since'] if rec else 0
+
+    def last_alert(self, name):
+        return self.data['alerts'].get(name)
+
+    def alert_age(self, name):
+        '''
+        seconds since the alert was sent - None when it never was
+        '''
+        alert = self.last_alert(name)
+        return self.now - alert['at'] if alert else None
+
+    def record_alert(self, name, msgid=None, at=None, **detail):
+        self.data['alerts'][name] = dict(detail, at=self.now if at is None else at, msgid=msgid)
+        self.dirty = True
+
+    def clear_alert(self, name):
+        if self.data['alerts'].pop(name, None) is not None:
+            self.dirty = True
+
+
+def import_lock_files(state, devices=None, alerts=None):
+    '''
+    seed a new state from the lock files of earlier versions - the file mtime is when it started
+
+    devices - dict of device name -> (lock filename, state the file means)
+    alerts - dict of alert name -> lock filename
+    returns the names imported
+    '''
+    imported = []
+    for name, (filename, value) in (devices or dict()).items():
+        if filename and os.path.isfile(filename) and state.device(name) is None:
+            state.set_state(name, value, since=os.path.getmtime(filename))
+            imported.append(name)
+    for name, filename in (alerts or dict()).items():
+        if filename and os.path.isfile(filename) and state.last_alert(name) is None:
+            state.record_alert(name, at=os.path.getmtime(filename), imported=filename)
+            imported.append(name)
+    if imported:
+        logger.info('import_lock_files:imported:%s', ','.join(imported))
+    return imported
+
+
+@contextlib.contextmanager
+def open_state(filename, now=None):
+    '''
+    load the state under the lock, hand it to the with block and save it once when the block succeeds
+    '''
+    with open(filename + LOCK_EXT, 'a+') as lck, kvutil.file_lock(lck):
+        state = PoolState(read_state(filename), now)
+        yield state
+        if state.dirty:
+            write_state(filename, state.data)
+
+
+# eof
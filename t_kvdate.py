@@ -0,0 +1,92 @@
+import unittest
+import kvdate
+import villastartup as vstart
+
+"""
+"""
+
+
+class TestKvDate(unittest.TestCase):
+    """Unit tests for kvdate.datetime_from_str and DatetimeParser."""
+
+    def test_datetime_from_str_p01_matches_legacy(self):
+        """ compiled table, fast path and cache convert the same as the original """
+        values = vstart.datetime_strings(900, block=7)
+        values += ['10-Jan-2024', '10-Jan-24', '10-Jan-24 10:30', '10-Jan-2024 10:30', '2024-01-02T03:04:05Z',
+                   '12/10/2025  11:31:00 PM', '1/2/2024 7:05', '20240102', '1/2/24']
+        parser = kvdate.DatetimeParser(cache_size=16)
+        for value in values + values[::-1]:
+            expected = kvdate.datetime_from_str_legacy(value)
+            self.assertEqual(kvdate.datetime_from_str(value), expected, value)
+            self.assertEqual(parser(value), expected, value)
+        self.assertGreater(parser.fast_hits, 0)
+        self.assertLessEqual(len(parser.cache), 16)
+
+    def test_datetime_from_str_f01_errors(self):
+        """ strings that do not convert raise - blanks and non strings handled as before """
+        parser = kvdate.DatetimeParser(cache_size=4)
+        parser('1/2/2024')
+        for value in ['13/45/2024', 'not a date', '']:
+            with self.assertRaises(Exception):
+                kvdate.datetime_from_str_legacy(value)
+            with self.assertRaises(Exception):
+                parser(value)
+        self.assertEqual(parser('  ', skipblank=True), '  ')
+        self.assertIsNone(parser(None, skipblank=True))
+        self.assertEqual(parser(5), 5)
+        with self.assertRaises(Exception):
+            parser(5, force_conversion=True)
+
+    def test_datetime64_column_p01(self):
+        """ column converted in one pass - same as strptime - bad values flagged instead of raising """
+        import numpy as np
+        values = ['2024-01-02 03:04:05', '2024-02-30 00:00:00', 'bad', '2024-1-2 3:04:05', '', '1969-07-20 20:17:00']
+        self.assertEqual(kvdate.detect_datetime_format(values), '%Y-%m-%d %H:%M:%S')
+        dates, errors = kvdate.datetime64_column(values)
+        self.assertEqual(errors.tolist(), [False, True, True, False, True, False])
+        self.assertEqual(dates[3], np.datetime64('2024-01-02T03:04:05'))
+        self.assertEqual(dates[5], np.datetime64('1969-07-20T20:17:00'))
+        # explicit format not in the table (pool_temps.csv now_str) and two digit years
+        dates, errors = kvdate.datetime64_column(['2024-01-02:03:04:05'], '%Y-%m-%d:%H:%M:%S')
+        self.assertEqual(dates[0], np.datetime64('2024-01-02T03:04:05'))
+        values = vstart.datetime_strings(200, block=50)
+        dates, errors = kvdate.datetime64_column(values)
+        self.assertFalse(errors.any())
+        self.assertEqual(dates.astype('datetime64[us]').tolist(),
+                         [kvdate.datetime_from_str(x) for x in values])
+
+    def test_utc_offset_p01_dst_boundaries(self):
+        """ transition table matches pytz through the 2024 spring forward gap and fall back fold """
+        import datetime
+        import pytz
+        pt = pytz.timezone('America/Los_Angeles')
+        for start in (datetime.datetime(2024, 3, 9, 22), datetime.datetime(2024, 11, 2, 22),
+                      datetime.datetime(2023, 12, 31, 20)):
+            for minutes in range(0, 8 * 60, 10):
+                dt = start + datetime.timedelta(minutes=minutes)
+                for is_dst in (False, True):
+                    self.assertEqual(kvdate.utc_offset(dt, 'America/Los_Angeles', is_dst),
+                                     pt.utcoffset(dt, is_dst=is_dst), (dt, is_dst))
+        self.assertEqual(kvdate.utc_offset(datetime.datetime(2024, 3, 10, 1, 59, 59), 'America/Los_Angeles'),
+                         datetime.timedelta(hours=-8))
+        self.assertEqual(kvdate.utc_offset(datetime.datetime(2024, 3, 10, 3), 'America/Los_Angeles'),
+                         datetime.timedelta(hours=-7))
+
+    def test_utc_offset_f01_ambiguous(self):
+        """ is_dst None raises in the gap and the fold - google_time_convert keeps the pytz behavior """
+        import datetime
+        import villacalendar
+        for dt in (datetime.datetime(2024, 3, 10, 2, 30), datetime.datetime(2024, 11, 3, 1, 30)):
+            with self.assertRaises(ValueError):
+                kvdate.utc_offset(dt, 'America/Los_Angeles', is_dst=None)
+        self.assertEqual(villacalendar.google_time_convert(datetime.datetime(2024, 11, 3, 12)),
+                         '2024-11-03T12:00:00-08:00')
+        self.assertEqual(villacalendar.google_time_convert(datetime.datetime(2024, 3, 10, 12)),
+                         '2024-03-10T12:00:00-07:00')
+        self.assertIs(kvdate.get_timezone('America/Los_Angeles'), kvdate.get_timezone('America/Los_Angeles'))
+        with self.assertRaises(ValueError):
+            kvdate.utc_offset(datetime.datetime(2024, 1, 1), 'Not/AZone')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import kvgoogleauth
+import kvgmailsendsimple
+import villacalendar
+import tempfile
+import shutil
+import datetime
+import pickle
+import json
+import os
+from unittest import mock
+
+import httplib2
+from google.oauth2.credentials import Credentials
+
+"""
+"""
+
+def expired_credentials():
+    """ credentials that need a refresh - granted gmail and calendar """
+    return Credentials(token='old-token', refresh_token='refresh-token', client_id='client', client_secret='secret',
+                       token_uri='https://oauth2.googleapis.com/token',
+                       scopes=kvgoogleauth.GMAIL_SCOPES + kvgoogleauth.CALENDAR_SCOPES,
+                       expiry=datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+
+
+def fake_refresh(creds, request):
+    creds.token = 'new-token'
+    creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+
+class TestKvGoogleAuth(unittest.TestCase):
+    """Unit tests for the shared google credentials and services."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.token = os.path.join(self.tmpdir, 'token.json')
+        kvgoogleauth.clear_cache()
+        for key in kvgoogleauth.stats:
+            kvgoogleauth.stats[key] = 0
+
+    def tearDown(self):
+        kvgoogleauth.clear_cache()
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_service_p01_one_refresh_no_fetch(self):
+        """ gmail and calendar on one token - one refresh and nothing fetched to build the services """
+        with open(self.token, 'w') as t:
+            t.write(expired_credentials().to_json())
+        with mock.patch.object(Credentials, 'refresh', autospec=True, side_effect=fake_refresh) as refresh, \
+             mock.patch.object(httplib2.Http, 'request', side_effect=AssertionError('http request made')):
+            gmail = kvgmailsendsimple.gmail_service('villa@example.com', file_token_json=self.token)
+            calendar = villacalendar.get_cal_service(self.token)
+            self.assertIs(kvgmailsendsimple.gmail_service('villa@example.com', file_token_json=self.token), gmail)
+            self.assertIs(villacalendar.get_cal_service(self.token), calendar)
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(kvgoogleauth.stats, {'refresh': 1, 'flow': 0, 'build': 2})
+        with open(self.token) as t:
+            self.assertEqual(json.load(t)['token'], 'new-token')
+
+    def test_get_cal_service_p01_shared_token_keeps_pickle(self):
+        """ calendar opted in to the gmail token - one refresh and the token.pickle is left alone """
+        pickle_filename = os.path.join(self.tmpdir, 'token.pickle')
+        with open(pickle_filename, 'wb') as t:
+            pickle.dump(expired_credentials(), t)
+        with open(self.token, 'w') as t:
+            t.write(expired_credentials().to_json())
+        with mock.patch.object(villacalendar, 'TOKEN_PICKLE_FILENAME', pickle_filename), \
+             mock.patch.object(Credentials, 'refresh', autospec=True, side_effect=fake_refresh) as refresh:
+            kvgmailsendsimple.gmail_service('villa@example.com', file_token_json=self.token)
+            villacalendar.get_cal_service(self.token)
+        self.assertEqual(refresh.call_count, 1)
+        self.assertTrue(os.path.isfile(pickle_filename))
+
+    def test_load_credentials_p01_pickle_converted(self):
+        pickle_filename = os.path.join(self.tmpdir, 'token.pickle')
+        with open(pickle_filename, 'wb') as t:
+            pickle.dump(expired_credentials(), t)
+        with mock.patch.object(Credentials, 'refresh', autospec=True, side_effect=fake_refresh):
+            creds = kvgoogleauth.load_credentials(kvgoogleauth.CALENDAR_SCOPES, self.token, pickle_filename=pickle_filename)
+        self.assertEqual(creds.token, 'new-token')
+        with open(self.token) as t:
+            self.assertEqual(json.load(t)['refresh_token'], 'refresh-token')
+
+
+if __name__ == '__main__':
+    unittest.main()
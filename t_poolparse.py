@@ -0,0 +1,67 @@
+import unittest
+import poolparse
+import glob
+import os
+import random
+
+"""
+"""
+
+SAMPLE_GLOB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'screenlogic_*.txt')
+
+# lines that look like output but are not fields
+NOISE = ['Pool Heat', 'Spa Heat Set Point: none', 'Pool temperature is last', 'Circuit 505 (Pool) is on',
+         '', '    ', 'Spa Heater Mode Off', 'pool heat: Off', 'Air temperature is 58']
+
+
+class TestPoolParse(unittest.TestCase):
+    """Unit tests for the compiled screenlogic output parser."""
+
+    def setUp(self):
+        self.samples = []
+        for filename in sorted(glob.glob(SAMPLE_GLOB)):
+            with open(filename, 'r') as t:
+                self.samples.append(t.read())
+
+    def test_parse_p01_samples_match_legacy(self):
+        self.assertTrue(self.samples)
+        for text in self.samples:
+            values, missing, layout = poolparse.parse_pool_output(text)
+            self.assertEqual(layout, 'v1')
+            self.assertEqual(missing, [])
+            self.assertEqual(values, poolparse.parse_pool_lines_legacy(text.splitlines(keepends=True)))
+            self.assertEqual(sorted(values), sorted(poolparse.POOL_FIELDS))
+
+    def test_parse_p02_fuzz(self):
+        """ shuffled, noisy, crlf and truncated output - same values as the legacy parser and the dropped fields reported """
+        rnd = random.Random(20)
+        for _ in range(300):
+            lines = rnd.choice(self.samples).splitlines()
+            rnd.shuffle(lines)
+            for _ in range(rnd.randint(0, 5)):
+                lines.insert(rnd.randint(0, len(lines)), rnd.choice(NOISE))
+            if rnd.random() < 0.5:
+                lines = lines[:rnd.randint(0, len(lines))]
+            text = ('\r\n' if rnd.random() < 0.3 else '\n').join(lines)
+            values, missing, layout = poolparse.parse_pool_output(text)
+            legacy = poolparse.parse_pool_lines_legacy(text.splitlines())
+            self.assertEqual({k: v.rstrip('\r') for k, v in values.items()}, legacy)
+            self.assertEqual(missing, [x for x in poolparse.POOL_FIELDS if x not in legacy])
+
+    def test_parse_p03_layout(self):
+        """ a new layout is picked by auto when the current one misses fields """
+        table = [(field, label.replace('Pool', 'Pool Body', 1)) for field, label in poolparse.POOL_LAYOUTS['v1']]
+        poolparse.POOL_LAYOUTS['test'] = tuple(table)
+        try:
+            text = self.samples[0].replace('Pool ', 'Pool Body ')
+            values, missing, layout = poolparse.parse_pool_output(text)
+            self.assertEqual((layout, missing), ('test', []))
+            self.assertEqual(values, poolparse.parse_pool_output(self.samples[0])[0])
+            self.assertEqual(len(poolparse.parse_pool_output(text, 'v1')[1]), 4)
+        finally:
+            del poolparse.POOL_LAYOUTS['test']
+            poolparse._compiled_layouts.pop('test', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import asyncio
+import poolscreenlogic as sl
+import poolscreenlogicsim as sim
+import poolparse
+
+"""
+poolscreenlogic client against the local controller stand-in
+"""
+
+
+class TestPoolScreenLogic(unittest.TestCase):
+    """Unit tests for the asyncio ScreenLogic client."""
+
+    def setUp(self):
+        self.sim = sim.ScreenLogicSimulator().start()
+
+    def tearDown(self):
+        self.sim.stop()
+
+    def test_read_pool_settings_p01(self):
+        """ pool and spa read in one connection - same fields and values as the parsed output """
+        settings = sl.read_pool_settings('127.0.0.1', self.sim.port, timeout=5)
+        self.assertEqual(sorted(settings), sorted(poolparse.POOL_FIELDS))
+        self.assertEqual(settings, {'pool_temp_last': '74', 'pool_temp_set': '80', 'pool_heat_set': 'Off', 'pool_heat_mode': 'Off',
+                                    'spa_temp_last': '99', 'spa_temp_set': '102', 'spa_heat_set': 'Heater', 'spa_heat_mode': 'Heater'})
+        self.assertEqual(self.sim.connections, 1)
+        self.assertEqual(self.sim.calls, [sl.CODE_CHALLENGE, sl.CODE_LOGIN, sl.CODE_POOL_STATUS])
+
+    def test_set_heat_mode_p01(self):
+        sl.set_heat_mode('127.0.0.1', 'spa', sl.HEAT_MODE_OFF, self.sim.port, timeout=5)
+        settings = sl.read_pool_settings('127.0.0.1', self.sim.port, timeout=5)
+        self.assertEqual((settings['spa_heat_mode'], settings['spa_heat_set']), ('Off', 'Off'))
+        with self.assertRaises(sl.ScreenLogicError):
+            sl.set_heat_mode('127.0.0.1', 'spa', 9, self.sim.port, timeout=5)
+
+    def test_status_p01_round_trip(self):
+        status = sl.decode_pool_status(sl.encode_pool_status(58, self.sim.bodies, self.sim.circuits, ph=7.52, saturation=-0.12, salt_ppm=3150))
+        self.assertEqual(status['bodies'], self.sim.bodies)
+        self.assertEqual(status['circuits'], self.sim.circuits)
+        self.assertEqual((status['air_temp'], status['ph'], status['saturation'], status['salt_ppm']), (58, 7.52, -0.12, 3150))
+
+    def test_errors_p01(self):
+        """ rejected login, dropped connection and a slow controller raise """
+        self.sim.reject_login = True
+        with self.assertRaises(sl.ScreenLogicError):
+            sl.read_pool_settings('127.0.0.1', self.sim.port, timeout=5)
+        self.sim.reject_login = False
+        self.sim.drop_after = len(self.sim.calls) + 2
+        with self.assertRaises(sl.ScreenLogicError):
+            sl.read_pool_settings('127.0.0.1', self.sim.port, timeout=5)
+        self.sim.drop_after = None
+        self.sim.latency = 0.5
+        with self.assertRaises(asyncio.TimeoutError):
+            sl.read_pool_settings('127.0.0.1', self.sim.port, timeout=0.1)
+
+    def test_concurrent_p01(self):
+        async def run():
+            return await asyncio.gather(*[sl.async_read_pool_settings('127.0.0.1', self.sim.port, 5) for _ in range(5)])
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(x == results[0] for x in results))
+        self.assertEqual(self.sim.connections, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import poolstate
+import tempfile
+import shutil
+import json
+import os
+import multiprocessing
+
+"""
+"""
+
+def bump_counter(filename, count):
+    """
+    Worker that adds one to a counter in the state - used to test overlapping runs
+    """
+    for _ in range(count):
+        with poolstate.open_state(filename) as state:
+            alert = state.last_alert('counter')
+            state.record_alert('counter', count=(alert['count'] if alert else 0) + 1)
+
+
+class TestPoolState(unittest.TestCase):
+    """Unit tests for the pool state store."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'pool_state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_state_p01_transitions(self):
+        """ state since only moves on a change - durations are exact across runs """
+        with poolstate.open_state(self.filename, now=1000.0) as state:
+            self.assertTrue(state.new)
+            self.assertIsNone(state.set_state('spa_heater', 'on'))
+            self.assertTrue(state.changed('spa_heater'))
+            self.assertIsNone(state.was('spa_heater'))
+        with poolstate.open_state(self.filename, now=4600.0) as state:
+            self.assertFalse(state.new)
+            self.assertEqual(state.set_state('spa_heater', 'on'), 'on')
+            self.assertFalse(state.changed('spa_heater'))
+            self.assertEqual(state.duration('spa_heater'), 3600.0)
+        with poolstate.open_state(self.filename, now=5000.0) as state:
+            self.assertEqual(state.set_state('spa_heater', 'off'), 'on')
+            self.assertEqual(state.was('spa_heater'), 'on')
+            self.assertEqual(state.device('spa_heater')['previous_since'], 1000.0)
+            state.record_alert('spa_heater', 'msg1', state='off')
+        with open(self.filename) as t:
+            data = json.load(t)
+        self.assertEqual(data['devices']['spa_heater']['since'], 5000.0)
+        self.assertEqual(data['alerts']['spa_heater'], {'at': 5000.0, 'msgid': 'msg1', 'state': 'off'})
+
+    def test_state_p02_failed_run_not_saved(self):
+        with poolstate.open_state(self.filename, now=1.0) as state:
+            state.set_state('controller', 'reading')
+        with self.assertRaises(RuntimeError):
+            with poolstate.open_state(self.filename, now=2.0) as state:
+                state.set_state('controller', 'missing')
+                raise RuntimeError('email failed')
+        self.assertEqual(poolstate.read_state(self.filename)['devices']['controller']['state'], 'reading')
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+    def test_import_lock_files_p01(self):
+        lockfile = os.path.join(self.tmpdir, 'spa_heater.lck')
+        with open(lockfile, 'w') as t:
+            t.write('SPA ON')
+        os.utime(lockfile, (500.0, 500.0))
+        with poolstate.open_state(self.filename, now=2300.0) as state:
+            imported = poolstate.import_lock_files(state, devices={'spa_heater': (lockfile, 'on'), 'pool_heater': ('missing.lck', 'on')},
+                                                   alerts={'spa_missing': None})
+            self.assertEqual(imported, ['spa_heater'])
+            state.set_state('spa_heater', 'on')
+            self.assertEqual(state.was('spa_heater'), 'on')
+            self.assertEqual(state.duration('spa_heater'), 1800.0)
+
+    def test_open_state_p01_overlapping_runs(self):
+        """ runs that overlap take turns - no update is lost """
+        workers = [multiprocessing.Process(target=bump_counter, args=(self.filename, 25)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(poolstate.read_state(self.filename)['alerts']['counter']['count'], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import villaecobeebatch as vbatch
+import villaecobeesim as sim
+
+"""
+"""
+
+
+class StandInEcobee(object):
+    """ the token side of pyecobee.Ecobee - pointed at the stand-in """
+
+    def __init__(self, standin):
+        self.standin = standin
+        self.access_token = standin.access_token
+
+    def refresh_tokens(self):
+        self.access_token = self.standin.new_tokens()['access_token']
+        return True
+
+
+class TestThermostatCommands(unittest.TestCase):
+    """Unit tests for the villaecobeebatch command builder."""
+
+    def setUp(self):
+        self.standin = sim.EcobeeStandIn().start()
+        self.ecobee = StandInEcobee(self.standin)
+        self.commands = vbatch.ThermostatCommands(self.ecobee, api_url=self.standin.url)
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def posts(self):
+        return [x for x in self.standin.calls if x[0] == 'POST' and x[1] == '/1/thermostat']
+
+    def test_send_p01_one_request_for_house(self):
+        """ same hold on every thermostat - one request - an off thermostat gets its own group """
+        for thermo in self.standin.thermostats:
+            self.commands.set_hold(thermo, 80.0, 55.0, 'indefinite')
+        results = self.commands.send()
+        self.assertEqual(results, {x['identifier']: True for x in self.standin.thermostats})
+        self.assertEqual(self.posts(), [('POST', '/1/thermostat', 'setHold')])
+        self.assertTrue(all(x['events'][0]['heatHoldTemp'] == 550 for x in self.standin.thermostats))
+
+        self.standin.thermostats[1]['settings']['hvacMode'] = 'off'
+        for thermo in self.standin.thermostats:
+            if thermo['settings']['hvacMode'] == 'off':
+                self.commands.set_hvac_mode(thermo, 'auto')
+            self.commands.resume_program(thermo, resume_all=True)
+        self.commands.send()
+        self.assertEqual(self.commands.requests_sent, 2)
+        self.assertEqual(self.standin.thermostats[1]['settings']['hvacMode'], 'auto')
+        self.assertTrue(all(x['events'] == [] for x in self.standin.thermostats))
+
+    def test_send_p02_partial_failure_falls_back(self):
+        """ a failing thermostat does not block the others - expired token refreshed once """
+        bad = self.standin.thermostats[1]['identifier']
+        self.standin.fail_identifiers.add(bad)
+        self.standin.expire_token()
+        for thermo in self.standin.thermostats:
+            self.commands.set_hold(thermo, 80.0, 55.0, 'indefinite')
+        results = self.commands.send()
+        self.assertEqual(results, {self.standin.thermostats[0]['identifier']: True, bad: False})
+        self.assertEqual([x[2] for x in self.posts()], ['auth-expired', 'error', 'setHold', 'error'])
+        self.assertEqual(self.standin.thermostats[1]['events'], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
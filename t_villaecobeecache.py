@@ -0,0 +1,88 @@
+import unittest
+import villaecobeecache as vcache
+import tempfile
+import shutil
+import json
+import os
+
+"""
+"""
+
+
+class FakeEcobee(object):
+    """ stands in for pyecobee.Ecobee - only what the cache touches """
+    access_token = 'token'
+    thermostats = []
+    authenticated = False
+
+    def refresh_tokens(self):
+        return False
+
+    def get_thermostats(self):
+        raise AssertionError('full fetch not expected')
+
+
+class CannedRevisionEcobee(vcache.RevisionGatedEcobee):
+    """ serves canned api responses and records what was requested """
+
+    def __init__(self, ecobee, cache_filename, revisions):
+        super().__init__(ecobee, cache_filename)
+        self.revisions = revisions
+        self.fetched = []
+
+    def _get(self, path, selection, retry=True):
+        if path == vcache.ECOBEE_SUMMARY_PATH:
+            return {'revisionList': ['%s:Therm %s:true:%s:0:%s:0' % (x, x, r[0], r[1])
+                                     for x, r in self.revisions.items()]}
+        ids = selection['selectionMatch'].split(',')
+        self.fetched.append(ids)
+        return {'thermostatList': [{'identifier': x, 'name': 'Therm ' + x, 'rev': self.revisions[x]}
+                                   for x in ids]}
+
+
+class TestRevisionGatedEcobee(unittest.TestCase):
+    """Unit tests for the villaecobeecache revision gate."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_filename = os.path.join(self.tmpdir, 'ecobee_revisions.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_revision_list_p01(self):
+        """ revision strings split into fields - names with colons survive """
+        revs = vcache.parse_revision_list(['111:Villa: Main:true:A:B:C:D'])
+        self.assertEqual(revs['111']['name'], 'Villa: Main')
+        self.assertEqual(revs['111']['thermostatRev'], 'A')
+        self.assertEqual(revs['111']['runtimeRev'], 'C')
+
+    def test_get_thermostats_p01_only_changed_fetched(self):
+        """ first run pulls all - later runs pull only changed thermostats """
+        revisions = {'111': ('t1', 'r1'), '222': ('t1', 'r1')}
+        ecobee = CannedRevisionEcobee(FakeEcobee(), self.cache_filename, revisions)
+        thermos = ecobee.get_thermostats()
+        self.assertEqual([x['identifier'] for x in thermos], ['111', '222'])
+        self.assertEqual(ecobee.fetched, [['111', '222']])
+
+        # new process - nothing changed
+        ecobee = CannedRevisionEcobee(FakeEcobee(), self.cache_filename, revisions)
+        thermos = ecobee.get_thermostats()
+        self.assertEqual(ecobee.fetched, [])
+        self.assertEqual(ecobee.served_from_cache, {'111', '222'})
+        self.assertEqual(ecobee.thermostats, thermos)
+        self.assertTrue(ecobee.authenticated)
+
+        # runtime changed on one thermostat
+        revisions['222'] = ('t1', 'r2')
+        ecobee = CannedRevisionEcobee(FakeEcobee(), self.cache_filename, revisions)
+        thermos = ecobee.get_thermostats()
+        self.assertEqual(ecobee.fetched, [['222']])
+        self.assertEqual(thermos[1]['rev'], ('t1', 'r2'))
+        self.assertEqual(ecobee.served_from_cache, {'111'})
+        with open(self.cache_filename) as t:
+            self.assertEqual(json.load(t)['revisions']['222'], {'thermostatRev': 't1', 'runtimeRev': 'r2'})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import villaecobeesim as sim
+import tempfile
+import shutil
+import os
+
+"""
+End to end runs of villaecobee.py against the local ecobee stand-in
+"""
+
+
+class TestVillaEcobeeSim(unittest.TestCase):
+    """End to end tests of villaecobee through the stand-in server."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.standin = sim.EcobeeStandIn().start()
+
+    def tearDown(self):
+        self.standin.stop()
+        shutil.rmtree(self.workdir)
+
+    def posts(self, result):
+        return [x for x in result['calls'] if x[0] == 'POST' and x[1] == '/1/thermostat']
+
+    def test_vacant_p01_holds_set_once(self):
+        """ vacant villa - first run sets holds in one request, next run sees them and does nothing """
+        sim.setup_workdir(self.workdir, self.standin, 'vacant')
+        result = sim.run_villaecobee(self.standin, self.workdir, ['sethold_hour=-1'])
+        self.assertEqual(result['exit_code'], 0)
+        self.assertEqual(len(self.posts(result)), 1)
+        self.assertTrue(all(x['events'] for x in self.standin.thermostats))
+        self.assertTrue(os.path.isfile(os.path.join(self.workdir, 'villatemps.txt')))
+
+        self.standin.tick()
+        result = sim.run_villaecobee(self.standin, self.workdir, ['sethold_hour=-1'])
+        self.assertEqual(self.posts(result), [])
+        self.assertEqual(result['emails'], [])
+
+    def test_arriving_p01_holds_removed_once(self):
+        """ arriving tomorrow - holds removed on the first run only - a thermostat turned off is put back """
+        sim.setup_workdir(self.workdir, self.standin, 'vacant')
+        sim.run_villaecobee(self.standin, self.workdir, ['sethold_hour=-1'])
+        sim.setup_workdir(self.workdir, self.standin, 'arriving')
+
+        self.standin.tick()
+        result = sim.run_villaecobee(self.standin, self.workdir, ['sethold_hour=-1'])
+        self.assertEqual([x[2] for x in self.posts(result)], ['resumeProgram'])
+        self.assertTrue(all(x['events'] == [] for x in self.standin.thermostats))
+
+        self.standin.tick()
+        result = sim.run_villaecobee(self.standin, self.workdir, ['sethold_hour=-1'])
+        self.assertEqual(self.posts(result), [])
+
+        # guest turns a thermostat off
+        self.standin.thermostats[0]['settings']['hvacMode'] = 'off'
+        self.standin.thermostats[0]['thermostatRev'] = 'guest'
+        result = sim.run_villaecobee(self.standin, self.workdir, ['sethold_hour=-1'])
+        self.assertEqual([x[2] for x in self.posts(result)], ['update'])
+        self.assertEqual(self.standin.thermostats[0]['settings']['hvacMode'], 'auto')
+
+    def test_expired_token_p01_refreshed(self):
+        """ an expired access token is refreshed and the run completes """
+        sim.setup_workdir(self.workdir, self.standin, 'occupied')
+        self.standin.expire_token()
+        result = sim.run_villaecobee(self.standin, self.workdir, ['sethold_hour=-1'])
+        self.assertEqual(result['exit_code'], 0)
+        self.assertIn(('POST', '/token', 'refresh_token'), result['calls'])
+
+
+if __name__ == "__main__":
+    unittest.main()
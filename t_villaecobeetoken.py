@@ -0,0 +1,65 @@
+import unittest
+import villaecobeetoken as vtoken
+import villaecobeesim as sim
+import tempfile
+import shutil
+import time
+import os
+
+"""
+"""
+
+
+class TestManagedTokenEcobee(unittest.TestCase):
+    """Unit tests for the villaecobeetoken config file token handling."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.standin = sim.EcobeeStandIn().start()
+        sim.setup_workdir(self.workdir, self.standin, 'vacant')
+        self.config_filename = os.path.join(self.workdir, 'ecobee.conf')
+
+    def tearDown(self):
+        self.standin.stop()
+        shutil.rmtree(self.workdir)
+
+    def token_calls(self):
+        return [x for x in self.standin.calls if x[1] == '/token']
+
+    def ecobee(self):
+        return vtoken.ManagedTokenEcobee(config_filename=self.config_filename, api_url=self.standin.url)
+
+    def test_init_p01_refresh_only_when_expiring(self):
+        """ unknown expiry refreshes once - later runs use the saved token """
+        ecobee = self.ecobee()
+        self.assertEqual(len(self.token_calls()), 1)
+        config = vtoken.read_config(self.config_filename)
+        self.assertEqual(config['ACCESS_TOKEN'], self.standin.access_token)
+        self.assertGreater(config[vtoken.EXPIRES_KEY], time.time() + 3000)
+        self.assertFalse(os.path.exists(self.config_filename + '.tmp'))
+
+        ecobee = self.ecobee()
+        self.assertEqual(len(self.token_calls()), 1)
+        self.assertEqual(ecobee.access_token, self.standin.access_token)
+
+        # inside the safety window
+        config[vtoken.EXPIRES_KEY] = time.time() + 60
+        vtoken.write_config(self.config_filename, config)
+        ecobee = self.ecobee()
+        self.assertEqual(len(self.token_calls()), 2)
+
+    def test_refresh_tokens_p01_uses_other_run_tokens(self):
+        """ a run that finds the tokens already refreshed by another run does not refresh again """
+        first = self.ecobee()
+        second = self.ecobee()
+        self.standin.expire_token()
+        self.assertTrue(first.refresh_tokens())
+        self.assertEqual(len(self.token_calls()), 2)
+        self.assertTrue(second.refresh_tokens())
+        self.assertEqual(len(self.token_calls()), 2)
+        self.assertEqual(second.access_token, self.standin.access_token)
+        self.assertEqual(second.refresh_token, self.standin.refresh_token)
+
+
+if __name__ == "__main__":
+    unittest.main()
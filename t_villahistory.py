@@ -0,0 +1,111 @@
+import unittest
+import villahistory
+import datetime
+import tempfile
+import shutil
+import os
+import multiprocessing
+
+"""
+"""
+
+def make_rows(start, count, step_minutes=240):
+    """
+    Build count polls worth of rows (two thermostats, three sensors) starting at start
+    """
+    rows = []
+    for idx in range(count):
+        dt_str = (start + datetime.timedelta(minutes=step_minutes * idx)).strftime(villahistory.HISTORY_DATEFMT)
+        hold = (idx % 2 == 0)
+        rows.append((dt_str, 'Villa Main', 'auto', 80.0, 55.0, 'Villa Main', 70.1 + idx % 7, 'false',
+                     'hold' if hold else None, '800' if hold else None, '550' if hold else None))
+        rows.append((dt_str, 'Villa Main', 'auto', 80.0, 55.0, 'Kitchen', 68.4, 'true',
+                     'hold' if hold else None, '800' if hold else None, '550' if hold else None))
+        rows.append((dt_str, 'Villa Bedrooms', 'heat', 78.5, 62.0, 'Villa Bedrooms', 66.0, 'false',
+                     None, None, None))
+    return rows
+
+
+def append_polls(textfile, segdir, start_day):
+    """
+    Worker that appends 20 polls to both backends - used to test overlapping runs
+    """
+    history = villahistory.open_history('both', textfile, segdir)
+    for idx in range(20):
+        history.append_rows(make_rows(datetime.datetime(2026, 3, start_day) + datetime.timedelta(minutes=idx), 1) * 50)
+
+
+class TestVillaHistory(unittest.TestCase):
+    """Unit tests for villahistory segment storage."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.textfile = os.path.join(self.tmpdir, 'villatemps.txt')
+        self.segdir = os.path.join(self.tmpdir, 'villatemps')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_segment_p01_export_matches_text(self):
+        """ segment export creates the same file the text backend creates """
+        rows = make_rows(datetime.datetime(2025, 12, 30), 40)
+        history = villahistory.open_history('both', self.textfile, self.segdir)
+        history.append_rows(rows[:30])
+        history.append_rows(rows[30:])
+        exportfile = os.path.join(self.tmpdir, 'export.txt')
+        cnt = villahistory.SegmentHistory(self.segdir).export_csv(exportfile)
+        self.assertEqual(cnt, len(rows))
+        with open(self.textfile) as t1, open(exportfile) as t2:
+            self.assertEqual(t1.read(), t2.read())
+
+    def test_segment_p02_monthly_segments(self):
+        """ rows are split into one segment per month """
+        history = villahistory.SegmentHistory(self.segdir)
+        history.append_rows(make_rows(datetime.datetime(2025, 12, 30), 40))
+        self.assertEqual(history.segment_keys(), ['2025-12', '2026-01'])
+
+    def test_segment_p03_read_window(self):
+        """ reading a window returns only records in that window with shared name ids """
+        history = villahistory.SegmentHistory(self.segdir)
+        for idx in range(365 * 6):
+            history.append_rows(make_rows(datetime.datetime(2025, 1, 1) + datetime.timedelta(hours=4 * idx), 1))
+        records, names = history.read(datetime.datetime(2025, 3, 1), datetime.datetime(2025, 3, 31, 23, 59))
+        self.assertEqual(len(records), 31 * 6 * 3)
+        self.assertEqual(set(names[x] for x in records['sensor']), {'Villa Main', 'Kitchen', 'Villa Bedrooms'})
+        records, names = history.read()
+        self.assertEqual(len(records), 365 * 6 * 3)
+
+    def test_segment_p04_read_rows_like_text(self):
+        """ read_rows returns the same dicts the text backend returns """
+        rows = make_rows(datetime.datetime(2026, 2, 1), 5)
+        villahistory.TextHistory(self.textfile).append_rows(rows)
+        villahistory.SegmentHistory(self.segdir).append_rows(rows)
+        self.assertEqual(villahistory.SegmentHistory(self.segdir).read_rows(),
+                         villahistory.TextHistory(self.textfile).read_rows())
+
+    def test_import_text_history_p01(self):
+        """ an existing text file loads into segments """
+        rows = make_rows(datetime.datetime(2026, 2, 1), 5)
+        villahistory.TextHistory(self.textfile).append_rows(rows)
+        history = villahistory.SegmentHistory(self.segdir)
+        self.assertEqual(villahistory.import_text_history(self.textfile, history), len(rows))
+        self.assertEqual(len(history.read()[0]), len(rows))
+
+    def test_append_rows_p01_overlapping_runs(self):
+        """ overlapping writers never interleave lines or write the header twice """
+        procs = [multiprocessing.Process(target=append_polls, args=(self.textfile, self.segdir, day))
+                 for day in range(1, 5)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        with open(self.textfile) as t:
+            lines = t.read().splitlines()
+        self.assertEqual(lines.count(villahistory.HISTORY_HEADER), 1)
+        self.assertEqual(len(lines), 1 + 4 * 20 * 150)
+        self.assertTrue(all(len(x.split(',')) == len(villahistory.HISTORY_FIELDS) for x in lines))
+        self.assertEqual(len(villahistory.SegmentHistory(self.segdir).read()[0]), 4 * 20 * 150)
+
+
+if __name__ == "__main__":
+    unittest.main()
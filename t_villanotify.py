@@ -0,0 +1,92 @@
+import unittest
+import villanotify
+import tempfile
+import shutil
+import os
+
+"""
+"""
+
+class Sender(object):
+    """ sender that records the messages - fail makes the next send return None """
+
+    def __init__(self):
+        self.sent = []
+        self.fail = False
+
+    def __call__(self, email_from, email_to, subject, body):
+        if self.fail:
+            return None
+        self.sent.append((email_from, email_to, subject, body))
+        return {'id': 'msg-%d' % len(self.sent)}
+
+
+class TestVillaNotify(unittest.TestCase):
+    """Unit tests for the notification hub."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'notify.json')
+        self.sender = Sender()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_publish_p01_digest_and_dedupe(self):
+        """ events of one run to the same recipients go out as one message """
+        with villanotify.open_hub(self.filename, self.sender, now=100.0) as hub:
+            self.assertEqual(hub.publish('spa_heater_on', 'SPA ON', 'spa on', 'a', 'team')['status'], 'queued')
+            self.assertEqual(hub.publish('spa_heater_on', 'SPA ON', 'spa on again', 'a', 'team')['status'], 'duplicate')
+            hub.publish('pool_heater_on', 'POOL ON', 'pool on', 'a', 'team')
+            hub.publish('villa_occupied', 'OCCUPIED', 'occupied', 'a', 'owner')
+        self.assertEqual(len(self.sender.sent), 2)
+        digest = [x for x in self.sender.sent if x[1] == 'team'][0]
+        self.assertEqual(digest[2], villanotify.DIGEST_SUBJECT + ' (2)')
+        self.assertIn('spa on again', digest[3])
+        self.assertEqual(self.sender.sent[1][2:], ('OCCUPIED', 'occupied'))
+        self.assertEqual(villanotify.read_hub(self.filename)['pending'], [])
+
+    def test_publish_p02_suppress_and_clear(self):
+        """ a key is repeated only after its window - clear sends the next one right away """
+        for now, expected in ((0.0, 'queued'), (3600.0, 'suppressed'), (14400.0, 'queued'), (15000.0, 'suppressed')):
+            with villanotify.open_hub(self.filename, self.sender, now=now) as hub:
+                self.assertEqual(hub.publish('villa_occupied', 'OCC', 'occupied', 'a', 'b', suppress_seconds=14400)['status'], expected)
+        self.assertEqual(len(self.sender.sent), 2)
+        self.assertIn('repeated 1 times', self.sender.sent[1][3])
+        with villanotify.open_hub(self.filename, self.sender, now=16000.0) as hub:
+            hub.clear('villa_occupied')
+        with villanotify.open_hub(self.filename, self.sender, now=16100.0) as hub:
+            self.assertEqual(hub.publish('villa_occupied', 'OCC', 'occupied', 'a', 'b', suppress_seconds=14400)['status'], 'queued')
+        self.assertEqual(len(self.sender.sent), 3)
+
+    def test_clear_p01_drops_held_event(self):
+        """ a condition that ends while its event is held for the digest is not sent """
+        with villanotify.open_hub(self.filename, self.sender, now=0.0, digest_seconds=900) as hub:
+            hub.publish('villa_occupied', 'OCC', 'occupied', 'a', 'b')
+            hub.publish('pool_heater_on', 'POOL ON', 'pool on', 'a', 'b')
+        with villanotify.open_hub(self.filename, self.sender, now=600.0, digest_seconds=900) as hub:
+            hub.clear('villa_occupied')
+        with villanotify.open_hub(self.filename, self.sender, now=900.0, digest_seconds=900):
+            pass
+        self.assertEqual([x[2] for x in self.sender.sent], ['POOL ON'])
+
+    def test_flush_p01_digest_window_and_failure(self):
+        """ events are held across runs until the window passes - a failed send keeps them """
+        with villanotify.open_hub(self.filename, self.sender, now=0.0, digest_seconds=900) as hub:
+            hub.publish('pool_heater_on', 'POOL ON', 'pool on', 'a', 'b')
+        with villanotify.open_hub(self.filename, self.sender, now=600.0, digest_seconds=900) as hub:
+            hub.publish('spa_heater_on', 'SPA ON', 'spa on', 'a', 'b')
+        self.assertEqual(self.sender.sent, [])
+        self.sender.fail = True
+        with villanotify.open_hub(self.filename, self.sender, now=900.0, digest_seconds=900):
+            pass
+        self.assertEqual(len(villanotify.read_hub(self.filename)['pending']), 2)
+        self.sender.fail = False
+        with villanotify.open_hub(self.filename, self.sender, now=1200.0, digest_seconds=900):
+            pass
+        self.assertEqual([x[2] for x in self.sender.sent], [villanotify.DIGEST_SUBJECT + ' (2)'])
+        self.assertEqual(sorted(villanotify.read_hub(self.filename)['keys']), ['pool_heater_on', 'spa_heater_on'])
+
+
+if __name__ == '__main__':
+    unittest.main()
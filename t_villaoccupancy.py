@@ -0,0 +1,79 @@
+import unittest
+import villaoccupancy as vocc
+import tempfile
+import shutil
+import datetime
+import os
+
+"""
+"""
+
+
+class TestVillaOccupancy(unittest.TestCase):
+    """Unit tests for the villaoccupancy compiled index."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stays_filename = os.path.join(self.tmpdir, 'stays.txt')
+        with open(self.stays_filename, 'w') as t:
+            t.write('date,occtype\n02/06/2026,O\n02/07/2026,O\n02/11/2026,R\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_stays_index_p01_lookups(self):
+        """ occupancy type by date, datetime or string - days outside the file are not occupied """
+        villacal = vocc.load_stays_index(self.stays_filename)
+        self.assertEqual(villacal.occtype(datetime.date(2026, 2, 6)), 'O')
+        self.assertIn(datetime.datetime(2026, 2, 11, 14, 0), villacal)
+        self.assertIn('02/07/2026', villacal)
+        self.assertNotIn(datetime.date(2026, 2, 8), villacal)
+        self.assertNotIn(datetime.date(2025, 1, 1), villacal)
+        self.assertNotIn(datetime.date(2027, 1, 1), villacal)
+        self.assertEqual(len(villacal), 3)
+        self.assertEqual(villacal.dates()[-1], datetime.date(2026, 2, 11))
+
+    def test_load_stays_index_p03_bad_row(self):
+        """ a row with a bad date is captured - the rest of the file still loads """
+        with open(self.stays_filename, 'a') as t:
+            t.write('10/18/2026x,R\n10/19/2026,R\n')
+        villacal = vocc.load_stays_index(self.stays_filename)
+        self.assertIn(datetime.date(2026, 10, 19), villacal)
+        self.assertEqual(len(villacal), 4)
+        self.assertEqual(len(villacal.invalid), 1)
+        self.assertTrue(villacal.invalid[0].startswith('5|10/18/2026x|'))
+
+    def test_load_stays_index_p02_sidecar_rebuilt_on_change(self):
+        """ second load comes from the sidecar - a changed file is recompiled """
+        vocc.load_stays_index(self.stays_filename)
+        self.assertTrue(os.path.isfile(self.stays_filename + vocc.SIDECAR_EXT_STAYS))
+        compiled = []
+        compile_stays_file = vocc.compile_stays_file
+        vocc.compile_stays_file = lambda *args: compiled.append(args) or compile_stays_file(*args)
+        try:
+            vocc.load_stays_index(self.stays_filename)
+            self.assertEqual(compiled, [])
+            with open(self.stays_filename, 'a') as t:
+                t.write('02/12/2026,R\n')
+            villacal = vocc.load_stays_index(self.stays_filename)
+        finally:
+            vocc.compile_stays_file = compile_stays_file
+        self.assertEqual(len(compiled), 1)
+        self.assertEqual(villacal.occtype(datetime.date(2026, 2, 12)), 'R')
+
+    def test_load_dates_index_p01_invalid_lines(self):
+        """ pool allowed dates - bad lines captured and kept through the sidecar """
+        filename = os.path.join(self.tmpdir, 'pool_heater_allowed.txt')
+        with open(filename, 'w') as t:
+            t.write('2026-02-06\nnot a date\n2026-02-07\n')
+        for _ in range(2):
+            allowed = vocc.load_dates_index(filename)
+            self.assertIn(datetime.date(2026, 2, 7), allowed)
+            self.assertNotIn(datetime.date(2026, 2, 8), allowed)
+            self.assertEqual(len(allowed.invalid), 1)
+            self.assertTrue(allowed.invalid[0].startswith('2|not a date|'))
+        self.assertEqual(len(vocc.load_dates_index(os.path.join(self.tmpdir, 'missing.txt'))), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import villaoutbox
+import tempfile
+import shutil
+import time
+import os
+
+"""
+"""
+
+class Sender(object):
+    """ send callable that records messages - fail_times failures first, delay seconds per send """
+
+    def __init__(self, fail_times=0, delay=0.0):
+        self.sent = []
+        self.fail_times = fail_times
+        self.delay = delay
+
+    def __call__(self, email_from, email_to, subject, body):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_times:
+            self.fail_times -= 1
+            raise OSError('gmail unavailable')
+        self.sent.append(subject)
+        return {'id': 'gmail-%d' % len(self.sent)}
+
+
+class TestVillaOutbox(unittest.TestCase):
+    """Unit tests for the email outbox."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outbox = villaoutbox.Outbox(os.path.join(self.tmpdir, 'outbox.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_send_due_p01_backoff(self):
+        """ a failure waits the backoff (doubling) - the rest of the pass waits too """
+        first = self.outbox.enqueue('a', 'b', 'one', 'body', now=0.0)
+        self.outbox.enqueue('a', 'b', 'two', 'body', now=0.0)
+        self.assertEqual(first['status'], 'queued')
+        sender = Sender(fail_times=1)
+        self.assertEqual(self.outbox.send_due(sender, now=0.0), (0, 1))
+        self.assertEqual(self.outbox.send_due(sender, now=59.0), (1, 0))
+        self.assertEqual(sender.sent, ['two'])
+        sender.fail_times = 1
+        self.assertEqual(self.outbox.send_due(sender, now=60.0), (0, 1))
+        self.assertEqual(self.outbox.send_due(sender, now=179.0), (0, 0))
+        self.assertEqual(self.outbox.send_due(sender, now=180.0), (1, 0))
+        self.assertEqual(self.outbox.status(first['id']), 'sent')
+        self.assertEqual(villaoutbox.read_outbox(self.outbox.filename)['messages'], [])
+
+    def test_send_due_p02_gives_up(self):
+        self.outbox.max_attempts = 2
+        handle = self.outbox.enqueue('a', 'b', 'one', 'body', now=0.0)
+        sender = Sender(fail_times=5)
+        self.outbox.send_due(sender, now=0.0)
+        self.outbox.send_due(sender, now=1000.0)
+        self.assertEqual(self.outbox.status(handle['id']), 'failed')
+        self.assertEqual(self.outbox.send_due(sender, now=100000.0), (0, 0))
+
+    def test_worker_p01_slow_endpoint(self):
+        """ enqueue returns right away while the worker is stuck in a slow send - stop gives up after the wait """
+        sender = Sender(delay=0.5)
+        worker = villaoutbox.start_worker(self.outbox, sender, poll_seconds=0.05)
+        start = time.perf_counter()
+        for idx in range(3):
+            self.outbox.enqueue('a', 'b', 'msg %d' % idx, 'body')
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertFalse(worker.stop(wait_seconds=0.1))
+        worker.join()
+        self.assertEqual(sender.sent, ['msg 0', 'msg 1', 'msg 2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
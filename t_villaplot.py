@@ -0,0 +1,160 @@
+import unittest
+import villaplot
+import datetime
+import numpy as np
+
+"""
+"""
+
+HEADER = 'datetime,thermo,hvacMode,desiredCool,desiredHeat,sensor,temp,occupied,holdName,holdCool,holdHeat'
+DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+
+def reference_series(lines, timedelta_minutes):
+    # straight python version of the pipeline - dict of rounded time -> {sensor: temp}
+    plotdata = dict()
+    sensors = []
+    for line in lines[1:]:
+        fields = line.rstrip('\r').split(',')
+        if len(fields) != 11:
+            continue
+        try:
+            dt = datetime.datetime.strptime(fields[0], DATEFMT)
+        except ValueError:
+            continue
+        ptime = villaplot.roundTime(dt, datetime.timedelta(minutes=timedelta_minutes))
+        plotdata.setdefault(ptime, dict())[fields[5]] = float(fields[6])
+        if fields[5] not in sensors:
+            sensors.append(fields[5])
+    return plotdata, sensors
+
+
+class TestVillaPlot(unittest.TestCase):
+    """Unit tests for the villaplot time x sensor pipeline."""
+
+    def setUp(self):
+        rows = [HEADER]
+        start = datetime.datetime(2024, 3, 9, 23, 50)
+        for idx in range(40):
+            ts = (start + datetime.timedelta(minutes=7 * idx, seconds=idx)).strftime(DATEFMT)
+            for sensor in ('Villa Main', 'Villa Bedrooms', 'Pool Room')[:1 + idx % 3]:
+                rows.append('%s,Main,auto,78.0,65.0,%s,%3.1f,false,,,' % (ts, sensor, 60 + idx * 0.5))
+        rows.insert(5, '2024-03-10 00:01:00,Main,auto,78.0,65.0,"Villa, Main",70.0,false,,,')
+        rows.insert(9, '2024-13-10 00:01:00,Main,auto,78.0,65.0,Villa Main,70.0,false,,,')
+        rows[12] = rows[12] + '\r'
+        self.lines = rows
+        self.data = '\n'.join(rows).encode('windows-1252')
+
+    def test_build_series_p01_matches_reference(self):
+        """ binned matrix matches the per row python version - bad lines skipped and counted """
+        series = villaplot.build_series(villaplot.read_plot_columns(self.data), DATEFMT, 15)
+        plotdata, sensors = reference_series(self.lines, 15)
+        self.assertEqual(series['sensors'], sensors)
+        self.assertEqual(series['invalid'], 2)
+        self.assertEqual(series['times'].astype('datetime64[us]').tolist(), sorted(plotdata))
+        for row, ptime in enumerate(sorted(plotdata)):
+            for col, sensor in enumerate(sensors):
+                expected = plotdata[ptime].get(sensor, np.nan)
+                self.assertTrue(np.isnan(expected) and np.isnan(series['values'][row, col])
+                                or expected == series['values'][row, col], (ptime, sensor))
+
+    def test_build_series_p02_forward_fill_window(self):
+        """ forward fill keeps leading gaps - window selects times and sensors """
+        series = villaplot.build_series(villaplot.read_plot_columns(self.data), DATEFMT, 15, forward_fill=True)
+        values = series['values']
+        self.assertTrue(np.isnan(values[0, 2]))
+        self.assertFalse(np.isnan(values[1:, 0]).any())
+        first = np.flatnonzero(~np.isnan(values[:, 2]))[0]
+        self.assertFalse(np.isnan(values[first:, 2]).any())
+        window = villaplot.window_series(series, datetime.datetime(2024, 3, 10, 1), datetime.datetime(2024, 3, 10, 2),
+                                         ['Pool Room'])
+        self.assertEqual(window['sensors'], ['Pool Room'])
+        self.assertEqual(window['times'][0], np.datetime64('2024-03-10T01:00:00'))
+        self.assertEqual(window['times'][-1], np.datetime64('2024-03-10T02:00:00'))
+        self.assertEqual(villaplot.gap_report(window), {'Pool Room': 0})
+
+    def test_read_plot_window_p01(self):
+        """ window read by binary search matches the full read trimmed to the window - and parses less """
+        import os
+        import tempfile
+        rows = [HEADER]
+        start = datetime.datetime(2024, 1, 1)
+        for idx in range(3000):
+            ts = (start + datetime.timedelta(minutes=10 * idx)).strftime(DATEFMT)
+            rows.extend('%s,Main,auto,78.0,65.0,%s,%3.1f,false,,,' % (ts, x, 60 + idx % 20) for x in ('A', 'B'))
+            if idx == 1500:
+                rows.append('garbage line')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'villatemps.txt')
+            with open(filename, 'w') as t:
+                t.write('\n'.join(rows) + '\n')
+            full = villaplot.read_plot_series(filename, DATEFMT, 15)
+            for window in ((datetime.datetime(2024, 1, 11, 3, 7), datetime.datetime(2024, 1, 12)),
+                           (None, datetime.datetime(2024, 1, 2)),
+                           (datetime.datetime(2024, 1, 21), None)):
+                series = villaplot.read_plot_window(filename, DATEFMT, 15, *window, slack_minutes=0)
+                expected = villaplot.window_series(full, *window)
+                self.assertEqual(series['times'].tolist(), expected['times'].tolist())
+                self.assertTrue(np.array_equal(series['values'], expected['values'], equal_nan=True))
+                self.assertLess(series['offsets'][1] - series['offsets'][0], os.path.getsize(filename) / 2)
+
+    def test_lttb_render_p01(self):
+        """ lttb keeps the ends and the spikes - windows written headless as png and svg into a new render_dir """
+        import os
+        import tempfile
+        x = np.arange(10000, dtype=float)
+        y = np.sin(x / 300.0)
+        y[4321] = 50.0
+        keep = villaplot.lttb(x, y, 200)
+        self.assertEqual(len(keep), 200)
+        self.assertEqual((keep[0], keep[-1]), (0, 9999))
+        self.assertIn(4321, keep)
+        self.assertTrue((np.diff(keep) > 0).all())
+        self.assertEqual(len(villaplot.lttb(x[:50], y[:50], 200)), 50)
+
+        series = villaplot.build_series(villaplot.read_plot_columns(self.data), DATEFMT, 15)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for fmt in ('png', 'svg'):
+                # render_dir is created when missing
+                filenames = villaplot.render_windows(series, ['day', 'week'], os.path.join(tmpdir, 'render'), 'test', fmt,
+                                                     width_px=300, height_px=200)
+                self.assertEqual([os.path.basename(x) for x in filenames], ['test_day.' + fmt, 'test_week.' + fmt])
+                self.assertTrue(all(os.path.getsize(x) for x in filenames))
+
+    def test_read_plot_cached_p01(self):
+        """ cache parses only appended complete lines - rebuilt when the file is rewritten or the bins change """
+        import os
+        import tempfile
+        lines = self.lines
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'villatemps.txt')
+            with open(filename, 'w', newline='') as t:
+                t.write('\n'.join(lines[:30]) + '\n' + lines[30][:12])
+            series = villaplot.read_plot_cached(filename, DATEFMT, 15)
+            self.assertTrue(series['cache']['rebuilt'])
+            self.assertTrue(os.path.isfile(filename + villaplot.PLOT_CACHE_EXT))
+
+            # finish the partial line and append the rest
+            with open(filename, 'a', newline='') as t:
+                t.write(lines[30][12:] + '\n' + '\n'.join(lines[31:]) + '\n')
+            series = villaplot.read_plot_cached(filename, DATEFMT, 15)
+            self.assertFalse(series['cache']['rebuilt'])
+            self.assertEqual(series['cache']['parsed_bytes'], os.path.getsize(filename) - len('\n'.join(lines[:30]) + '\n'))
+            full = villaplot.read_plot_series(filename, DATEFMT, 15)
+            self.assertEqual(series['times'].tolist(), full['times'].tolist())
+            self.assertEqual(series['sensors'], full['sensors'])
+            self.assertTrue(np.array_equal(series['values'], full['values'], equal_nan=True))
+            self.assertEqual(series['invalid'], full['invalid'])
+            self.assertEqual(villaplot.read_plot_cached(filename, DATEFMT, 15)['cache']['parsed_bytes'], 0)
+
+            # rewritten in place (same inode) and longer than before
+            with open(filename, 'r+', newline='') as t:
+                t.write(lines[0] + '\n' + '\n'.join(lines[1:]).replace('Villa Main', 'Villa Mains') + '\n')
+            series = villaplot.read_plot_cached(filename, DATEFMT, 15)
+            self.assertTrue(series['cache']['rebuilt'])
+            self.assertIn('Villa Mains', series['sensors'])
+            self.assertTrue(villaplot.read_plot_cached(filename, DATEFMT, 30)['cache']['rebuilt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
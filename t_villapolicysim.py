@@ -0,0 +1,52 @@
+import unittest
+import villapolicysim as vps
+import villaoccupancy
+import villaecobee
+import itertools
+import datetime
+import numpy as np
+
+"""
+"""
+
+ACTION_CONV = {
+    villaecobee.HOLD_ACTION_NONE: vps.ACTION_NONE,
+    villaecobee.HOLD_ACTION_SET: vps.ACTION_SET,
+    villaecobee.HOLD_ACTION_REMOVE: vps.ACTION_REMOVE,
+}
+
+
+class TestVillaPolicySim(unittest.TestCase):
+    """Unit tests for the villapolicysim hold policy replay."""
+
+    def test_decide_p01_matches_hold_decision(self):
+        """ vectorized policy gives the same action as villaecobee.hold_decision for every case """
+        cases = list(itertools.product([False, True], [False, True], range(24), [False, True]))
+        for occ_today, occ_tomorrow, hour, hold_on in cases:
+            action, hold_after = vps.decide(np.array([occ_today]), np.array([occ_tomorrow]),
+                                            np.array([hour]), 17, hold_on)
+            expected, state = villaecobee.hold_decision(occ_today, occ_tomorrow, hour, 17, hold_on)
+            self.assertEqual(action[0], ACTION_CONV[expected], (occ_today, occ_tomorrow, hour, hold_on))
+
+    def test_simulate_p01_one_stay(self):
+        """ one stay - hourly polls - holds removed the evening before and set the evening of checkout """
+        start = datetime.date(2025, 3, 1)
+        villacal = villaoccupancy.build_index({start + datetime.timedelta(days=x): 'R' for x in range(2, 5)})
+        polls = vps.synthetic_polls(start, start + datetime.timedelta(days=6), poll_minutes=60)
+        result = vps.simulate(polls, villacal, sethold_hour=17, thermostats=2)
+
+        # vacant start sets once, arriving day removes at 18-23, checkout day sets at 18-23
+        self.assertEqual(result['remove_runs'], 6)
+        self.assertEqual(result['set_runs'], 1 + 6)
+        self.assertEqual(result['api_calls'], 26)
+        # hold off from 18:00 on 03/02 through 17:59 on 03/05 (72 hours) out of 168
+        self.assertAlmostEqual(result['hold_hours'], 168 - 72)
+        self.assertAlmostEqual(result['setback_degree_hours'], 96 * ((70 - 55) + (80 - 76)))
+
+        later = vps.simulate(polls, villacal, sethold_hour=20, thermostats=2)
+        self.assertEqual(later['set_runs'], 1 + 3)
+        self.assertAlmostEqual(later['hold_hours'], 168 - 72)
+
+
+if __name__ == "__main__":
+    unittest.main()
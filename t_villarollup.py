@@ -0,0 +1,115 @@
+import unittest
+import villarollup
+import villahistory
+import villaplot
+import datetime
+import tempfile
+import shutil
+import os
+import numpy as np
+
+"""
+"""
+
+def make_rows(start, count, step_minutes=7):
+    """
+    Build count polls worth of rows (three sensors) starting at start
+    """
+    rows = []
+    for idx in range(count):
+        dt_str = (start + datetime.timedelta(minutes=step_minutes * idx)).strftime(villahistory.HISTORY_DATEFMT)
+        for sensor, temp in (('Villa Main', 70.0 + idx % 11), ('Kitchen', 60.5 + idx % 5), ('Pool Room', 80.0 - idx % 3)):
+            rows.append((dt_str, 'Villa Main', 'auto', 80.0, 55.0, sensor, temp, 'false', None, None, None))
+    return rows
+
+
+class TestVillaRollup(unittest.TestCase):
+    """Unit tests for the villarollup min/max/mean levels."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.textfile = os.path.join(self.tmpdir, 'villatemps.txt')
+        self.rollupdir = os.path.join(self.tmpdir, 'villarollup')
+        # crosses a month and a year boundary
+        self.rows = make_rows(datetime.datetime(2025, 12, 29), 1500)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_choose_level_p01(self):
+        self.assertEqual(villarollup.choose_level(5 * 366 * 86400, 1200), 'day')
+        self.assertEqual(villarollup.choose_level(366 * 86400, 1200), 'hour')
+        self.assertEqual(villarollup.choose_level(7 * 86400, 1200), '5min')
+        self.assertIsNone(villarollup.choose_level(86400, 1200))
+
+    def test_append_rows_p01_matches_build(self):
+        """ polls added one at a time give the same rollups as a build from the text file """
+        history = villahistory.MultiHistory([villahistory.TextHistory(self.textfile), villarollup.RollupHistory(self.rollupdir)])
+        for idx in range(0, len(self.rows), 3):
+            history.append_rows(self.rows[idx:idx + 3])
+        builddir = os.path.join(self.tmpdir, 'build')
+        self.assertEqual(villarollup.build_rollup(self.textfile, builddir), len(self.rows))
+        for level in villarollup.LEVEL_SECONDS:
+            polled = villarollup.read_rollup(self.rollupdir, level)
+            built = villarollup.read_rollup(builddir, level)
+            self.assertEqual(polled['times'].tolist(), built['times'].tolist())
+            self.assertEqual(polled['sensors'], built['sensors'])
+            for stat in ('values', 'min', 'max', 'count'):
+                self.assertTrue(np.allclose(polled[stat], built[stat], equal_nan=True), (level, stat))
+        self.assertTrue(os.path.isfile(villarollup.rollup_filename(self.rollupdir, '5min', '2026-01')))
+        self.assertTrue(os.path.isfile(villarollup.rollup_filename(self.rollupdir, 'hour', '2025')))
+
+    def test_build_rollup_p01_keeps_other_files(self):
+        """ a build into a directory with other files only replaces the rollup files """
+        villahistory.TextHistory(self.textfile).append_rows(self.rows)
+        other = os.path.join(self.tmpdir, 'important.txt')
+        with open(other, 'w') as t:
+            t.write('keep me')
+        stale = villarollup.rollup_filename(self.tmpdir, 'hour', '1999')
+        with open(stale, 'wb') as t:
+            t.write(b'old')
+        self.assertEqual(villarollup.build_rollup(self.textfile, self.tmpdir), len(self.rows))
+        self.assertTrue(os.path.isfile(other))
+        self.assertTrue(os.path.isfile(self.textfile))
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.isfile(villarollup.rollup_filename(self.tmpdir, 'day', 'all')))
+
+    def test_append_rows_p02_bad_rollup_file(self):
+        """ a bad rollup file is logged - the poll is still saved to the text file """
+        filename = villarollup.rollup_filename(self.rollupdir, '5min', '2025-12')
+        os.makedirs(self.rollupdir)
+        with open(filename, 'wb') as t:
+            t.write(b'not a numpy file')
+        history = villahistory.MultiHistory([villahistory.TextHistory(self.textfile), villarollup.RollupHistory(self.rollupdir)])
+        with self.assertLogs('villarollup', level='ERROR'):
+            history.append_rows(self.rows[:3])
+        self.assertEqual(len(history.read_rows()), 3)
+
+    def test_read_rollup_p01_stats(self):
+        """ hourly min/max/mean/count match the raw readings """
+        villarollup.RollupHistory(self.rollupdir).append_rows(self.rows)
+        start = datetime.datetime(2026, 1, 2)
+        series = villarollup.read_rollup(self.rollupdir, 'hour', start, start + datetime.timedelta(hours=23))
+        self.assertEqual(len(series['times']), 24)
+        col = series['sensors'].index('Kitchen')
+        temps = [x[6] for x in self.rows if x[5] == 'Kitchen' and x[0].startswith('2026-01-02 05:')]
+        self.assertEqual(series['count'][5, col], len(temps))
+        self.assertAlmostEqual(series['values'][5, col], sum(temps) / len(temps))
+        self.assertEqual(series['min'][5, col], min(temps))
+        self.assertEqual(series['max'][5, col], max(temps))
+
+    def test_load_plot_series_p01_uses_rollup(self):
+        """ a long window is read from the rollups - a short one from the file """
+        villahistory.MultiHistory([villahistory.TextHistory(self.textfile), villarollup.RollupHistory(self.rollupdir)]).append_rows(self.rows)
+        end = datetime.datetime(2026, 1, 5)
+        series = villaplot.load_plot_series(self.textfile, villahistory.HISTORY_DATEFMT, 15, end - datetime.timedelta(days=6), end,
+                                            plot_cache=False, rollup_dirname=self.rollupdir, points=100)
+        self.assertEqual(series['level'], 'hour')
+        self.assertIn('min', villaplot.window_series(series, sensors=['Kitchen']))
+        series = villaplot.load_plot_series(self.textfile, villahistory.HISTORY_DATEFMT, 15, end - datetime.timedelta(days=1), end,
+                                            plot_cache=False, rollup_dirname=self.rollupdir, points=100)
+        self.assertNotIn('level', series)
+
+
+if __name__ == '__main__':
+    unittest.main()
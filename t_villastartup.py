@@ -0,0 +1,53 @@
+import unittest
+import villastartup as vstart
+import kvutil
+import tempfile
+import sys
+
+"""
+"""
+
+IMPORTTIME = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:        80 |         80 |     marshal
+import time:       300 |        500 | kvdate
+import time:      1000 |       1500 | villaecobee
+"""
+
+
+class TestVillaStartup(unittest.TestCase):
+    """Unit tests for villastartup and kvutil.lazy_import."""
+
+    def test_parse_importtime_p01(self):
+        """ header skipped - names, times and nesting depth captured """
+        modules = vstart.parse_importtime(IMPORTTIME)
+        self.assertEqual([x['name'] for x in modules], ['_io', 'marshal', 'kvdate', 'villaecobee'])
+        self.assertEqual([x['depth'] for x in modules], [1, 2, 0, 0])
+        self.assertEqual(modules[3]['cumulative_us'], 1500)
+
+    def test_lazy_import_p01(self):
+        """ lazy module imported on first attribute use - imported modules returned as is """
+        self.assertIs(kvutil.lazy_import('sys'), sys)
+        sys.modules.pop('colorsys', None)
+        colorsys = kvutil.lazy_import('colorsys')
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertEqual(colorsys.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+        self.assertIn('colorsys', sys.modules)
+
+    def test_scriptinfo_p01_matches_inspect(self):
+        """ fast scriptinfo returns the same as the inspect.stack() version and is faster """
+        self.assertEqual(kvutil.scriptinfo(), kvutil.scriptinfo_inspect())
+        timing = vstart.bench_scriptinfo(20)
+        self.assertLess(timing['scriptinfo'], timing['scriptinfo_inspect'])
+
+    def test_measure_startup_p01_no_heavy_imports(self):
+        """ entry points do not import the google/excel/plot libraries at startup """
+        with tempfile.TemporaryDirectory() as workdir:
+            for module in vstart.ENTRY_POINTS:
+                result = vstart.measure_startup(module, cwd=workdir)
+                names = set(x['name'].split('.')[0] for x in result['modules'])
+                self.assertEqual([x for x in vstart.HEAVY_MODULES if x in names], [], module)
+
+
+if __name__ == "__main__":
+    unittest.main()
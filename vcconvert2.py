@@ -1,7 +1,7 @@
 """
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version: 1.31
+@version: 1.35
 
 Read information from Beautiful Places XLS files,
 extract out occupancy data, build a new
@@ -13,11 +13,13 @@ import pprint
 # we are reusing features from another applicatoin but we wnat
 # the log files to be tied to this applicatoin - so we call tihs
 # application/library late in order to have the logger ocnfigured to THIS app
-import villaecobee
-import villacalendar
-
 import kvutil
-import kvxls
+
+# heavy modules - only imported when a step that needs them runs
+villaecobee = kvutil.lazy_import("villaecobee")
+villacalendar = kvutil.lazy_import("villacalendar")
+
+kvxls = kvutil.lazy_import("kvxls")
 import kvcsv
 
 import copy
@@ -28,15 +30,13 @@ import datetime
 import sys
 
 import poolfile
+import villaoccupancy
 
 # for sorting a list of dicts
 from operator import itemgetter
 
-# working with Excel files
-import openpyxl
-from openpyxl.styles import Alignment, Font
-from openpyxl.styles import numbers
-from openpyxl.utils import get_column_letter
+# working with Excel files - imported when we first write a workbook
+openpyxl = kvutil.lazy_import("openpyxl")
 
 import kvlogger
 
@@ -46,11 +46,17 @@ import kvlogger
 
 pp = pprint.PrettyPrinter(indent=4)
 
-# Excel formatting strings
-EXCEL_FMT_BOLD = Font(bold=True, name="Arial", size=10)
-EXCEL_FMT_REGULAR = Font(name="Arial", size=10)
-EXCEL_FMT_FIT_CENTERED = Alignment(shrink_to_fit=True, horizontal="center")
-EXCEL_FMT_FIT = Alignment(shrink_to_fit=True)
+# Excel formatting strings - built when needed so openpyxl is not imported at startup
+def excel_formats():
+    """
+    returns (EXCEL_FMT_BOLD, EXCEL_FMT_REGULAR, EXCEL_FMT_FIT_CENTERED, EXCEL_FMT_FIT)
+    """
+    return (
+        openpyxl.styles.Font(bold=True, name="Arial", size=10),
+        openpyxl.styles.Font(name="Arial", size=10),
+        openpyxl.styles.Alignment(shrink_to_fit=True, horizontal="center"),
+        openpyxl.styles.Alignment(shrink_to_fit=True),
+    )
 
 
 # date information
@@ -197,7 +203,7 @@ logger = kvlogger.getLogger(__name__)
 # application variables
 optiondictconfig = {
     "AppVersion": {
-        'value': '1.31',
+        'value': '1.35',
         "description": "defines the version number for the app",
     },
     "debug": {
@@ -264,6 +270,10 @@ optiondictconfig = {
         "value": True,
         "description": "defines if we are going to sync XLS data with calendar",
     },
+    "file_token_json": {
+        "value": "token.json",
+        "description": "defines the google token file used for the calendar (converted from token.pickle) - set to the gmail token file to share one token and refresh when the calendar is on the gmail account",
+    },
     "startback": {
         "type": "int",
         "description": "defines number of days added to today that we update the calendar (negative numbers are in the past)",
@@ -776,6 +786,7 @@ def rewrite_file(
 
     # create workbook for output
     wb = openpyxl.Workbook()
+    EXCEL_FMT_BOLD, EXCEL_FMT_REGULAR, EXCEL_FMT_FIT_CENTERED, EXCEL_FMT_FIT = excel_formats()
 
     # set the first sheet name
     ws = wb.active
@@ -795,7 +806,7 @@ def rewrite_file(
         else:
             a1.alignment = EXCEL_FMT_FIT
         if key in COL_WIDTH:
-            ws.column_dimensions[get_column_letter(colidx)].width = COL_WIDTH[key]
+            ws.column_dimensions[openpyxl.utils.get_column_letter(colidx)].width = COL_WIDTH[key]
 
     # data records
     for recidx, rec in enumerate(xlsaref, start=2):
@@ -811,7 +822,7 @@ def rewrite_file(
             if key in xlsdateflds:
                 a1.number_format = "MM/DD/YYYY"
             if key in COL_NUMBER_FLDS:
-                a1.number_format = numbers.FORMAT_NUMBER_COMMA_SEPARATED1
+                a1.number_format = openpyxl.styles.numbers.FORMAT_NUMBER_COMMA_SEPARATED1
 
     # build out month oriented tabs
     for mon in range(1, 13):
@@ -826,7 +837,7 @@ def rewrite_file(
             else:
                 a1.alignment = EXCEL_FMT_FIT
             if key in COL_WIDTH:
-                ws.column_dimensions[get_column_letter(colidx)].width = COL_WIDTH[key]
+                ws.column_dimensions[openpyxl.utils.get_column_letter(colidx)].width = COL_WIDTH[key]
 
         # extract out data for this sheet
         monaref = [x for x in xlsaref if x[fld_first_night].month == mon]
@@ -1074,51 +1085,54 @@ def migrate_stays_to_history(
     debug: bool = False,
 ):
     # log that we are doing this work
-    # load stay history
+    # load stay history - compiled index so we only look up dates
     if os.path.isfile(occupy_history_filename):
         logger.info("migrate_stays_to_history:load file:%s", occupy_history_filename)
-        stays_history = villaecobee.load_villa_calendar(
-            occupy_history_filename, fld_date, debug=False
-        )
+        stays_history_index = villaoccupancy.load_stays_index(occupy_history_filename, fld_date)
     else:
         logger.info(
             "migrate_stays_to_history:file does not exist:%s", occupy_history_filename
         )
-        stays_history = dict()
+        stays_history_index = villaoccupancy.OccupancyIndex()
 
     # load current stay information
-    stays = villaecobee.load_villa_calendar(occupy_filename, fld_date, debug=False)
+    stays_index = villaoccupancy.load_stays_index(occupy_filename, fld_date)
     logger.info("migrate_stays_to_history:load file:%s", occupy_filename)
 
-    # capture today
-    today = datetime.datetime.today()
-
-    # and capture the number of records add to the stay history
-    records_added = 0
-
-    # step through the stays file and look for past due dates
-    for staydate in stays:
-        if not staydate:
-            # skip blanks
-            continue
-        if datetime.datetime.strptime(staydate, DATE_FMT) < today:
-            # this date is in the past - see if this date is in the history already
-            if staydate not in stays_history:
-                # add this date to stays history
-                stays_history[staydate] = stays[staydate]
-                # increment the counter
-                records_added += 1
-                # debugging message
-                logger.debug("migrate_stays_to_history:date added:%s", staydate)
-            else:
-                # debugging message
-                logger.debug("migrate_stays_to_history:date skipped:%s", staydate)
+    # capture today - a stay date at midnight is before now so today migrates too
+    today = datetime.date.today()
+
+    # step through the stays file and look for past due dates not in the history already
+    new_dates = []
+    for staydate in stays_index:
+        if staydate > today:
+            # dates are in order - the rest are in the future
+            break
+        if staydate not in stays_history_index:
+            new_dates.append(staydate)
+            # debugging message
+            logger.debug("migrate_stays_to_history:date added:%s", staydate)
+        else:
+            # debugging message
+            logger.debug("migrate_stays_to_history:date skipped:%s", staydate)
 
     # loop through - now if we added records we need to save stay history data
-    if records_added:
+    if new_dates:
         logger.info(
-            "migrate_stays_to_history:records added to history:%d", records_added
+            "migrate_stays_to_history:records added to history:%d", len(new_dates)
         )
+        # only now do we need the full records
+        if os.path.isfile(occupy_history_filename):
+            stays_history = kvcsv.readcsv2dict(occupy_history_filename, [fld_date], True)
+        else:
+            stays_history = dict()
+        stays = kvcsv.readcsv2dict(occupy_filename, [fld_date], True)
+        stays_by_date = {
+            datetime.datetime.strptime(x, DATE_FMT).date(): x for x in stays if x
+        }
+        for staydate in new_dates:
+            staydate_str = stays_by_date[staydate]
+            stays_history[staydate_str] = stays[staydate_str]
         kvcsv.writedict2csv(occupy_history_filename, stays_history)
     else:
         logger.info("migrate_stays_to_history:no records added to history")
@@ -1193,7 +1207,10 @@ if __name__ == "__main__":
             now = datetime.datetime.now()
         # now update the calendar
         villacalendar.sync_villa_cal_with_bp_xls(
-            xlsaref, now=now, debug=optiondict["debug"]
+            xlsaref,
+            now=now,
+            debug=optiondict["debug"],
+            file_token_json=optiondict["file_token_json"],
         )
 
     # validate we can load this file after we created it
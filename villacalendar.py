@@ -1,7 +1,7 @@
 """
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version:  1.07
+@version:  1.12
 
 set of functions used to parse BP xls and update the appropriate google calendar
 """
@@ -9,12 +9,7 @@ set of functions used to parse BP xls and update the appropriate google calendar
 from __future__ import print_function
 import datetime
 import pytz
-import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import pytz
 import time
 
 # pretty printing
@@ -24,53 +19,45 @@ pp = pprint.PrettyPrinter(indent=4)
 
 # setup the logger
 import kvutil
+import kvdate
 import logging
 
+# google credentials and services - shared with gmail (see kvgoogleauth.py)
+import kvgoogleauth
+
 logger = logging.getLogger(__name__)
 
 # set the module version number
-AppVersion = "1.07"
+AppVersion = "1.12"
 
 
-# If modifying these scopes, delete the file token.pickle.
+# If modifying these scopes, the browser flow is run again to grant them (see kvgoogleauth.py)
 # SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 # changed access to read/write so we could create events as defined by the 2nd function
-SCOPES = ["https://www.googleapis.com/auth/calendar"]
+SCOPES = kvgoogleauth.CALENDAR_SCOPES
+
+# json file with the calendar account token - token.pickle of earlier versions is converted to it
+# pass the gmail token file instead (file_token_json) when both use the same account - one refresh serves both
+TOKEN_FILENAME = "token.json"
+TOKEN_PICKLE_FILENAME = "token.pickle"
+
+# timezone of the villa calendar events
+CALENDAR_TIMEZONE = "America/Los_Angeles"
 
 
 # connect to google services, based on data stored in the credential.json or
-# what has been created in the token.pickle file
-def get_cal_service():
-    """Shows basic usage of the Google Calendar API.
-    Prints the start and name of the next 10 events on the user's calendar.
+# what has been created in the token.json file
+def get_cal_service(file_token_json=TOKEN_FILENAME):
+    """connect to the calendar api - credentials are loaded (and refreshed) once per process
+    and the service is built once from the bundled discovery document (see kvgoogleauth.py)
+
+    file_token_json - token file - the gmail token file when gmail and calendar are the same account
+                      (one refresh serves both) - the calendar events go to its primary calendar
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists("token.pickle"):
-        logger.info("Load credentials from pickle file")
-        with open("token.pickle", "rb") as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            logger.info("Refreshing credentials with google")
-            creds.refresh(Request())
-        else:
-            logger.info("Using credentials.json to create a set of secrets")
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server()
-        # Save the credentials for the next run
-        logger.info("Saving current credentials to pickle file")
-        with open("token.pickle", "wb") as token:
-            pickle.dump(creds, token)
-
-    # connect with the calendar services
-    logger.info("Build calendar service")
-    service = build("calendar", "v3", credentials=creds)
-
-    return service
+    logger.info("Get calendar service:%s", file_token_json)
+    return kvgoogleauth.get_service(
+        "calendar", "v3", SCOPES, file_token_json, pickle_filename=TOKEN_PICKLE_FILENAME
+    )
 
 
 # read in all future events for this user
@@ -193,11 +180,11 @@ def create_cal_event(service):
         "description": "Testing the google API for creating an event",
         "start": {
             "dateTime": "2019-02-22T17:00:00-07:00",
-            "timeZone": "America/Los_Angeles",
+            "timeZone": CALENDAR_TIMEZONE,
         },
         "end": {
             "dateTime": "2019-02-22T18:00:00-07:00",
-            "timeZone": "America/Los_Angeles",
+            "timeZone": CALENDAR_TIMEZONE,
         },
         #        'recurrence': [
         #            'RRULE:FREQ=DAILY;COUNT=2'
@@ -231,9 +218,10 @@ def create_cal_event(service):
 
 
 # create a date/time string that can be compared with the data returned from google calendar
+# offset looked up in the kvdate per year transition table - no zone construction per event
+# is_dst=None - like pytz a time in the fall back fold or spring forward gap raises
 def google_time_convert(dt):
-    pt = pytz.timezone("America/Los_Angeles")
-    hoursoff = pt.utcoffset(dt).total_seconds() / 3600
+    hoursoff = kvdate.utc_offset(dt, CALENDAR_TIMEZONE, is_dst=None).total_seconds() / 3600
     return dt.isoformat() + "{:+03.0f}:00".format(hoursoff)
 
 
@@ -297,11 +285,11 @@ def create_event_dict(eType, starttime, endtime, stay, debug=False):
     )
     event["start"] = {
         "dateTime": starttime.isoformat(),
-        "timeZone": "America/Los_Angeles",
+        "timeZone": CALENDAR_TIMEZONE,
     }
     event["end"] = {
         "dateTime": endtime.isoformat(),
-        "timeZone": "America/Los_Angeles",
+        "timeZone": CALENDAR_TIMEZONE,
     }
 
     # debbugingg
@@ -628,12 +616,12 @@ def remove_nonmatch_events(service, cal_events_start_dict, debug=False):
 
 
 # core routine - takes in the list of records from the BP xls and updates the google calendar to match
-def sync_villa_cal_with_bp_xls(xlsaref, now=None, debug=False):
+def sync_villa_cal_with_bp_xls(xlsaref, now=None, debug=False, file_token_json=TOKEN_FILENAME):
     # logger
     logger.info("Synching XLS with calendar events:XLS event count:%s", len(xlsaref))
 
     # connect to the account and get the service up and running
-    service = get_cal_service()
+    service = get_cal_service(file_token_json)
 
     # capture the current time
     if not now:
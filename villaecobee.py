@@ -1,7 +1,7 @@
 '''
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version:  1.17
+@version:  1.27
 
 Read data from ecobee thermostats, and store to file
 Read occupancy from flat file
@@ -16,7 +16,15 @@ import kvutil
 import datetime
 import os
 import sys
-import kvgmailsendsimple
+import villahistory
+import villaecobeecache
+import villaoccupancy
+import villaecobeebatch
+import villaecobeereconcile
+import villaecobeetoken
+import villarollup
+import villanotify
+import villaoutbox
 
 # this utility queries the villa thermostats and sensor
 # saves the information to a text file for review in the future
@@ -49,7 +57,7 @@ logger = logging.getLogger(__name__)
 # application variables
 optiondictconfig = {
     'AppVersion' : {
-        'value': '1.17',
+        'value': '1.27',
         'description' : 'defines the version number for the app',
     },
     'debug' : {
@@ -74,6 +82,15 @@ optiondictconfig = {
         'value' : 'ecobee.conf',
         'description' : 'defines the name of the input file to updated',
     },
+    'token_safety_seconds' : {
+        'value' : 300,
+        'type' : 'int',
+        'description' : 'defines how many seconds before the access token expires that we refresh it',
+    },
+    'revision_cache_filename' : {
+        'value' : 'ecobee_revisions.json',
+        'description' : 'defines the file caching thermostat revisions/data - only changed thermostats are pulled (blank to disable)',
+    },
     'occupy_filename' : {
         'value' : 'stays.txt',
         'description' : 'defines the name of the file holding the villa occupancy',
@@ -86,6 +103,25 @@ optiondictconfig = {
         'value' : 'villatemps.txt',
         'description' : 'defines the name of the file that holds the temperature readings',
     },
+    'history_backend' : {
+        'value' : 'text',
+        'type' : 'inlist',
+        'valid' : villahistory.HISTORY_BACKENDS,
+        'description' : 'defines where temperature readings are saved (text=temperature_filename, segment=history_dirname, both)',
+    },
+    'history_dirname' : {
+        'value' : 'villatemps',
+        'description' : 'defines the directory that holds the binary monthly segment files of temperature readings',
+    },
+    'history_fsync' : {
+        'value' : False,
+        'type' : 'bool',
+        'description' : 'defines if we force the temperature readings to disk (fsync) after each poll',
+    },
+    'rollup_dirname' : {
+        'value' : '',
+        'description' : 'defines the directory of the 5min/hour/day min/max/mean rollups updated after each poll (blank - no rollups)',
+    },
     'holdType' : {
         'value' : 'indefinite',
         'description' : 'defines the hold string used when placing temperature holds',
@@ -95,6 +131,11 @@ optiondictconfig = {
         'type' : 'int',
         'description' : 'defines the hour after which to set holds on day the guest depart or the day before arrival',
     },
+    'force_holds' : {
+        'value' : False,
+        'type' : 'bool',
+        'description' : 'defines if holds are written to every thermostat on every set/remove run (default: only thermostats not in the desired state)',
+    },
     ### Email Notification when occupied and no one is supposed to be there
     'occupied_email_from' : {
         'value' : '210608thSt@gmail.com',
@@ -114,6 +155,29 @@ optiondictconfig = {
         'value' : 'We have just detected the Villa is occupied and stays.txt file says there are no guests ',
         'description' : 'defines the body of the message sent out when we are occupied and stays.txt says we are not',
     },
+    'occupied_suppress_hours' : {
+        'value' : 4,
+        'type' : 'int',
+        'description' : 'defines the hours we wait before repeating the occupied message while the villa stays occupied (0 - every run)',
+    },
+    'notify_state_filename' : {
+        'value' : 'villa_notify.json',
+        'description' : 'defines the file that holds when each message was last sent and the messages held for a digest',
+    },
+    'notify_digest_minutes' : {
+        'value' : 0,
+        'type' : 'int',
+        'description' : 'defines the minutes messages are held and sent together as one digest (0 - sent at the end of the run)',
+    },
+    'outbox_filename' : {
+        'value' : 'villa_outbox.json',
+        'description' : 'defines the file that holds the messages waiting to be sent by the outbox worker (see villaoutbox.py) - blank sends each message during the run',
+    },
+    'outbox_wait_seconds' : {
+        'value' : 20,
+        'type' : 'int',
+        'description' : 'defines the seconds we wait at the end of the run for the outbox worker - messages not sent stay queued for the next run',
+    },
     'scopes' : {
         'value' : None,
         'description' : 'defines the gmail scopes used to generate and send emails - see kvgmailsendsimple.py',
@@ -158,28 +222,40 @@ holdSetting = { 'heat' : 55.0, 'cool' : 80.0 }
 
 
 
-# read in the file of dates the villa is booked into a dictionary keyed on date
+# read in the file of dates the villa is booked into an occupancy index keyed on date
+# (see villaoccupancy.py - lookups take a date or a MM/DD/YYYY string)
 #
 def load_villa_calendar( occupy_filename, fldDate, debug=False ):
-    # read in the file as a dictionary
-    return kvcsv.readcsv2dict(occupy_filename, [fldDate], True)
+    # compiled index - only rebuilt when the file changes
+    return villaoccupancy.load_stays_index(occupy_filename, fldDate)
 
 
-# read the current thermostat readings, save them to a file (if filename is provided),
+# read the current thermostat readings, save them to a file (if filename is provided)
+# or to the history backend (if history is provided - see villahistory.py),
 # and return the thermometer values of interest in a list of lists each
 # thermostat record has the following array of values:
 #     'thermo,hvacMode,currentTemp,holdName,holdCool,holdHeat'
 #
-def readSave_thermoSensor_rtn_therms( ecobee, temperature_filename, debug=False ):
+def readSave_thermoSensor_rtn_therms( ecobee, temperature_filename, debug=False, history=None ):
     # local variables - list of therm values
     thermvals = []
 
+    # saving to a filename is the text history backend
+    if history is None and temperature_filename:
+        history = villahistory.TextHistory(temperature_filename)
+
     # local variable - capture if any thermo says we are occupied
     occupied = False
 
+    # local variable - every sensor row for this poll - written once at the end
+    rows = []
+
     # read in the current settings
     thermos=ecobee.get_thermostats()
 
+    # thermostats served from the revision cache have no new readings to save
+    served_from_cache = getattr(ecobee, 'served_from_cache', set())
+
     # debugging
     if debug:
         print('readSave_thermoSensor_rtn_therms:thermos:')
@@ -223,23 +299,17 @@ def readSave_thermoSensor_rtn_therms( ecobee, temperature_filename, debug=False
             if not occupied and sensors[rSensor['name']]['occupancy'] == 'true':
                 occupied = True
 
-        # Save results to file if a filename is provided
-        if temperature_filename:
-            # check to see if the file exists
-            exists = os.path.isfile( temperature_filename )
+        # unchanged since the last run - readings already saved
+        if thermo.get('identifier') in served_from_cache:
+            continue
+
+        # capture the sensor data for this thermostat
+        for sensor in sensors:
+            rows.append( (thermo['thermostatTime'],name, hvacMode, thermo['runtime']['desiredCool']/10, thermo['runtime']['desiredHeat']/10, sensor, float(sensors[sensor]['temperature'])/10, sensors[sensor]['occupancy'],holdName,holdCool,holdHeat) )
 
-            # determine the open type
-            open_type = 'a' if exists else 'w'
-            
-            # now open a file and dump the values collected
-            with open( temperature_filename, open_type ) as t:
-                # check to see if the file exists - and if it did not - create header in the file
-                if not exists:
-                    # create the header for the file as we created the file
-                    t.write('datetime,thermo,hvacMode,desiredCool,desiredHeat,sensor,temp,occupied,holdName,holdCool,holdHeat\n')
-                # now output the sensor data
-                for sensor in sensors:
-                    t.write("%s,%s,%s,%3.1f,%3.1f,%s,%3.1f,%s,%s,%s,%s\n" % (thermo['thermostatTime'],name, hvacMode, thermo['runtime']['desiredCool']/10, thermo['runtime']['desiredHeat']/10, sensor, float(sensors[sensor]['temperature'])/10, sensors[sensor]['occupancy'],holdName,holdCool,holdHeat))
+    # Save results to the history if one is provided - one locked write for the whole poll
+    if history:
+        history.append_rows(rows)
 
     # debugging - list of sensors
     if debug:
@@ -266,19 +336,27 @@ def set_therm_to_auto_if_off( ecobee, idx, thermos, debug=False ):
         logger.info('set_therm_to_auto_if_off:status-not-changed:idx:%d:returned-status:%s', idx, result)
 
 # remove any temperature holds that exist on all thermostats
+# one batched request for the house (see villaecobeebatch.py)
 #
 def remove_temp_holds_all( ecobee, debug=False ):
     # read in the current set of thermostats - so we have a list to work
     thermos=ecobee.get_thermostats()
 
-    # loop through the thermometers
-    for idx in range(len(thermos)):
+    # build the commands for each thermostat
+    commands = villaecobeebatch.ThermostatCommands(ecobee)
+    for thermo in thermos:
         # make sure the thermostat is not off
-        set_therm_to_auto_if_off( ecobee, idx, thermos, debug=debug )
+        if thermo['settings']['hvacMode'] == 'off':
+            logger.info('remove_temp_holds_all:thermo-is-off:%s:set-to:%s', thermo['name'], 'auto')
+            commands.set_hvac_mode(thermo, 'auto')
         # remove all holds on this thermostat
-        result = ecobee.resume_program(idx, resume_all=True)
+        commands.resume_program(thermo, resume_all=True)
+
+    # send them
+    results = commands.send()
+    for thermo in thermos:
         # show the result of the thermostat call
-        logger.info('remove_temp_holds_all:idx:%d:result:%s', idx,result)
+        logger.info('remove_temp_holds_all:therm:%s:result:%s', thermo['name'], results.get(thermo['identifier']))
 
 # set temperature holds on all thermostats
 #
@@ -286,24 +364,27 @@ def set_temp_holds_all( ecobee, therms, holdSetting, hold_type, debug=False ):
     # read in the current set of thermostats - so we have a list to work
     thermos=ecobee.get_thermostats()
 
-    # Get values from the array that was passed in (therms)
-    (thermo,hvacMode,currentTemp,holdName,holdCool,holdHeat) = therms[0]
-    
-    # loop through the thermometers
-    for idx in range(len(thermos)):
+    # build the commands for each thermostat
+    commands = villaecobeebatch.ThermostatCommands(ecobee)
+    for thermo in thermos:
         # make sure the thermostat is not off
-        set_therm_to_auto_if_off( ecobee, idx, thermos, debug=debug )
+        if thermo['settings']['hvacMode'] == 'off':
+            logger.info('set_temp_holds_all:thermo-is-off:%s:set-to:%s', thermo['name'], 'auto')
+            commands.set_hvac_mode(thermo, 'auto')
         # The prescribed way to do this
         #  1) if hvacMode is NOT 'auto', then set the cool and heat to the same value
         #  2) if hvacMode is 'auto', then set the cool and heat differently.
         #
-        # set a temperature hold - temperatue defined by therm mod and holdSetting value
-        # set_hold_temp(index, cool_temp, heat_temp, hold_type= nextTransition )
-        # result = ecobee.set_hold_temp(idx,holdSetting[hvacMode],holdSetting[hvacMode],hold_type=hold_type)
         # decided to fill this in with the cool/heat settings uniquely - not as the same value to deal with auto.
-        result = ecobee.set_hold_temp(idx,holdSetting['cool'],holdSetting['heat'],hold_type=hold_type)
+        commands.set_hold(thermo, holdSetting['cool'], holdSetting['heat'], hold_type=hold_type)
+
+    # send them - thermostats with the same changes go in one request
+    results = commands.send()
+
+    # loop through the thermometers
+    for idx in range(len(thermos)):
         # print out the results of setting the hold
-        logger.info('set_temp_holds_all:therm:%s:result:%s', therms[idx][0], result)
+        logger.info('set_temp_holds_all:therm:%s:result:%s', thermos[idx]['name'], results.get(thermos[idx]['identifier']))
         # debugging
         if debug:
             # pull the thermos data again
@@ -327,10 +408,13 @@ def turn_on_all_thermos( ecobee, debug=False ):
     # read in the current set of thermostats - so we have a list to work
     thermos=ecobee.get_thermostats()
 
-    # loop through the thermometers
-    for idx in range(len(thermos)):
-        # make sure the thermostat is not off
-        set_therm_to_auto_if_off( ecobee, idx, thermos, debug=debug )
+    # every thermostat that is off is set to auto in one request
+    commands = villaecobeebatch.ThermostatCommands(ecobee)
+    for thermo in thermos:
+        if thermo['settings']['hvacMode'] == 'off':
+            logger.info('turn_on_all_thermos:thermo-is-off:%s:set-to:%s', thermo['name'], 'auto')
+            commands.set_hvac_mode(thermo, 'auto')
+    commands.send()
 
 
 # set temperature holds on defined thermostat
@@ -420,6 +504,44 @@ def systemHoldOn_chk( therms, holdSetting, debug=False ):
     return True
 
     
+# actions returned by hold_decision
+HOLD_ACTION_NONE = 'none'
+HOLD_ACTION_SET = 'set'
+HOLD_ACTION_REMOVE = 'remove'
+
+# decide what to do with the temperature holds for this run - no side effects
+# so the same policy can be replayed against history (see villapolicysim.py)
+#
+#   occupied_today/occupied_tomorrow - the villa calendar has an entry for the day
+#   hour - current hour (0-23)
+#   sethold_hour - hour we must be past to set/remove holds on vacate/arrive days
+#   systemHoldOn - all thermostats already have our hold on
+#
+# returns (action, state) - action is one of HOLD_ACTION_* and
+# state is occupied, vacating, arriving or vacant
+#
+def hold_decision( occupied_today, occupied_tomorrow, hour, sethold_hour, systemHoldOn ):
+    if occupied_today and occupied_tomorrow:
+        # today and tomorrow are villa days no action
+        return HOLD_ACTION_NONE, 'occupied'
+    elif occupied_today:
+        # today but not tomorrow - late enough - set the hold
+        # 2025-02-14;kv removed the check for systemholdon and just force the update - dealing with the thermostats were turned off
+        if hour > sethold_hour:
+            return HOLD_ACTION_SET, 'vacating'
+        return HOLD_ACTION_NONE, 'vacating'
+    elif occupied_tomorrow:
+        # tomorrow is a villa day and today is not - late enough - remove the holds
+        # 2025-02-14;kv removed the check for systemholdon and just force the update - dealing with the thermostats were turned off
+        if hour > sethold_hour:
+            return HOLD_ACTION_REMOVE, 'arriving'
+        return HOLD_ACTION_NONE, 'arriving'
+    elif not systemHoldOn:
+        # today is not occupied and no holds on - so set a hold
+        return HOLD_ACTION_SET, 'vacant'
+    return HOLD_ACTION_NONE, 'vacant'
+
+
 # routine used to connect the application to a thermostat/account
 # used then the command line has "connect=True" on it
 #
@@ -535,12 +657,22 @@ if __name__ == '__main__':
         
     # create the ecobee object
     logger.info( "Building ecobee object - it may refresh the tokens and update config file:%s",optiondict['config_filename'] )
-    ecobee = pyecobee.Ecobee(api_key=optiondict['api_key'],config_filename=optiondict['config_filename'])
+    # tokens are only refreshed when the access token is about to expire (see villaecobeetoken.py)
+    ecobee = villaecobeetoken.ManagedTokenEcobee(api_key=optiondict['api_key'],config_filename=optiondict['config_filename'],safety_seconds=optiondict['token_safety_seconds'])
+    if optiondict['revision_cache_filename']:
+        # only pull thermostats whose revisions changed since the last run
+        ecobee = villaecobeecache.RevisionGatedEcobee( ecobee, optiondict['revision_cache_filename'] )
 #    ecobee = pyecobee.Ecobee(config_filename=optiondict['config_filename'], config={'API_KEY': optiondict['api_key']})
 
+    # define where the temperature readings are saved
+    history = villahistory.open_history( optiondict['history_backend'], optiondict['temperature_filename'], optiondict['history_dirname'], fsync=optiondict['history_fsync'] )
+    if optiondict['rollup_dirname']:
+        # keep the plot rollups current - each poll updates the bins it falls in
+        history = villahistory.MultiHistory( [history, villarollup.RollupHistory( optiondict['rollup_dirname'] )] )
+
     # read in therms, save data, get therm values, and determine if the villa is occupied
-    logger.info( 'Fetch ecobee thermostat data - save temp readings to file:%s', optiondict['temperature_filename'])
-    therms, occupied = readSave_thermoSensor_rtn_therms(ecobee, optiondict['temperature_filename'], debug=debug )
+    logger.info( 'Fetch ecobee thermostat data - save temp readings to:%s:%s', optiondict['history_backend'], optiondict['temperature_filename'] if optiondict['history_backend'] == 'text' else optiondict['history_dirname'])
+    therms, occupied = readSave_thermoSensor_rtn_therms(ecobee, optiondict['temperature_filename'], debug=debug, history=history )
 
     # validate that we were authenticated after we called in
     if not ecobee.authenticated:
@@ -559,56 +691,62 @@ if __name__ == '__main__':
     # read in the villa occupancy information
     logger.info('Read in villa occupancy data from file:%s', optiondict['occupy_filename'])
     villacal = load_villa_calendar( optiondict['occupy_filename'], optiondict['fldDate'], debug=debug )
+    logger.info('occtype:today:%s:tomorrow:%s', villacal.occtype(today), villacal.occtype(tomorrow))
 
     # read in the villa starts informatoin
     #logger.info('Read in villa occupancy data from file:%s', optiondict['occupy_filename'])
     #villastarts = load_villa_calendar( optiondict['starts_filename'], optiondict['fldDate'], debug=debug )
 
     # simple test - create a message if thermostats say we are occupied and stays says we should not be
-    if occupied and today_str not in villacal:
-        msgid = kvgmailsendsimple.gmail_send_simple_message(
-            optiondict['occupied_email_from'],
-            optiondict['occupied_email_to'],
-            optiondict['occupied_email_subject'],
-            optiondict['occupied_email_body'],
-            optiondict['scopes'],
-            optiondict['file_token_json'],
-            optiondict['file_credentials_json']
-        )
-        # log message
-        logger.info('Villa occupied when stays.txt says not: %s', msgid['id'])
+    # the hub only repeats the message every occupied_suppress_hours while this holds
+    if optiondict['outbox_filename']:
+        # saved to the outbox and sent by a worker thread while we work on the holds
+        outbox = villaoutbox.Outbox( optiondict['outbox_filename'] )
+        worker = villaoutbox.start_worker( outbox, villaoutbox.gmail_send( optiondict['scopes'], optiondict['file_token_json'], optiondict['file_credentials_json'] ) )
+        sender = outbox.sender()
+    else:
+        worker = None
+        sender = villanotify.gmail_sender( optiondict['scopes'], optiondict['file_token_json'], optiondict['file_credentials_json'] )
+    with villanotify.open_hub( optiondict['notify_state_filename'], sender, digest_seconds=optiondict['notify_digest_minutes']*60 ) as hub:
+        if occupied and today not in villacal:
+            msgid = hub.publish(
+                'villa_occupied',
+                optiondict['occupied_email_subject'],
+                optiondict['occupied_email_body'],
+                optiondict['occupied_email_from'],
+                optiondict['occupied_email_to'],
+                suppress_seconds=optiondict['occupied_suppress_hours']*3600
+            )
+            # log message
+            logger.info('Villa occupied when stays.txt says not: %s:%s', msgid['id'], msgid['status'])
+        else:
+            # condition ended - the next time it happens we message right away
+            hub.clear('villa_occupied')
 
     
-    # set the hold on villa main if today is a start date and it is not already set
-    
-    # check to see if we are in an occupied day
-    if today_str in villacal and tomorrow_str in villacal:
-        # today and tomorrow are villa days no action
-        logger.info('Villa occupied:no action to take')
-    elif today_str in villacal:
-        # today but not tomorrow - check the time - late enough - set the hold
-        logger.info('Villa vacated today:current_hour:%d:update_after:%d:temp holds set:%s', today_hour, optiondict['sethold_hour'], systemHoldOn)
-        # 2025-02-14;kv removed the check for systemholdon and just force the update - dealing with the thermostats were turned off
-        #if not systemHoldOn and today_hour > optiondict['sethold_hour']:
-        if today_hour > optiondict['sethold_hour']:
-            logger.info('Villa vacated:set temperature holds')
+    # decide what to do with the holds
+    action, state = hold_decision( today in villacal, tomorrow in villacal, today_hour, optiondict['sethold_hour'], systemHoldOn )
+    logger.info('Villa state:%s:current_hour:%d:update_after:%d:temp holds set:%s:action:%s', state, today_hour, optiondict['sethold_hour'], systemHoldOn, action)
+
+    # take the action
+    if action == HOLD_ACTION_NONE:
+        logger.info('No action taken on this run')
+    elif optiondict['force_holds']:
+        if action == HOLD_ACTION_SET:
+            logger.info('Villa %s:set temperature holds', state)
             set_temp_holds_all( ecobee, therms, holdSetting, optiondict['holdType'], debug=debug )
-    elif tomorrow_str in villacal:
-        # if tomorrow is a villa day and today is not, remove holds if the occupant is owner or renter
-        logger.info('Villa occupied tomorrow:current_hour:%d:update_after:%d:temp holds set:%s', today_hour, optiondict['sethold_hour'], systemHoldOn)
-        logger.info('Villa occupied tomorrow')
-        # 2025-02-14;kv removed the check for systemholdon and just force the update - dealing with the thermostats were turned off
-        #if systemHoldOn and today_hour > optiondict['sethold_hour']:
-        if today_hour > optiondict['sethold_hour']:
+        else:
             # renter or owner - remove temp holds
-            logger.info('Villa occupied tomorrow:remove holds')
+            logger.info('Villa %s:remove holds', state)
             remove_temp_holds_all( ecobee, debug=debug )
-    elif not systemHoldOn:
-        # today is not occupied and no holds on - so set a hold
-        logger.info('Villa not occupied:set temp holds')
-        set_temp_holds_all( ecobee, therms, holdSetting, optiondict['holdType'], debug=debug )
     else:
-        logger.info('No action taken on this run')
+        # only send what differs from the thermostats we just read
+        desired = villaecobeereconcile.desired_state( action, holdSetting, optiondict['holdType'] )
+        changed = villaecobeereconcile.reconcile( ecobee, ecobee.thermostats, desired )
+        logger.info('Villa %s:%s holds:thermostats changed:%s', state, action, changed)
 
-# eof
+    # give the outbox worker a little time to send what this run queued
+    if worker is not None:
+        worker.stop( optiondict['outbox_wait_seconds'] )
 
+# eof
@@ -0,0 +1,146 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Batched thermostat commands for villaecobee.py
+
+The ecobee update call (POST /1/thermostat) takes a selection of
+thermostat identifiers and applies the thermostat settings and functions
+in the body to every thermostat selected.  ThermostatCommands collects
+the hold/resume/mode changes for each thermostat, groups the thermostats
+that need exactly the same changes and sends one request per group -
+so a house where every thermostat gets the same hold is one request.
+
+If a group request fails, each thermostat in the group is sent on its
+own so one bad thermostat does not block the others.
+
+    commands = villaecobeebatch.ThermostatCommands(ecobee)
+    for thermo in ecobee.get_thermostats():
+        commands.set_hold(thermo, 80.0, 55.0, 'indefinite')
+    results = commands.send()
+
+'''
+import json
+import logging
+import requests
+
+import villaecobeecache
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# ecobee status codes that mean the access token must be refreshed
+TOKEN_STATUS_CODES = (14, 16)
+
+
+def build_update_body(identifiers, settings=None, functions=None):
+    '''
+    body for POST /1/thermostat that applies settings/functions to the listed thermostats
+    '''
+    body = {'selection': {'selectionType': 'thermostats', 'selectionMatch': ','.join(identifiers)}}
+    if settings:
+        body['thermostat'] = {'settings': settings}
+    if functions:
+        body['functions'] = functions
+    return body
+
+
+class ThermostatCommands(object):
+    '''
+    collect commands by thermostat and send them in as few update requests as possible
+    '''
+
+    def __init__(self, ecobee, api_url=None):
+        self.ecobee = ecobee
+        self.api_url = api_url or villaecobeecache.ECOBEE_API_URL
+        # identifier -> {'name':, 'settings': {}, 'functions': []} - in the order thermostats were added
+        self.commands = dict()
+        # number of update requests sent by the last send
+        self.requests_sent = 0
+
+    def _thermostat(self, thermo):
+        # the command entry for this thermostat object
+        if thermo['identifier'] not in self.commands:
+            self.commands[thermo['identifier']] = {'name': thermo['name'], 'settings': {}, 'functions': []}
+        return self.commands[thermo['identifier']]
+
+    def set_hvac_mode(self, thermo, hvac_mode):
+        self._thermostat(thermo)['settings']['hvacMode'] = hvac_mode
+
+    def set_hold(self, thermo, cool_temp, heat_temp, hold_type='nextTransition'):
+        self._thermostat(thermo)['functions'].append({'type': 'setHold', 'params': {
+            'holdType': hold_type,
+            'coolHoldTemp': int(cool_temp * 10),
+            'heatHoldTemp': int(heat_temp * 10),
+        }})
+
+    def resume_program(self, thermo, resume_all=False):
+        self._thermostat(thermo)['functions'].append({'type': 'resumeProgram', 'params': {
+            'resumeAll': resume_all,
+        }})
+
+    def groups(self):
+        '''
+        list of (identifiers, settings, functions) - thermostats with identical changes share a group
+        '''
+        grouped = dict()
+        for identifier, command in self.commands.items():
+            if not command['settings'] and not command['functions']:
+                continue
+            key = json.dumps([command['settings'], command['functions']], sort_keys=True)
+            if key not in grouped:
+                grouped[key] = ([], command['settings'], command['functions'])
+            grouped[key][0].append(identifier)
+        return list(grouped.values())
+
+    def _post(self, body, retry=True):
+        # send an update - refresh tokens and retry once when the token expired
+        header = {'Content-Type': 'application/json;charset=UTF-8',
+                  'Authorization': 'Bearer ' + self.ecobee.access_token}
+        self.requests_sent += 1
+        try:
+            request = requests.post(self.api_url + villaecobeecache.ECOBEE_THERMOSTAT_PATH,
+                                    headers=header, params={'format': 'json'}, json=body)
+        except requests.exceptions.RequestException as e:
+            logger.warning('Error connecting to Ecobee:update:%s', e)
+            return False
+        if request.status_code == requests.codes.ok:
+            return True
+        try:
+            status = request.json()['status']['code']
+        except (ValueError, KeyError, TypeError):
+            status = None
+        logger.info('Error from Ecobee:update:%s:status:%s', body['selection']['selectionMatch'], status)
+        if retry and status in TOKEN_STATUS_CODES and self.ecobee.refresh_tokens():
+            return self._post(body, retry=False)
+        return False
+
+    def send(self):
+        '''
+        send every collected command
+
+        returns dict of identifier -> True/False (the change was accepted)
+        '''
+        results = dict()
+        self.requests_sent = 0
+        for identifiers, settings, functions in self.groups():
+            if self._post(build_update_body(identifiers, settings, functions)):
+                results.update((x, True) for x in identifiers)
+                continue
+            if len(identifiers) == 1:
+                results[identifiers[0]] = False
+                continue
+            # the group failed - send each thermostat on its own
+            logger.info('send:group failed - sending per thermostat:%s', identifiers)
+            for identifier in identifiers:
+                results[identifier] = self._post(build_update_body([identifier], settings, functions))
+        logger.info('send:thermostats:%d:requests:%d:failed:%d', len(results), self.requests_sent,
+                    list(results.values()).count(False))
+        self.commands = dict()
+        return results
+
+
+# eof
@@ -0,0 +1,224 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Revision gated thermostat fetch for villaecobee.py
+
+ecobee publishes a lightweight summary (thermostatSummary) that lists
+the revision strings for each registered thermostat.  We keep the last
+full thermostat objects and their revisions in a json cache file and
+only request the full thermostat payload for thermostats whose
+runtime or thermostat (settings/program/events) revision changed.
+
+RevisionGatedEcobee wraps a pyecobee.Ecobee object - every other
+attribute/method is passed through to the wrapped object - so it can
+be handed to any routine in villaecobee.py that takes an ecobee object.
+
+'''
+import os
+import json
+import logging
+import requests
+import pyecobee
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# ecobee api end points - the base url can be pointed at a stand-in server
+ECOBEE_API_URL = 'https://api.ecobee.com'
+ECOBEE_SUMMARY_PATH = '/1/thermostatSummary'
+ECOBEE_THERMOSTAT_PATH = '/1/thermostat'
+
+# what we ask for when we pull full thermostat objects (same as pyecobee.get_thermostats)
+THERMOSTAT_INCLUDES = {
+    'includeRuntime': 'true',
+    'includeSensors': 'true',
+    'includeProgram': 'true',
+    'includeEquipmentStatus': 'true',
+    'includeEvents': 'true',
+    'includeWeather': 'true',
+    'includeSettings': 'true',
+}
+
+# the revisions that tell us the thermostat data we care about changed
+REVISION_KEYS = ('thermostatRev', 'runtimeRev')
+
+
+def parse_revision_list(revision_list):
+    '''
+    convert the thermostatSummary revisionList into a dict keyed by identifier
+
+    each entry is:  identifier:name:connected:thermostatRev:alertsRev:runtimeRev:intervalRev
+    '''
+    revisions = dict()
+    for entry in revision_list:
+        parts = entry.split(':')
+        if len(parts) < 7:
+            logger.warning('parse_revision_list:unexpected entry:%s', entry)
+            continue
+        # the name could hold a colon - so pull fields from both ends
+        connected, thermostatRev, alertsRev, runtimeRev, intervalRev = parts[-5:]
+        revisions[parts[0]] = {
+            'name': ':'.join(parts[1:-5]),
+            'connected': connected == 'true',
+            'thermostatRev': thermostatRev,
+            'alertsRev': alertsRev,
+            'runtimeRev': runtimeRev,
+            'intervalRev': intervalRev,
+        }
+    return revisions
+
+
+def load_revision_cache(cache_filename):
+    '''
+    read the revision cache - return an empty cache if the file is missing or unreadable
+    '''
+    cache = {'revisions': {}, 'thermostats': {}}
+    if cache_filename and os.path.isfile(cache_filename):
+        try:
+            with open(cache_filename, 'r') as t:
+                cache.update(json.load(t))
+        except (OSError, ValueError) as e:
+            logger.warning('load_revision_cache:unable to read:%s:%s', cache_filename, e)
+    return cache
+
+
+def save_revision_cache(cache_filename, cache):
+    '''
+    write the revision cache - temp file and rename so a reader never sees a partial file
+    '''
+    tmp_filename = cache_filename + '.tmp'
+    with open(tmp_filename, 'w') as t:
+        json.dump(cache, t)
+    os.replace(tmp_filename, cache_filename)
+
+
+class DeferredEcobee(pyecobee.Ecobee):
+    '''
+    pyecobee.Ecobee that does not pull every thermostat while it is being built
+    the first get_thermostats call (or RevisionGatedEcobee) does the fetch
+    '''
+
+    def update(self):
+        pass
+
+
+class RevisionGatedEcobee(object):
+    '''
+    pyecobee.Ecobee wrapper that serves unchanged thermostats from the revision cache
+    '''
+
+    def __init__(self, ecobee, cache_filename, api_url=None):
+        self.ecobee = ecobee
+        self.cache_filename = cache_filename
+        self.api_url = api_url or ECOBEE_API_URL
+        self.cache = load_revision_cache(cache_filename)
+        # identifiers of the thermostats returned from the cache on the last get_thermostats
+        self.served_from_cache = set()
+
+    def __getattr__(self, attr):
+        # everything we do not define is handled by the wrapped ecobee object
+        return getattr(self.ecobee, attr)
+
+    def _get(self, path, selection, retry=True):
+        # issue a GET against the api - refresh tokens and retry once on auth failures
+        header = {'Content-Type': 'application/json;charset=UTF-8',
+                  'Authorization': 'Bearer ' + self.ecobee.access_token}
+        params = {'json': json.dumps({'selection': selection})}
+        try:
+            request = requests.get(self.api_url + path, headers=header, params=params)
+        except requests.exceptions.RequestException as e:
+            logger.warning('Error connecting to Ecobee:%s:%s', path, e)
+            return None
+        if request.status_code == requests.codes.ok:
+            return request.json()
+        logger.info('Error from Ecobee:%s:status:%s', path, request.status_code)
+        if retry and self.ecobee.refresh_tokens():
+            return self._get(path, selection, retry=False)
+        return None
+
+    def get_summary(self):
+        '''
+        call thermostatSummary and return the revisions keyed by identifier (None on failure)
+        '''
+        result = self._get(ECOBEE_SUMMARY_PATH, {'selectionType': 'registered', 'selectionMatch': ''})
+        if result is None or 'revisionList' not in result:
+            return None
+        return parse_revision_list(result['revisionList'])
+
+    def fetch_thermostats(self, identifiers):
+        '''
+        pull the full thermostat objects for a list of identifiers (None on failure)
+        '''
+        selection = {'selectionType': 'thermostats', 'selectionMatch': ','.join(identifiers)}
+        selection.update(THERMOSTAT_INCLUDES)
+        result = self._get(ECOBEE_THERMOSTAT_PATH, selection)
+        if result is None or 'thermostatList' not in result:
+            return None
+        return result['thermostatList']
+
+    def changed_identifiers(self, revisions):
+        '''
+        list of identifiers whose revisions differ from the cache (or are not cached)
+        '''
+        changed = []
+        for identifier, rev in revisions.items():
+            cached = self.cache['revisions'].get(identifier)
+            if (identifier not in self.cache['thermostats'] or not cached
+                    or any(cached.get(key) != rev[key] for key in REVISION_KEYS)):
+                changed.append(identifier)
+        return changed
+
+    def _full_fetch(self):
+        # fall back to the pyecobee full fetch and reseed the cache from it
+        thermos = self.ecobee.get_thermostats()
+        self.served_from_cache = set()
+        if thermos:
+            self.cache = {'revisions': {}, 'thermostats': {x['identifier']: x for x in thermos}}
+            save_revision_cache(self.cache_filename, self.cache)
+        return thermos
+
+    def get_thermostats(self):
+        '''
+        same result as pyecobee.Ecobee.get_thermostats - but only changed thermostats are pulled
+        '''
+        revisions = self.get_summary()
+        if revisions is None:
+            logger.info('get_thermostats:summary not available - full fetch')
+            return self._full_fetch()
+
+        # pull what changed
+        changed = self.changed_identifiers(revisions)
+        if changed:
+            thermos = self.fetch_thermostats(changed)
+            if thermos is None:
+                logger.info('get_thermostats:fetch of changed thermostats failed - full fetch')
+                return self._full_fetch()
+            for thermo in thermos:
+                self.cache['thermostats'][thermo['identifier']] = thermo
+            for identifier in changed:
+                self.cache['revisions'][identifier] = {key: revisions[identifier][key] for key in REVISION_KEYS}
+
+        # forget thermostats that are no longer registered
+        for identifier in list(self.cache['thermostats']):
+            if identifier not in revisions:
+                del self.cache['thermostats'][identifier]
+                self.cache['revisions'].pop(identifier, None)
+
+        if changed:
+            save_revision_cache(self.cache_filename, self.cache)
+
+        logger.info('get_thermostats:registered:%d:fetched:%d', len(revisions), len(changed))
+
+        # build the list in registered order - pyecobee calls work by index into this list
+        self.served_from_cache = set(revisions) - set(changed)
+        thermos = [self.cache['thermostats'][x] for x in revisions if x in self.cache['thermostats']]
+        self.ecobee.thermostats = thermos
+        self.ecobee.authenticated = True
+        return thermos
+
+
+# eof
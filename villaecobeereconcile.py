@@ -0,0 +1,118 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Desired state reconciler for the villaecobee.py temperature holds
+
+villaecobee.hold_decision says what the house should look like this run
+(holds set or holds removed).  Rather than write the holds to every
+thermostat on every run we build the desired state for each thermostat
+(hvac mode on, heat/cool hold and hold type - or no hold) and compare it
+to the thermostat objects we just read.  Only the differences are sent
+(batched through villaecobeebatch) so a house that is already in the
+right state costs no api calls, while a thermostat a guest changed or
+turned off is put back.
+
+'''
+import logging
+
+import villaecobeebatch
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# the mode we set a thermostat to when it was turned off
+MODE_OFF = 'off'
+MODE_ON = 'auto'
+
+# change names reported by thermostat_changes
+CHANGE_MODE = 'mode'
+CHANGE_HOLD = 'hold'
+CHANGE_RESUME = 'resume'
+
+
+def desired_state(action, holdSetting, hold_type):
+    '''
+    desired state for every thermostat from a villaecobee.hold_decision action
+
+    returns None when the action does not call for a change - otherwise dict of:
+        hold - (cool, heat) hold in degrees or None for no hold
+        hold_type - ecobee hold type used when the hold is set
+    '''
+    if action == 'set':
+        return {'hold': (holdSetting['cool'], holdSetting['heat']), 'hold_type': hold_type}
+    elif action == 'remove':
+        return {'hold': None, 'hold_type': None}
+    return None
+
+
+def current_hold(thermo):
+    '''
+    the hold event on this thermostat (None when no hold is on)
+    '''
+    for event in thermo.get('events') or []:
+        if event.get('type', 'hold') == 'hold' and event.get('running', True):
+            return event
+    return None
+
+
+def thermostat_changes(thermo, desired):
+    '''
+    list of changes (CHANGE_*) needed to bring this thermostat object to the desired state
+    '''
+    changes = []
+    if thermo['settings']['hvacMode'] == MODE_OFF:
+        changes.append(CHANGE_MODE)
+
+    hold = current_hold(thermo)
+    if desired['hold'] is None:
+        if hold is not None:
+            changes.append(CHANGE_RESUME)
+    elif (hold is None
+          or int(hold['coolHoldTemp']) != int(10 * desired['hold'][0])
+          or int(hold['heatHoldTemp']) != int(10 * desired['hold'][1])
+          or hold.get('holdType', desired['hold_type']) != desired['hold_type']):
+        # not all ecobee events report the holdType - we only compare it when it is there
+        changes.append(CHANGE_HOLD)
+    return changes
+
+
+def reconcile(ecobee, thermos, desired):
+    '''
+    send only the commands needed to bring the thermostats to the desired state
+
+    ecobee - pyecobee.Ecobee (or villaecobeecache.RevisionGatedEcobee)
+    thermos - thermostat objects just read from ecobee (ecobee.thermostats)
+    desired - desired_state result
+
+    returns dict of thermostat name -> list of changes sent (thermostats in the desired state are left out)
+    '''
+    commands = villaecobeebatch.ThermostatCommands(ecobee)
+    changed = dict()
+    for thermo in thermos:
+        changes = thermostat_changes(thermo, desired)
+        logger.info('reconcile:therm:%s:changes:%s', thermo['name'], changes)
+        if not changes:
+            continue
+        changed[thermo['name']] = changes
+        if CHANGE_MODE in changes:
+            commands.set_hvac_mode(thermo, MODE_ON)
+        if CHANGE_HOLD in changes:
+            commands.set_hold(thermo, desired['hold'][0], desired['hold'][1], hold_type=desired['hold_type'])
+        if CHANGE_RESUME in changes:
+            commands.resume_program(thermo, resume_all=True)
+
+    if changed:
+        results = commands.send()
+        for thermo in thermos:
+            if thermo['identifier'] in results:
+                logger.info('reconcile:therm:%s:result:%s', thermo['name'], results[thermo['identifier']])
+    else:
+        logger.info('reconcile:thermostats in desired state - nothing sent')
+    return changed
+
+
+# eof
@@ -0,0 +1,502 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.02
+
+Local stand-in for the ecobee cloud api and a replay harness for villaecobee.py
+
+The stand-in server answers the calls pyecobee (and villaecobeecache) make:
+  GET  /authorize              - pin request
+  POST /token                  - token request/refresh
+  GET  /1/thermostat           - thermostat objects (registered or a list of identifiers)
+  GET  /1/thermostatSummary    - revision list
+  POST /1/thermostat           - setHold, resumeProgram and settings updates (hvacMode)
+
+Thermostat data comes from a recorded json fixture (fixtures/ecobee_thermostats.json)
+and holds/mode changes are applied to the in memory copy so later reads see them.
+Latency and errors can be injected to test failure handling.
+
+The harness (run_villaecobee) runs villaecobee.py as __main__ in a work directory
+with every request to api.ecobee.com sent to the stand-in and gmail messages
+captured instead of sent - so runs can be benchmarked with no network.
+
+    python villaecobeesim.py scenario=vacant runs=10
+
+'''
+import os
+import sys
+import json
+import time
+import copy
+import random
+import runpy
+import datetime
+import threading
+import contextlib
+import http.server
+import urllib.parse
+import logging
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.02'
+
+# what we stand in for
+ECOBEE_API_URL = 'https://api.ecobee.com'
+
+# default fixture and the scenarios the harness can build stays.txt for
+FIXTURE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ecobee_thermostats.json')
+VILLAECOBEE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'villaecobee.py')
+SCENARIOS = ['occupied', 'vacating', 'arriving', 'vacant']
+
+# ecobee status codes we hand back
+STATUS_OK = {'code': 0, 'message': ''}
+STATUS_AUTH_EXPIRED = {'code': 14, 'message': 'Authentication token has expired. Refresh your tokens.'}
+STATUS_PROCESSING_ERROR = {'code': 3, 'message': 'Processing error. Injected by stand-in.'}
+
+
+class EcobeeStandIn(object):
+    '''
+    in memory ecobee account served over http on localhost
+    '''
+
+    def __init__(self, fixture_filename=None, latency=0.0, error_rate=0.0, seed=0, port=0):
+        with open(fixture_filename or FIXTURE_FILENAME, 'r') as t:
+            self.thermostats = json.load(t)['thermostatList']
+        self.latency = latency
+        self.error_rate = error_rate
+        # number of upcoming api calls that fail no matter what (error injection)
+        self.fail_next = 0
+        # updates that select any of these thermostat identifiers fail (error injection)
+        self.fail_identifiers = set()
+        self.random = random.Random(seed)
+        self.port = port
+        self.access_token = 'standin-access-0'
+        self.refresh_token = 'standin-refresh-0'
+        self.token_count = 0
+        # every request handled - (method, path, detail)
+        self.calls = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def start(self):
+        '''
+        start serving on a background thread
+        '''
+        standin = self
+
+        class Handler(EcobeeStandInHandler):
+            pass
+        Handler.standin = standin
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info('EcobeeStandIn:listening:%s', self.url)
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def call_counts(self):
+        '''
+        number of calls by (method, path, detail)
+        '''
+        counts = dict()
+        for call in self.calls:
+            counts[call] = counts.get(call, 0) + 1
+        return counts
+
+    def expire_token(self):
+        '''
+        invalidate the current access token - the next api call gets status 14
+        '''
+        with self.lock:
+            self.access_token = 'standin-expired'
+
+    def tick(self, minutes=15):
+        '''
+        advance thermostat time and readings - changes the runtime revision
+        '''
+        with self.lock:
+            for thermo in self.thermostats:
+                now = datetime.datetime.strptime(thermo['thermostatTime'], '%Y-%m-%d %H:%M:%S')
+                now += datetime.timedelta(minutes=minutes)
+                thermo['thermostatTime'] = now.strftime('%Y-%m-%d %H:%M:%S')
+                thermo['runtime']['runtimeRev'] = now.strftime('%y%m%d%H%M%S')
+                for sensor in thermo['remoteSensors']:
+                    for capability in sensor['capability']:
+                        if capability['type'] == 'temperature':
+                            capability['value'] = str(int(capability['value']) + self.random.choice((-3, 0, 3)))
+
+    def _bump_thermostat_rev(self, thermo):
+        thermo['thermostatRev'] = '%s%04d' % (thermo['thermostatTime'][2:10].replace('-', ''), self.random.randint(0, 9999))
+
+    def selected(self, selection):
+        '''
+        thermostats that match an api selection
+        '''
+        if selection.get('selectionType') == 'thermostats':
+            ids = selection.get('selectionMatch', '').split(',')
+            return [x for x in self.thermostats if x['identifier'] in ids]
+        return list(self.thermostats)
+
+    def inject_error(self):
+        '''
+        decide if this call fails (fail_next or error_rate)
+        '''
+        with self.lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+            return self.error_rate and self.random.random() < self.error_rate
+
+    def new_tokens(self):
+        with self.lock:
+            self.token_count += 1
+            self.access_token = 'standin-access-%d' % self.token_count
+            self.refresh_token = 'standin-refresh-%d' % self.token_count
+            return {'access_token': self.access_token, 'token_type': 'Bearer',
+                    'refresh_token': self.refresh_token, 'expires_in': 3599, 'scope': 'smartWrite'}
+
+    def apply_update(self, body):
+        '''
+        apply a POST /1/thermostat body to the selected thermostats
+        returns the list of function types applied (for the call log)
+        '''
+        applied = []
+        with self.lock:
+            thermos = self.selected(body.get('selection', {}))
+            for function in body.get('functions', []):
+                params = function.get('params', {})
+                applied.append(function['type'])
+                for thermo in thermos:
+                    if function['type'] == 'setHold':
+                        thermo['events'] = [{
+                            'type': 'hold',
+                            'name': 'auto',
+                            'running': True,
+                            'holdClimateRef': params.get('holdClimateRef', ''),
+                            'coolHoldTemp': params.get('coolHoldTemp', thermo['runtime']['desiredCool']),
+                            'heatHoldTemp': params.get('heatHoldTemp', thermo['runtime']['desiredHeat']),
+                            'fan': params.get('fan', 'auto'),
+                            'holdType': params.get('holdType'),
+                        }]
+                    elif function['type'] == 'resumeProgram':
+                        thermo['events'] = []
+                    self._bump_thermostat_rev(thermo)
+            if 'thermostat' in body:
+                applied.append('update')
+                for thermo in thermos:
+                    for section, values in body['thermostat'].items():
+                        thermo.setdefault(section, {}).update(values)
+                    self._bump_thermostat_rev(thermo)
+        return applied
+
+
+class EcobeeStandInHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    http handler - the standin attribute is set on a subclass per server
+    '''
+    standin = None
+
+    def log_message(self, fmt, *args):
+        logger.debug('EcobeeStandInHandler:' + fmt, *args)
+
+    def _reply(self, code, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start(self):
+        # common request handling - returns (path, query) or None when we already replied
+        standin = self.standin
+        if standin.latency:
+            time.sleep(standin.latency)
+        parsed = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        if standin.inject_error():
+            standin.calls.append((self.command, parsed.path, 'error'))
+            self._reply(500, {'status': STATUS_PROCESSING_ERROR})
+            return None
+        return parsed.path, query
+
+    def _authorized(self, path):
+        # api calls must carry the current access token
+        if self.headers.get('Authorization') != 'Bearer ' + self.standin.access_token:
+            self.standin.calls.append((self.command, path, 'auth-expired'))
+            self._reply(500, {'status': STATUS_AUTH_EXPIRED})
+            return False
+        return True
+
+    def do_GET(self):
+        started = self._start()
+        if not started:
+            return
+        path, query = started
+        standin = self.standin
+
+        if path == '/authorize':
+            standin.calls.append(('GET', path, ''))
+            self._reply(200, {'ecobeePin': 'STND', 'code': 'standin-code', 'scope': 'smartWrite',
+                              'expires_in': 900, 'interval': 30})
+            return
+
+        if not self._authorized(path):
+            return
+        selection = json.loads(query.get('json', '{}')).get('selection', {})
+
+        if path == '/1/thermostat':
+            standin.calls.append(('GET', path, selection.get('selectionType', '')))
+            with standin.lock:
+                thermos = copy.deepcopy(standin.selected(selection))
+            self._reply(200, {'page': {'page': 1, 'totalPages': 1, 'pageSize': len(thermos), 'total': len(thermos)},
+                              'thermostatList': thermos, 'status': STATUS_OK})
+        elif path == '/1/thermostatSummary':
+            standin.calls.append(('GET', path, ''))
+            with standin.lock:
+                revisions = ['%s:%s:true:%s:0:%s:%s' % (x['identifier'], x['name'], x['thermostatRev'],
+                                                        x['runtime']['runtimeRev'], x['runtime']['runtimeRev'])
+                             for x in standin.thermostats]
+            self._reply(200, {'thermostatCount': len(revisions), 'revisionList': revisions, 'status': STATUS_OK})
+        else:
+            standin.calls.append(('GET', path, 'not-found'))
+            self._reply(404, {'status': {'code': 404, 'message': 'not found'}})
+
+    def do_POST(self):
+        started = self._start()
+        if not started:
+            return
+        path, query = started
+        standin = self.standin
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if path == '/token':
+            standin.calls.append(('POST', path, query.get('grant_type', '')))
+            self._reply(200, standin.new_tokens())
+            return
+
+        if not self._authorized(path):
+            return
+
+        if path == '/1/thermostat':
+            body = json.loads(body or b'{}')
+            selected = set(x['identifier'] for x in standin.selected(body.get('selection', {})))
+            if selected & standin.fail_identifiers:
+                standin.calls.append(('POST', path, 'error'))
+                self._reply(500, {'status': STATUS_PROCESSING_ERROR})
+                return
+            applied = standin.apply_update(body)
+            standin.calls.append(('POST', path, ','.join(applied)))
+            self._reply(200, {'status': STATUS_OK})
+        else:
+            standin.calls.append(('POST', path, 'not-found'))
+            self._reply(404, {'status': {'code': 404, 'message': 'not found'}})
+
+
+@contextlib.contextmanager
+def redirect_ecobee(url):
+    '''
+    send every requests call made to api.ecobee.com to url instead
+    '''
+    import requests
+
+    orig_request = requests.sessions.Session.request
+
+    def request(self, method, url_requested, *args, **kwargs):
+        if url_requested.startswith(ECOBEE_API_URL):
+            url_requested = url + url_requested[len(ECOBEE_API_URL):]
+        return orig_request(self, method, url_requested, *args, **kwargs)
+
+    # requests.get/post call Session.request(method=, url=)
+    def request_kw(self, method=None, url=None, *args, **kwargs):
+        return request(self, method, url, *args, **kwargs)
+
+    requests.sessions.Session.request = request_kw
+    try:
+        yield
+    finally:
+        requests.sessions.Session.request = orig_request
+
+
+@contextlib.contextmanager
+def capture_gmail(sent):
+    '''
+    capture gmail messages into the sent list instead of sending them
+    '''
+    import kvgmailsendsimple
+
+    orig = (kvgmailsendsimple.gmail_send_simple_message, kvgmailsendsimple.gmail_service,
+            kvgmailsendsimple.gmail_send_service_message)
+
+    def send(email_from, email_to, email_subject, email_body, *args, **kwargs):
+        sent.append({'from': email_from, 'to': email_to, 'subject': email_subject, 'body': email_body})
+        return {'id': 'standin-%d' % len(sent)}
+
+    # the outbox worker sends through a shared service - capture that path too
+    kvgmailsendsimple.gmail_send_simple_message = send
+    kvgmailsendsimple.gmail_service = lambda *args, **kwargs: None
+    kvgmailsendsimple.gmail_send_service_message = lambda service, *args: send(*args)
+    try:
+        yield
+    finally:
+        (kvgmailsendsimple.gmail_send_simple_message, kvgmailsendsimple.gmail_service,
+         kvgmailsendsimple.gmail_send_service_message) = orig
+
+
+def write_stays_file(occupy_filename, scenario, today=None):
+    '''
+    create a stays.txt that puts the villa in the scenario for today
+    '''
+    if today is None:
+        today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    dates = {
+        'occupied': [today, tomorrow],
+        'vacating': [today - datetime.timedelta(days=1), today],
+        'arriving': [tomorrow, tomorrow + datetime.timedelta(days=1)],
+        'vacant': [today - datetime.timedelta(days=10)],
+    }[scenario]
+    with open(occupy_filename, 'w') as t:
+        t.write('date,occtype\n')
+        for stay_date in dates:
+            t.write('%s,R\n' % stay_date.strftime('%m/%d/%Y'))
+
+
+def setup_workdir(workdir, standin, scenario):
+    '''
+    create the files villaecobee.py needs in the work directory
+    '''
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    with open(os.path.join(workdir, 'ecobee.conf'), 'w') as t:
+        json.dump({'API_KEY': 'standin-api-key', 'ACCESS_TOKEN': standin.access_token,
+                   'REFRESH_TOKEN': standin.refresh_token, 'AUTHORIZATION_CODE': 'standin-code'}, t)
+    write_stays_file(os.path.join(workdir, 'stays.txt'), scenario)
+
+
+def run_villaecobee(standin, workdir, args=None):
+    '''
+    run villaecobee.py as __main__ in workdir against the stand-in
+
+    args - list of key=value command line settings
+    returns dict of elapsed seconds, exit code, api calls made and emails captured
+    '''
+    calls_before = len(standin.calls)
+    sent = []
+    exit_code = 0
+    orig_argv = sys.argv
+    orig_cwd = os.getcwd()
+    sys.argv = [VILLAECOBEE_FILENAME, 'conf_json='] + list(args or [])
+    start = time.perf_counter()
+    try:
+        os.chdir(workdir)
+        with redirect_ecobee(standin.url), capture_gmail(sent):
+            runpy.run_path(VILLAECOBEE_FILENAME, run_name='__main__')
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    finally:
+        elapsed = time.perf_counter() - start
+        os.chdir(orig_cwd)
+        sys.argv = orig_argv
+    return {'elapsed': elapsed, 'exit_code': exit_code, 'calls': standin.calls[calls_before:], 'emails': sent}
+
+
+# ---------------------------------------------------------------------------
+if __name__ == '__main__':
+    import tempfile
+    import kvutil
+
+    # application variables
+    optiondictconfig = {
+        'AppVersion' : {
+            'value' : AppVersion,
+            'description' : 'defines the version number for the app',
+        },
+        'debug' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we are running in debug mode',
+        },
+        'fixture_filename' : {
+            'value' : FIXTURE_FILENAME,
+            'description' : 'defines the recorded thermostat json served by the stand-in',
+        },
+        'scenario' : {
+            'value' : 'vacant',
+            'type' : 'inlist',
+            'valid' : SCENARIOS,
+            'description' : 'defines the occupancy scenario written to stays.txt',
+        },
+        'runs' : {
+            'value' : 5,
+            'type' : 'int',
+            'description' : 'defines the number of villaecobee runs to make',
+        },
+        'latency' : {
+            'value' : 0.0,
+            'type' : 'float',
+            'description' : 'defines the seconds of latency added to every api call',
+        },
+        'error_rate' : {
+            'value' : 0.0,
+            'type' : 'float',
+            'description' : 'defines the fraction of api calls that fail (0.0-1.0)',
+        },
+        'sethold_hour' : {
+            'value' : -1,
+            'type' : 'int',
+            'description' : 'defines the sethold_hour passed to villaecobee (-1 acts at any hour)',
+        },
+        'workdir' : {
+            'value' : None,
+            'description' : 'defines the work directory (default: a temp directory)',
+        },
+        'villaecobee_args' : {
+            'value' : [],
+            'type' : 'liststr',
+            'description' : 'defines extra key=value settings passed to villaecobee (comma separated)',
+        },
+    }
+
+    # capture the command line
+    optiondict = kvutil.kv_parse_command_line( optiondictconfig, debug=False )
+    # villaecobee parses the command line again - so it only gets what we hand it
+    del sys.argv[1:]
+
+    workdir = optiondict['workdir'] or tempfile.mkdtemp(prefix='villaecobeesim')
+    standin = EcobeeStandIn(optiondict['fixture_filename'], latency=optiondict['latency'], error_rate=optiondict['error_rate'])
+    with standin:
+        setup_workdir(workdir, standin, optiondict['scenario'])
+        args = ['sethold_hour=%d' % optiondict['sethold_hour']] + [x for x in optiondict['villaecobee_args'] if x]
+        for run in range(optiondict['runs']):
+            result = run_villaecobee(standin, workdir, args)
+            print('run %2d: %7.3f sec exit:%s api calls:%2d emails:%d' % (
+                run + 1, result['elapsed'], result['exit_code'], len(result['calls']), len(result['emails'])))
+            standin.tick()
+
+    print('-' * 80)
+    print('workdir:', workdir)
+    for call, cnt in sorted(standin.call_counts().items()):
+        print('%5d  %s' % (cnt, ' '.join(x for x in call if x)))
+
+# eof
@@ -0,0 +1,182 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Expiry aware token handling for the ecobee configuration file (ecobee.conf)
+
+pyecobee.Ecobee keeps the api tokens in ecobee.conf but does not know when
+the access token expires - it refreshes after a call fails and rewrites
+the file in place.  Two runs that overlap (cron plus a manual run) can both
+refresh, and the one that loses holds a refresh token ecobee no longer
+accepts - which is when we have to go through the PIN process again.
+
+ManagedTokenEcobee:
+  - saves the access token expiry (ACCESS_TOKEN_EXPIRES - seconds since epoch) in ecobee.conf
+  - uses the access token as is while it is good - no refresh call
+  - refreshes when the token is within safety_seconds of expiring
+  - refreshes while holding a lock on the config file (ecobee.conf.lck) and
+    re-reads the file first - if another run already refreshed we use its tokens
+  - writes the file to a temp file and renames it over ecobee.conf
+
+Like villaecobeecache.DeferredEcobee it does not pull every thermostat
+while it is being built.
+
+'''
+import os
+import json
+import time
+import logging
+import requests
+
+import kvutil
+import villaecobeecache
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# ecobee token end point
+ECOBEE_TOKEN_PATH = '/token'
+
+# refresh when the access token expires within this many seconds
+TOKEN_SAFETY_SECONDS = 300
+
+# config file key holding the access token expiry
+EXPIRES_KEY = 'ACCESS_TOKEN_EXPIRES'
+
+# extension of the lock file kept next to the config file
+LOCK_EXT = '.lck'
+
+
+def read_config(config_filename):
+    '''
+    read the configuration file - empty dict when missing or unreadable
+    '''
+    if not os.path.isfile(config_filename):
+        return {}
+    try:
+        with open(config_filename, 'r') as t:
+            return json.load(t)
+    except (OSError, ValueError) as e:
+        logger.warning('read_config:unable to read:%s:%s', config_filename, e)
+        return {}
+
+
+def write_config(config_filename, config):
+    '''
+    write the configuration file - temp file and rename so a reader never sees a partial file
+    '''
+    tmp_filename = config_filename + '.tmp'
+    with open(tmp_filename, 'w') as t:
+        json.dump(config, t)
+    os.replace(tmp_filename, config_filename)
+
+
+class ManagedTokenEcobee(villaecobeecache.DeferredEcobee):
+    '''
+    pyecobee.Ecobee with expiry tracking and locked, atomic updates of the config file
+    '''
+
+    def __init__(self, config_filename=None, api_key=None, safety_seconds=TOKEN_SAFETY_SECONDS, api_url=None):
+        self.safety_seconds = safety_seconds
+        self.api_url = api_url or villaecobeecache.ECOBEE_API_URL
+        self.token_expires = 0
+        # number of token refresh calls made by this object
+        self.refresh_count = 0
+        super().__init__(config_filename=config_filename, api_key=api_key)
+        if not getattr(self, 'config_filename', None):
+            return
+        self.token_expires = read_config(self.config_filename).get(EXPIRES_KEY, 0)
+        # no refresh token - pyecobee already started the PIN process
+        if self.refresh_token:
+            self.ensure_token()
+
+    def lock_filename(self):
+        return self.config_filename + LOCK_EXT
+
+    def token_valid(self, now=None):
+        '''
+        true when the access token is good for more than safety_seconds
+        '''
+        now = time.time() if now is None else now
+        return bool(self.access_token) and self.token_expires - self.safety_seconds > now
+
+    def _adopt(self, config):
+        # take the tokens from the config file if they are still good - true if we took them
+        if config.get('ACCESS_TOKEN') and config.get(EXPIRES_KEY, 0) - self.safety_seconds > time.time():
+            self.access_token = config['ACCESS_TOKEN']
+            self.refresh_token = config.get('REFRESH_TOKEN', self.refresh_token)
+            self.token_expires = config[EXPIRES_KEY]
+            return True
+        return False
+
+    def ensure_token(self):
+        '''
+        refresh the access token only when it is expired or close to expiring
+        '''
+        if self.token_valid():
+            logger.info('ensure_token:access token valid for:%d seconds', self.token_expires - time.time())
+            return True
+        return self.refresh_tokens()
+
+    def _write_config(self):
+        # write the tokens (caller holds the lock)
+        config = read_config(self.config_filename)
+        config.update({'API_KEY': self.api_key,
+                       'ACCESS_TOKEN': self.access_token,
+                       'REFRESH_TOKEN': self.refresh_token,
+                       'AUTHORIZATION_CODE': self.authorization_code,
+                       EXPIRES_KEY: self.token_expires})
+        write_config(self.config_filename, config)
+
+    def write_tokens_to_file(self):
+        '''
+        pyecobee calls this after request_tokens - save under the lock
+        '''
+        if not self.file_based_config:
+            return super().write_tokens_to_file()
+        with open(self.lock_filename(), 'a+') as lck, kvutil.file_lock(lck):
+            self._write_config()
+
+    def refresh_tokens(self):
+        '''
+        refresh the api tokens - one run at a time - and save them with the new expiry
+        '''
+        if not self.file_based_config:
+            return super().refresh_tokens()
+
+        with open(self.lock_filename(), 'a+') as lck, kvutil.file_lock(lck):
+            # another run may have refreshed while we waited for the lock
+            config = read_config(self.config_filename)
+            if config.get('ACCESS_TOKEN') != self.access_token and self._adopt(config):
+                logger.info('refresh_tokens:using tokens refreshed by another run')
+                return True
+            if config.get('REFRESH_TOKEN'):
+                self.refresh_token = config['REFRESH_TOKEN']
+
+            params = {'grant_type': 'refresh_token',
+                      'refresh_token': self.refresh_token,
+                      'client_id': self.api_key}
+            self.refresh_count += 1
+            try:
+                request = requests.post(self.api_url + ECOBEE_TOKEN_PATH, params=params)
+            except requests.exceptions.RequestException as e:
+                logger.warning('refresh_tokens:error connecting to Ecobee:%s', e)
+                return False
+            if request.status_code == requests.codes.ok:
+                result = request.json()
+                self.access_token = result['access_token']
+                self.refresh_token = result['refresh_token']
+                self.token_expires = int(time.time()) + int(result.get('expires_in', 0))
+                self._write_config()
+                logger.info('refresh_tokens:tokens refreshed:expires in:%s', result.get('expires_in'))
+                return True
+
+        logger.warning('refresh_tokens:refresh failed:status:%s', request.status_code)
+        self.request_pin()
+        return False
+
+
+# eof
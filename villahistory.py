@@ -0,0 +1,552 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.02
+
+Storage backends for the temperature history captured by villaecobee.py
+
+Two backends are supported:
+  text    - the original villatemps.txt comma separated file (one row per sensor reading)
+  segment - append only binary files, one segment per month, made of fixed width records
+
+A segment is made up of three files in the history directory:
+  YYYY-MM.dat - fixed width records (RECORD_FMT) appended in time order
+  YYYY-MM.tix - time index - one (timestamp, record number) pair written per append
+  YYYY-MM.nam - interned name table - one name per line, the line number is the name id
+
+The segment backend can export back out to the text format (export_csv)
+and existing text history files can be loaded into segments (import_text_history)
+
+'''
+import os
+import csv
+import struct
+import bisect
+import calendar
+import datetime
+import logging
+import kvutil
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.02'
+
+
+# text file definition - shared with villaecobee.py
+HISTORY_HEADER = 'datetime,thermo,hvacMode,desiredCool,desiredHeat,sensor,temp,occupied,holdName,holdCool,holdHeat'
+HISTORY_FIELDS = HISTORY_HEADER.split(',')
+HISTORY_ROW_FMT = "%s,%s,%s,%3.1f,%3.1f,%s,%3.1f,%s,%s,%s,%s\n"
+HISTORY_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+# binary record definition (24 bytes)
+#   ts          uint32 - seconds since 1970-01-01 of the thermostat (local) time
+#   thermo      uint16 - name id
+#   hvacMode    uint16 - name id
+#   desiredCool int16  - tenths of a degree
+#   desiredHeat int16  - tenths of a degree
+#   sensor      uint16 - name id
+#   temp        int16  - tenths of a degree
+#   occupied    uint8  - 0=false, 1=true, 2=unknown
+#   (pad)       1 byte
+#   holdName    uint16 - name id (NO_NAME when there is no hold)
+#   holdCool    int16  - hold value as reported by ecobee (NO_VALUE when there is no hold)
+#   holdHeat    int16  - hold value as reported by ecobee (NO_VALUE when there is no hold)
+RECORD_FMT = '<IHHhhHhBxHhh'
+RECORD_SIZE = struct.calcsize(RECORD_FMT)
+RECORD_FIELDS = ('ts', 'thermo', 'hvacMode', 'desiredCool', 'desiredHeat', 'sensor',
+                 'temp', 'occupied', 'holdName', 'holdCool', 'holdHeat')
+RECORD_NAME_FIELDS = ('thermo', 'hvacMode', 'sensor', 'holdName')
+
+# time index entry - (timestamp, record number)
+TINDEX_FMT = '<II'
+TINDEX_SIZE = struct.calcsize(TINDEX_FMT)
+
+# markers for missing values
+NO_NAME = 0xFFFF
+NO_VALUE = -32768
+OCCUPIED_CONV = {'false': 0, 'true': 1}
+OCCUPIED_STR = ('false', 'true', 'unknown')
+
+# segment file extensions
+SEGMENT_DATA_EXT = '.dat'
+SEGMENT_TINDEX_EXT = '.tix'
+SEGMENT_NAMES_EXT = '.nam'
+SEGMENT_LOCK_FILENAME = 'segments.lck'
+
+# valid backend settings
+HISTORY_BACKENDS = ['text', 'segment', 'both']
+
+
+# convert a date time string into seconds since epoch (no timezone conversion)
+def datetime_str_to_ts(dt_str):
+    return calendar.timegm(datetime.datetime.strptime(dt_str, HISTORY_DATEFMT).timetuple())
+
+
+# convert seconds since epoch back into the date time string
+def ts_to_datetime_str(ts):
+    return datetime.datetime.fromtimestamp(int(ts), datetime.timezone.utc).strftime(HISTORY_DATEFMT)
+
+
+# convert a date/datetime (or None) into seconds since epoch
+def datetime_to_ts(dt):
+    if dt is None:
+        return None
+    if not isinstance(dt, datetime.datetime):
+        dt = datetime.datetime.combine(dt, datetime.time())
+    return calendar.timegm(dt.timetuple())
+
+
+# the segment key (YYYY-MM) for a seconds since epoch value
+def segment_key(ts):
+    tm = datetime.datetime.fromtimestamp(int(ts), datetime.timezone.utc)
+    return '%04d-%02d' % (tm.year, tm.month)
+
+
+# convert a degree value into tenths stored as an int
+def _tenths(value):
+    return int(round(float(value) * 10))
+
+
+# convert a hold value string (or None) into the stored int
+def _hold_value(value):
+    if value is None or value == 'None':
+        return NO_VALUE
+    return int(value)
+
+
+# convert the stored hold value back into the string form used in the text file
+def _hold_str(value):
+    if value == NO_VALUE:
+        return 'None'
+    return str(value)
+
+
+def numpy_record_dtype():
+    '''
+    numpy dtype that overlays RECORD_FMT - used to read segments in one call
+    '''
+    import numpy as np
+
+    return np.dtype([('ts', '<u4'), ('thermo', '<u2'), ('hvacMode', '<u2'),
+                     ('desiredCool', '<i2'), ('desiredHeat', '<i2'), ('sensor', '<u2'),
+                     ('temp', '<i2'), ('occupied', 'u1'), ('pad', 'u1'),
+                     ('holdName', '<u2'), ('holdCool', '<i2'), ('holdHeat', '<i2')])
+
+
+class TextHistory(object):
+    '''
+    Original comma separated history file (villatemps.txt)
+    '''
+
+    def __init__(self, filename, fsync=False):
+        self.filename = filename
+        self.fsync = fsync
+
+    def append_rows(self, rows):
+        '''
+        append rows to the text file - create the header if the file is new
+
+        all rows go out in a single write while holding an advisory lock
+        so overlapping runs can not interleave lines
+
+        rows - list of tuples in HISTORY_FIELDS order
+        '''
+        if not rows:
+            return
+        # build the output once
+        data = ''.join(HISTORY_ROW_FMT % row for row in rows)
+
+        # now open a file and dump the values collected
+        with open(self.filename, 'a') as t, kvutil.file_lock(t):
+            # check for an empty file under the lock - so only one run creates the header
+            t.seek(0, os.SEEK_END)
+            if t.tell() == 0:
+                data = HISTORY_HEADER + '\n' + data
+            t.write(data)
+            t.flush()
+            if self.fsync:
+                os.fsync(t.fileno())
+
+    def read_rows(self):
+        '''
+        read the file and return a list of dicts keyed by HISTORY_FIELDS
+        '''
+        import kvcsv
+
+        return kvcsv.readcsv2list(self.filename)
+
+
+class SegmentHistory(object):
+    '''
+    Append only monthly binary segments with a time index and name table per segment
+    '''
+
+    def __init__(self, dirname, fsync=False):
+        self.dirname = dirname
+        self.fsync = fsync
+        # cache of name tables loaded for appending - keyed by segment key
+        self._names = dict()
+
+    def _segment_filename(self, key, ext):
+        return os.path.join(self.dirname, key + ext)
+
+    def segment_keys(self):
+        '''
+        sorted list of segment keys (YYYY-MM) that exist in the history directory
+        '''
+        if not os.path.isdir(self.dirname):
+            return []
+        return sorted(os.path.splitext(x)[0] for x in os.listdir(self.dirname) if x.endswith(SEGMENT_DATA_EXT))
+
+    def load_names(self, key):
+        '''
+        read the name table for a segment - returns the list of names (index is the name id)
+        '''
+        filename = self._segment_filename(key, SEGMENT_NAMES_EXT)
+        if not os.path.isfile(filename):
+            return []
+        with open(filename, 'r', encoding='utf-8') as t:
+            return [line.rstrip('\n') for line in t]
+
+    def _name_lookup(self, key):
+        # load the name table once and build the reverse lookup
+        if key not in self._names:
+            names = self.load_names(key)
+            self._names[key] = (names, {name: idx for idx, name in enumerate(names)})
+        return self._names[key]
+
+    def _intern(self, key, name, new_names):
+        # convert a name to its id - registering new names as we go
+        if name is None:
+            return NO_NAME
+        names, lookup = self._name_lookup(key)
+        if name not in lookup:
+            if len(names) >= NO_NAME:
+                raise ValueError('Segment name table is full:' + key)
+            lookup[name] = len(names)
+            names.append(name)
+            new_names.append(name)
+        return lookup[name]
+
+    def pack_row(self, key, row, new_names):
+        '''
+        convert a row (tuple in HISTORY_FIELDS order) to its binary record
+        '''
+        (dt_str, thermo, hvacMode, desiredCool, desiredHeat, sensor, temp,
+         occupied, holdName, holdCool, holdHeat) = row
+        return struct.pack(RECORD_FMT,
+                           datetime_str_to_ts(dt_str),
+                           self._intern(key, thermo, new_names),
+                           self._intern(key, hvacMode, new_names),
+                           _tenths(desiredCool),
+                           _tenths(desiredHeat),
+                           self._intern(key, sensor, new_names),
+                           _tenths(temp),
+                           OCCUPIED_CONV.get(str(occupied).lower(), 2),
+                           self._intern(key, holdName, new_names),
+                           _hold_value(holdCool),
+                           _hold_value(holdHeat))
+
+    def append_rows(self, rows):
+        '''
+        append rows to the segment(s) they belong to
+
+        rows - list of tuples in HISTORY_FIELDS order
+        '''
+        if not rows:
+            return
+
+        # make sure we have some place to write
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+
+        # group the rows by the segment they belong in - keeping the order
+        by_segment = dict()
+        for row in rows:
+            key = segment_key(datetime_str_to_ts(row[0]))
+            by_segment.setdefault(key, []).append(row)
+
+        # one lock for the whole directory - overlapping runs append one after the other
+        with open(os.path.join(self.dirname, SEGMENT_LOCK_FILENAME), 'a') as lck, kvutil.file_lock(lck):
+            # another run may have added names since we loaded them
+            self._names = dict()
+
+            for key, seg_rows in by_segment.items():
+                new_names = []
+                records = b''.join(self.pack_row(key, row, new_names) for row in seg_rows)
+
+                # names must be on disk before the records that reference them
+                if new_names:
+                    self._append_file(key, SEGMENT_NAMES_EXT, ''.join(name + '\n' for name in new_names).encode('utf-8'))
+
+                # append the records - the record number is where this batch starts
+                recno = self._append_file(key, SEGMENT_DATA_EXT, records) // RECORD_SIZE
+
+                # one time index entry per batch appended
+                self._append_file(key, SEGMENT_TINDEX_EXT, struct.pack(TINDEX_FMT, datetime_str_to_ts(seg_rows[0][0]), recno))
+
+                logger.debug('append_rows:segment:%s:records:%d:new_names:%d', key, len(seg_rows), len(new_names))
+
+    def _append_file(self, key, ext, data):
+        # append bytes to a segment file - returns the offset the data was written at
+        with open(self._segment_filename(key, ext), 'ab') as t:
+            offset = t.tell()
+            t.write(data)
+            t.flush()
+            if self.fsync:
+                os.fsync(t.fileno())
+        return offset
+
+    def load_tindex(self, key):
+        '''
+        read the time index for a segment - returns two lists (timestamps, record numbers)
+        '''
+        filename = self._segment_filename(key, SEGMENT_TINDEX_EXT)
+        if not os.path.isfile(filename):
+            return [], []
+        with open(filename, 'rb') as t:
+            data = t.read()
+        data = data[:len(data) - len(data) % TINDEX_SIZE]
+        entries = list(struct.iter_unpack(TINDEX_FMT, data))
+        return [x[0] for x in entries], [x[1] for x in entries]
+
+    def _record_range(self, key, start_ts, end_ts):
+        # use the time index to find the record range that can hold the window
+        # rows inside one batch are only roughly ordered (one thermostat clock each)
+        # so we widen the range by one batch on each side and trim after reading
+        ts_list, recno_list = self.load_tindex(key)
+        first = last = None
+        if ts_list and start_ts is not None:
+            pos = bisect.bisect_left(ts_list, start_ts) - 2
+            if pos > 0:
+                first = recno_list[pos]
+        if ts_list and end_ts is not None:
+            pos = bisect.bisect_right(ts_list, end_ts) + 1
+            if pos < len(ts_list):
+                last = recno_list[pos]
+        return first, last
+
+    def read_segment(self, key, start_ts=None, end_ts=None):
+        '''
+        read the records of a single segment into a numpy structured array
+        only the byte range the time index says can hold [start_ts, end_ts] is read
+        '''
+        import numpy as np
+
+        dtype = numpy_record_dtype()
+        filename = self._segment_filename(key, SEGMENT_DATA_EXT)
+        first, last = self._record_range(key, start_ts, end_ts)
+        with open(filename, 'rb') as t:
+            if first:
+                t.seek(first * RECORD_SIZE)
+            if last is not None:
+                data = t.read((last - (first or 0)) * RECORD_SIZE)
+            else:
+                data = t.read()
+        # ignore any partial record left by an interrupted write
+        data = data[:len(data) - len(data) % RECORD_SIZE]
+        records = np.frombuffer(data, dtype=dtype)
+
+        # trim to the exact window
+        if start_ts is not None:
+            records = records[records['ts'] >= start_ts]
+        if end_ts is not None:
+            records = records[records['ts'] <= end_ts]
+        return records
+
+    def read(self, start=None, end=None):
+        '''
+        read all records between start and end (date/datetime - inclusive - None means open ended)
+
+        returns:
+            records - numpy structured array (numpy_record_dtype) - name fields hold ids into names
+            names - list of names shared across all segments read
+        '''
+        import numpy as np
+
+        start_ts = datetime_to_ts(start)
+        end_ts = datetime_to_ts(end)
+        start_key = segment_key(start_ts) if start_ts is not None else None
+        end_key = segment_key(end_ts) if end_ts is not None else None
+
+        names = []
+        lookup = dict()
+        parts = []
+        for key in self.segment_keys():
+            # skip segments outside of the window
+            if start_key and key < start_key:
+                continue
+            if end_key and key > end_key:
+                break
+            records = self.read_segment(key, start_ts, end_ts)
+            if not len(records):
+                continue
+
+            # map segment name ids to the shared name list
+            seg_names = self.load_names(key)
+            remap = np.full(NO_NAME + 1, NO_NAME, dtype='<u2')
+            for idx, name in enumerate(seg_names):
+                if name not in lookup:
+                    lookup[name] = len(names)
+                    names.append(name)
+                remap[idx] = lookup[name]
+            records = records.copy()
+            for fld in RECORD_NAME_FIELDS:
+                records[fld] = remap[records[fld]]
+            parts.append(records)
+
+        if not parts:
+            return np.zeros(0, dtype=numpy_record_dtype()), names
+        return np.concatenate(parts), names
+
+    def iter_rows(self, start=None, end=None):
+        '''
+        generator of rows (tuples in HISTORY_FIELDS order) in the text file form
+        '''
+        records, names = self.read(start, end)
+        for rec in records.tolist():
+            (ts, thermo, hvacMode, desiredCool, desiredHeat, sensor, temp,
+             occupied, pad, holdName, holdCool, holdHeat) = rec
+            yield (ts_to_datetime_str(ts),
+                   names[thermo],
+                   names[hvacMode],
+                   desiredCool / 10,
+                   desiredHeat / 10,
+                   names[sensor],
+                   temp / 10,
+                   OCCUPIED_STR[occupied],
+                   'None' if holdName == NO_NAME else names[holdName],
+                   _hold_str(holdCool),
+                   _hold_str(holdHeat))
+
+    def read_rows(self, start=None, end=None):
+        '''
+        read the records and return a list of dicts keyed by HISTORY_FIELDS (same as TextHistory)
+        '''
+        return [dict(zip(HISTORY_FIELDS, [str(x) for x in row]))
+                for row in self.iter_rows(start, end)]
+
+    def export_csv(self, filename, start=None, end=None):
+        '''
+        export the records between start and end to a text file in the villatemps.txt format
+        returns the number of rows written
+        '''
+        count = 0
+        with open(filename, 'w') as t:
+            t.write(HISTORY_HEADER + '\n')
+            for row in self.iter_rows(start, end):
+                t.write(HISTORY_ROW_FMT % row)
+                count += 1
+        return count
+
+
+class MultiHistory(object):
+    '''
+    Write the same rows to more than one backend - reads come from the first backend
+    '''
+
+    def __init__(self, backends):
+        self.backends = backends
+
+    def append_rows(self, rows):
+        for backend in self.backends:
+            backend.append_rows(rows)
+
+    def read_rows(self):
+        return self.backends[0].read_rows()
+
+
+def open_history(backend, temperature_filename, history_dirname, fsync=False):
+    '''
+    create the history backend defined by the backend setting
+
+    backend - text, segment or both
+    temperature_filename - the text history filename
+    history_dirname - the directory holding the segment files
+    fsync - when set, force each append to disk before returning
+    '''
+    if backend == 'text':
+        return TextHistory(temperature_filename, fsync=fsync)
+    elif backend == 'segment':
+        return SegmentHistory(history_dirname, fsync=fsync)
+    elif backend == 'both':
+        return MultiHistory([TextHistory(temperature_filename, fsync=fsync), SegmentHistory(history_dirname, fsync=fsync)])
+    raise ValueError('Unknown history backend:' + str(backend))
+
+
+def import_text_history(temperature_filename, history, batch_size=5000):
+    '''
+    load an existing text history file into a history backend (segment)
+    returns the number of rows loaded
+    '''
+    count = 0
+    batch = []
+    with open(temperature_filename, 'r', encoding='windows-1252') as t:
+        reader = csv.reader(t)
+        header = next(reader)
+        for row in reader:
+            if len(row) != len(header):
+                logger.warning('import_text_history:skipping malformed row:%s', row)
+                continue
+            rec = dict(zip(header, row))
+            batch.append(tuple(rec[fld] for fld in HISTORY_FIELDS))
+            if len(batch) >= batch_size:
+                history.append_rows(batch)
+                count += len(batch)
+                batch = []
+    history.append_rows(batch)
+    count += len(batch)
+    return count
+
+
+# ---------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    # application variables
+    optiondictconfig = {
+        'AppVersion' : {
+            'value' : AppVersion,
+            'description' : 'defines the version number for the app',
+        },
+        'debug' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we are running in debug mode',
+        },
+        'history_dirname' : {
+            'value' : 'villatemps',
+            'description' : 'defines the directory that holds the segment history files',
+        },
+        'import_filename' : {
+            'value' : None,
+            'description' : 'defines the text history file to load into the segment history',
+        },
+        'export_filename' : {
+            'value' : None,
+            'description' : 'defines the text file we export the segment history into',
+        },
+        'date_start' : {
+            'type' : 'date',
+            'description' : 'defines the starting date for the export (default: earliest date)',
+        },
+        'date_end' : {
+            'type' : 'date',
+            'description' : 'defines the ending date for the export (default: latest date)',
+        },
+    }
+
+    # capture the command line
+    optiondict = kvutil.kv_parse_command_line( optiondictconfig, debug=False )
+
+    history = SegmentHistory(optiondict['history_dirname'])
+
+    if optiondict['import_filename']:
+        cnt = import_text_history(optiondict['import_filename'], history)
+        print('Imported', cnt, 'rows from', optiondict['import_filename'], 'into', optiondict['history_dirname'])
+
+    if optiondict['export_filename']:
+        cnt = history.export_csv(optiondict['export_filename'], optiondict['date_start'], optiondict['date_end'])
+        print('Exported', cnt, 'rows from', optiondict['history_dirname'], 'to', optiondict['export_filename'])
+
+# eof
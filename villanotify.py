@@ -0,0 +1,200 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.01
+
+Notification hub for the villa scripts (pool.py, villaecobee.py)
+
+Scripts publish events to the hub instead of sending an email for each
+alert.  Each event has a key (pool_heater_on, villa_occupied, ...):
+
+  dedupe      - an event published again in the same run replaces the first
+  suppression - an event whose key was sent less than suppress_seconds ago
+                is not sent again (it is counted and the count is reported
+                with the next message) - clear(key) when the condition ends
+                so the next occurrence goes out right away.  A lock file
+                that was kept while a condition held and rewritten on each
+                reminder is the special case suppress_seconds=reminder time
+  digest      - the events of a run going to the same recipients are sent as
+                one message - with digest_seconds the events are held (in the
+                state file) until the oldest has waited that long
+
+The hub state (last send per key, held events) is kept in a json file
+read and written under a lock on filename.lck - like poolstate.py.
+
+    with villanotify.open_hub('pool_notify.json', villanotify.gmail_sender(scopes)) as hub:
+        hub.publish('spa_heater_on', subject, body, email_from, email_to)
+
+'''
+import os
+import json
+import time
+import contextlib
+import logging
+
+import kvutil
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.01'
+
+# layout version saved in the file
+HUB_VERSION = 1
+
+# extension of the lock file kept next to the state file
+LOCK_EXT = '.lck'
+
+# subject of a message that carries more than one event
+DIGEST_SUBJECT = 'Villa Carneros notices'
+
+
+def read_hub(filename):
+    '''
+    read the hub state - None when missing or unreadable
+    '''
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'r') as t:
+            data = json.load(t)
+    except (OSError, ValueError) as e:
+        logger.warning('read_hub:unable to read:%s:%s', filename, e)
+        return None
+    if data.get('version') != HUB_VERSION:
+        logger.warning('read_hub:unknown version:%s:%s', filename, data.get('version'))
+        return None
+    return data
+
+
+def write_hub(filename, data):
+    '''
+    save the hub state - temp file and rename so readers never see a partial file
+    '''
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as t:
+        json.dump(data, t, indent=1, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+
+def gmail_sender(scopes=None, file_token_json=None, file_credentials_json=None):
+    '''
+    sender that sends through kvgmailsendsimple - returns the gmail message dict (None on failure)
+    '''
+    def send(email_from, email_to, subject, body):
+        import kvgmailsendsimple
+        return kvgmailsendsimple.gmail_send_simple_message(email_from, email_to, subject, body,
+                                                           scopes, file_token_json, file_credentials_json)
+    return send
+
+
+class NotificationHub(object):
+    '''
+    events published during one run - sent by flush
+
+    sender - callable(email_from, email_to, subject, body) returning a dict with the message id
+    '''
+
+    def __init__(self, sender, data=None, now=None, digest_seconds=0, digest_subject=DIGEST_SUBJECT):
+        self.sender = sender
+        self.data = data or {'version': HUB_VERSION, 'keys': dict(), 'pending': []}
+        self.now = time.time() if now is None else now
+        self.digest_seconds = digest_seconds
+        self.digest_subject = digest_subject
+        # messages sent by flush - (subject, keys, message id)
+        self.sent = []
+
+    def publish(self, key, subject, body, email_from, email_to, suppress_seconds=0):
+        '''
+        queue an event - returns dict with the key as id and the status (queued, duplicate or suppressed)
+        '''
+        for event in self.data['pending']:
+            if event['key'] == key:
+                # dedupe - the latest text wins
+                event.update(subject=subject, body=body, email_from=email_from, email_to=email_to)
+                event['count'] += 1
+                return {'id': key, 'status': 'duplicate'}
+
+        rec = self.data['keys'].get(key)
+        if rec and suppress_seconds and self.now - rec['sent'] < suppress_seconds:
+            rec['suppressed'] = rec.get('suppressed', 0) + 1
+            logger.info('publish:suppressed:%s:sent %d seconds ago', key, self.now - rec['sent'])
+            return {'id': key, 'status': 'suppressed'}
+
+        self.data['pending'].append({'key': key, 'subject': subject, 'body': body, 'email_from': email_from,
+                                     'email_to': email_to, 'at': self.now, 'count': 1})
+        return {'id': key, 'status': 'queued'}
+
+    def clear(self, *keys):
+        '''
+        the condition behind these keys ended - the next event is sent right away
+        events of these keys still held for a digest are dropped - they no longer hold
+        '''
+        for key in keys:
+            self.data['keys'].pop(key, None)
+        self.data['pending'] = [x for x in self.data['pending'] if x['key'] not in keys]
+
+    def due(self):
+        '''
+        true when the held events should go out
+        '''
+        pending = self.data['pending']
+        return bool(pending) and (not self.digest_seconds or self.now - min(x['at'] for x in pending) >= self.digest_seconds)
+
+    def _message(self, events):
+        # subject and body for the events going to one set of recipients
+        texts = []
+        for event in events:
+            rec = self.data['keys'].get(event['key']) or dict()
+            body = event['body']
+            if rec.get('suppressed'):
+                body += '\n(repeated %d times since the last message)' % rec['suppressed']
+            texts.append((event['subject'], body))
+        if len(texts) == 1:
+            return texts[0]
+        subject = '%s (%d)' % (self.digest_subject, len(texts))
+        return subject, '\n\n'.join('%s\n%s' % x for x in texts)
+
+    def flush(self, force=False):
+        '''
+        send the held events - one message per (email_from, email_to) - returns the messages sent
+        events whose message fails stay held for the next run
+        '''
+        if not (self.due() or (force and self.data['pending'])):
+            return []
+        groups = dict()
+        for event in self.data['pending']:
+            groups.setdefault((event['email_from'], event['email_to']), []).append(event)
+
+        held = []
+        sent = []
+        for (email_from, email_to), events in groups.items():
+            subject, body = self._message(events)
+            message = self.sender(email_from, email_to, subject, body)
+            if not message:
+                logger.warning('flush:send failed - held for the next run:%s', subject)
+                held.extend(events)
+                continue
+            keys = [x['key'] for x in events]
+            for key in keys:
+                self.data['keys'][key] = {'sent': self.now, 'msgid': message['id'], 'suppressed': 0}
+            sent.append((subject, keys, message['id']))
+            logger.info('flush:sent:%s:%s:keys:%s', message['id'], subject, ','.join(keys))
+        self.data['pending'] = held
+        self.sent.extend(sent)
+        return sent
+
+
+@contextlib.contextmanager
+def open_hub(filename, sender, now=None, digest_seconds=0, digest_subject=DIGEST_SUBJECT):
+    '''
+    load the hub under the lock, hand it to the with block - flush and save when the block succeeds
+    '''
+    with open(filename + LOCK_EXT, 'a+') as lck, kvutil.file_lock(lck):
+        hub = NotificationHub(sender, read_hub(filename), now, digest_seconds, digest_subject)
+        yield hub
+        hub.flush()
+        write_hub(filename, hub.data)
+
+
+# eof
@@ -0,0 +1,231 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.02
+
+Compiled occupancy calendar index
+
+Compiles the date files used by the villa tools into a compact array with
+one byte per day (indexed by date ordinal) so a lookup is an array index:
+  stays.txt / stays_history.txt  - date,occtype - byte holds the occtype letter
+  pool_heater_allowed.txt        - one date per line - byte marks the pool as allowed
+
+The compiled array is saved in a sidecar file next to the source file
+(filename + .occidx or .dateidx) along with the source file mtime and size.
+When the source file changes the sidecar is rebuilt on the next load.
+
+    villacal = villaoccupancy.load_stays_index('stays.txt')
+    if today in villacal and villacal.occtype(tomorrow) == 'R':
+        ...
+
+'''
+import os
+import csv
+import json
+import struct
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.02'
+
+# date format used in stays.txt
+STAYS_DATEFMT = '%m/%d/%Y'
+
+# the byte stored for a date in a date list file (pool_heater_allowed.txt)
+DATE_LIST_CODE = 'Y'
+
+# occtype stored when the stays file has a date with no type
+UNKNOWN_OCCTYPE = '?'
+
+# sidecar layout:  header, one byte per day, json list of invalid lines
+#   magic (4s), source mtime_ns (q), source size (q), base ordinal (i), days (i), invalid bytes (i)
+SIDECAR_MAGIC_STAYS = b'OCC1'
+SIDECAR_MAGIC_DATES = b'DAT1'
+SIDECAR_HEADER_FMT = '<4sqqiii'
+SIDECAR_HEADER_SIZE = struct.calcsize(SIDECAR_HEADER_FMT)
+SIDECAR_EXT_STAYS = '.occidx'
+SIDECAR_EXT_DATES = '.dateidx'
+
+
+class OccupancyIndex(object):
+    '''
+    one byte per day starting at base_ordinal - 0 means the day is not in the file
+
+    lookups take a date, datetime or MM/DD/YYYY string
+    '''
+
+    def __init__(self, base_ordinal=0, days=b'', invalid=None):
+        self.base_ordinal = base_ordinal
+        self.days = bytes(days)
+        # lines from the source file we could not convert
+        self.invalid = invalid or []
+
+    def _pos(self, value):
+        # convert the value to a position in days (None when out of range)
+        if isinstance(value, str):
+            value = datetime.datetime.strptime(value, STAYS_DATEFMT)
+        pos = value.toordinal() - self.base_ordinal
+        if 0 <= pos < len(self.days):
+            return pos
+        return None
+
+    def occtype(self, value):
+        '''
+        the occtype letter for this day - None when the day is not in the file
+        '''
+        pos = self._pos(value)
+        if pos is None or not self.days[pos]:
+            return None
+        return chr(self.days[pos])
+
+    def __contains__(self, value):
+        return self.occtype(value) is not None
+
+    def __len__(self):
+        return len(self.days) - self.days.count(0)
+
+    def __iter__(self):
+        # dates in the file - in date order
+        for pos, code in enumerate(self.days):
+            if code:
+                yield datetime.date.fromordinal(self.base_ordinal + pos)
+
+    def dates(self):
+        return list(self)
+
+
+def build_index(day_codes, invalid=None):
+    '''
+    create an index from a dict of {date: occtype letter}
+    '''
+    if not day_codes:
+        return OccupancyIndex(invalid=invalid)
+    ordinals = {x.toordinal(): code for x, code in day_codes.items()}
+    base = min(ordinals)
+    days = bytearray(max(ordinals) - base + 1)
+    for ordinal, code in ordinals.items():
+        days[ordinal - base] = ord(code)
+    return OccupancyIndex(base, days, invalid)
+
+
+def compile_stays_file(filename, fld_date='date', fld_type='occtype'):
+    '''
+    read a stays file (date,occtype) and build the index
+    lines with a date that does not convert are captured as:  line number|date|error
+    '''
+    day_codes = dict()
+    invalid = []
+    with open(filename, 'r', encoding='windows-1252') as t:
+        reader = csv.DictReader(t)
+        for rec in reader:
+            date_str = (rec.get(fld_date) or '').strip()
+            # skip blanks
+            if not date_str:
+                continue
+            occtype = (rec.get(fld_type) or '').strip()[:1] or UNKNOWN_OCCTYPE
+            try:
+                day_codes[datetime.datetime.strptime(date_str, STAYS_DATEFMT).date()] = occtype
+            except ValueError as e:
+                invalid.append(f'{reader.line_num}|{date_str}|{e}')
+    if invalid:
+        logger.warning('compile_stays_file:lines skipped:%s:%s', filename, invalid)
+    return build_index(day_codes, invalid)
+
+
+def compile_dates_file(filename):
+    '''
+    read a file with a date on each line and build the index
+    lines that do not convert are captured as:  line number|line|error
+    '''
+    import kvdate
+
+    # one parser for the file - the lines share a format so the last matched format is tried first
+    parse_date = kvdate.DatetimeParser()
+    day_codes = dict()
+    invalid = []
+    with open(filename, 'r') as t:
+        for idx, line in enumerate(t):
+            try:
+                day_codes[parse_date(line.strip()).date()] = DATE_LIST_CODE
+            except Exception as e:
+                invalid.append(f'{idx+1}|{line.strip()}|{e}')
+    return build_index(day_codes, invalid)
+
+
+def read_sidecar(sidecar_filename, magic, stat):
+    '''
+    read the sidecar if it matches the source file stat - None when missing or stale
+    '''
+    try:
+        with open(sidecar_filename, 'rb') as t:
+            data = t.read()
+    except OSError:
+        return None
+    if len(data) < SIDECAR_HEADER_SIZE:
+        return None
+    file_magic, mtime_ns, size, base, ndays, ninvalid = struct.unpack_from(SIDECAR_HEADER_FMT, data)
+    if file_magic != magic or mtime_ns != stat.st_mtime_ns or size != stat.st_size:
+        return None
+    if len(data) != SIDECAR_HEADER_SIZE + ndays + ninvalid:
+        return None
+    days = data[SIDECAR_HEADER_SIZE:SIDECAR_HEADER_SIZE + ndays]
+    invalid = json.loads(data[SIDECAR_HEADER_SIZE + ndays:]) if ninvalid else []
+    return OccupancyIndex(base, days, invalid)
+
+
+def write_sidecar(sidecar_filename, magic, stat, index):
+    '''
+    save the index - temp file and rename so readers never see a partial sidecar
+    '''
+    invalid = json.dumps(index.invalid).encode('utf-8') if index.invalid else b''
+    tmp_filename = sidecar_filename + '.tmp'
+    try:
+        with open(tmp_filename, 'wb') as t:
+            t.write(struct.pack(SIDECAR_HEADER_FMT, magic, stat.st_mtime_ns, stat.st_size,
+                                index.base_ordinal, len(index.days), len(invalid)))
+            t.write(index.days)
+            t.write(invalid)
+        os.replace(tmp_filename, sidecar_filename)
+    except OSError as e:
+        # the index still works - we just compile it again next time
+        logger.warning('write_sidecar:unable to save:%s:%s', sidecar_filename, e)
+
+
+def _load_index(filename, magic, ext, compiler, use_cache):
+    # load from the sidecar when it is current - otherwise compile and save it
+    stat = os.stat(filename)
+    sidecar_filename = filename + ext
+    if use_cache:
+        index = read_sidecar(sidecar_filename, magic, stat)
+        if index is not None:
+            logger.debug('_load_index:sidecar:%s', sidecar_filename)
+            return index
+    index = compiler(filename)
+    logger.info('_load_index:compiled:%s:days:%d', filename, len(index))
+    if use_cache:
+        write_sidecar(sidecar_filename, magic, stat, index)
+    return index
+
+
+def load_stays_index(filename, fld_date='date', fld_type='occtype', use_cache=True):
+    '''
+    occupancy index for a stays file (stays.txt, stays_history.txt)
+    '''
+    return _load_index(filename, SIDECAR_MAGIC_STAYS, SIDECAR_EXT_STAYS,
+                       lambda x: compile_stays_file(x, fld_date, fld_type), use_cache)
+
+
+def load_dates_index(filename, use_cache=True):
+    '''
+    date index for a file with one date per line (pool_heater_allowed.txt)
+    an empty index is returned when the file does not exist
+    '''
+    if not os.path.exists(filename):
+        return OccupancyIndex()
+    return _load_index(filename, SIDECAR_MAGIC_DATES, SIDECAR_EXT_DATES, compile_dates_file, use_cache)
+
+
+# eof
@@ -0,0 +1,382 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Durable email outbox for the villa scripts (pool.py, villaecobee.py)
+
+Messages are saved to a local queue file (villa_outbox.json) and the caller
+gets a handle right away - {'id': outbox id, 'status': 'queued'} - so a slow
+or failing gmail api never holds up the pool or thermostat work.  A worker
+sends what is due:
+
+  - one authorized gmail service (and http connection) per process and
+    sending account (kvgmailsendsimple.gmail_service)
+  - a message being sent is claimed for LEASE_SECONDS so overlapping
+    workers (another run, the standalone worker) do not send it twice -
+    a worker that dies mid send leaves it to be sent again after the lease
+  - a failed send is tried again after BACKOFF_SECONDS, doubling on each
+    failure up to MAX_BACKOFF_SECONDS - after MAX_ATTEMPTS it is marked
+    failed and kept in the file
+  - the first failure ends the pass - the rest wait for the next pass
+
+The file is read and written under a lock on filename.lck (like poolstate.py)
+but the lock is never held while talking to gmail.
+
+    outbox = villaoutbox.Outbox('villa_outbox.json')
+    worker = villaoutbox.start_worker(outbox, villaoutbox.gmail_send(scopes))
+    handle = outbox.enqueue(email_from, email_to, subject, body)
+    ...
+    worker.stop(wait_seconds=20)
+
+Run this file to send what is queued (loop=True keeps sending as messages arrive).
+
+'''
+import os
+import json
+import time
+import uuid
+import threading
+import contextlib
+import logging
+
+import kvutil
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# layout version saved in the file
+OUTBOX_VERSION = 1
+
+# extension of the lock file kept next to the queue file
+LOCK_EXT = '.lck'
+
+# retry schedule - first retry, the longest wait between tries, tries before we give up
+BACKOFF_SECONDS = 60
+MAX_BACKOFF_SECONDS = 6 * 60 * 60
+MAX_ATTEMPTS = 12
+
+# seconds a worker owns a message it is sending
+LEASE_SECONDS = 300
+
+# sent messages remembered so a handle can be looked up
+SENT_KEEP = 200
+
+# message status
+STATUS_QUEUED = 'queued'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def read_outbox(filename):
+    '''
+    read the queue file - empty outbox when missing or unreadable
+    '''
+    data = None
+    if os.path.isfile(filename):
+        try:
+            with open(filename, 'r') as t:
+                data = json.load(t)
+        except (OSError, ValueError) as e:
+            logger.warning('read_outbox:unable to read:%s:%s', filename, e)
+        if data is not None and data.get('version') != OUTBOX_VERSION:
+            logger.warning('read_outbox:unknown version:%s:%s', filename, data.get('version'))
+            data = None
+    return data or {'version': OUTBOX_VERSION, 'messages': [], 'sent': []}
+
+
+def write_outbox(filename, data):
+    '''
+    save the queue - temp file and rename so readers never see a partial file
+    '''
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as t:
+        json.dump(data, t, indent=1, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+
+def backoff_seconds(attempts, backoff=BACKOFF_SECONDS, max_backoff=MAX_BACKOFF_SECONDS):
+    '''
+    seconds to wait after the attempts-th failure
+    '''
+    return min(backoff * 2 ** (attempts - 1), max_backoff)
+
+
+class Outbox(object):
+    '''
+    queue of messages saved in filename
+    '''
+
+    def __init__(self, filename, backoff=BACKOFF_SECONDS, max_backoff=MAX_BACKOFF_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 lease=LEASE_SECONDS):
+        self.filename = filename
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+    @contextlib.contextmanager
+    def locked(self):
+        '''
+        the queue under the lock - saved when the with block succeeds
+        '''
+        with open(self.filename + LOCK_EXT, 'a+') as lck, kvutil.file_lock(lck):
+            data = read_outbox(self.filename)
+            yield data
+            write_outbox(self.filename, data)
+
+    def enqueue(self, email_from, email_to, subject, body, now=None):
+        '''
+        save a message to be sent - returns the handle dict (id, status)
+        '''
+        now = time.time() if now is None else now
+        msg = {'id': uuid.uuid4().hex[:16], 'email_from': email_from, 'email_to': email_to, 'subject': subject,
+               'body': body, 'status': STATUS_QUEUED, 'created': now, 'next_try': now, 'attempts': 0,
+               'claimed_until': 0, 'error': None}
+        with self.locked() as data:
+            data['messages'].append(msg)
+        logger.info('enqueue:%s:%s', msg['id'], subject)
+        return {'id': msg['id'], 'status': STATUS_QUEUED}
+
+    def sender(self):
+        '''
+        enqueue as a villanotify sender - callable(email_from, email_to, subject, body)
+        '''
+        return self.enqueue
+
+    def status(self, msg_id):
+        '''
+        queued, sent or failed - None when unknown
+        '''
+        data = read_outbox(self.filename)
+        for msg in data['messages'] + data['sent']:
+            if msg['id'] == msg_id:
+                return msg['status']
+        return None
+
+    def due(self, now=None):
+        '''
+        messages that can be sent now
+        '''
+        now = time.time() if now is None else now
+        return [x for x in read_outbox(self.filename)['messages']
+                if x['status'] == STATUS_QUEUED and x['next_try'] <= now and x['claimed_until'] <= now]
+
+    def claim(self, now=None, limit=None):
+        '''
+        take the due messages for this worker - returns copies of them
+        '''
+        now = time.time() if now is None else now
+        claimed = []
+        with self.locked() as data:
+            for msg in data['messages']:
+                if limit is not None and len(claimed) >= limit:
+                    break
+                if msg['status'] == STATUS_QUEUED and msg['next_try'] <= now and msg['claimed_until'] <= now:
+                    msg['claimed_until'] = now + self.lease
+                    claimed.append(dict(msg))
+        return claimed
+
+    def release(self, msg_ids):
+        '''
+        give back claimed messages we did not try
+        '''
+        msg_ids = set(msg_ids)
+        if not msg_ids:
+            return
+        with self.locked() as data:
+            for msg in data['messages']:
+                if msg['id'] in msg_ids:
+                    msg['claimed_until'] = 0
+
+    def complete(self, msg_id, result, now=None):
+        '''
+        the message was sent - move it to the sent list with the gmail message id
+        '''
+        now = time.time() if now is None else now
+        with self.locked() as data:
+            for msg in data['messages']:
+                if msg['id'] == msg_id:
+                    data['messages'].remove(msg)
+                    data['sent'].append({'id': msg_id, 'status': STATUS_SENT, 'subject': msg['subject'],
+                                         'sent': now, 'msgid': (result or dict()).get('id'), 'attempts': msg['attempts'] + 1})
+                    del data['sent'][:-SENT_KEEP]
+                    break
+
+    def fail(self, msg_id, error, now=None):
+        '''
+        the send failed - schedule the next try or give up after max_attempts
+        '''
+        now = time.time() if now is None else now
+        with self.locked() as data:
+            for msg in data['messages']:
+                if msg['id'] == msg_id:
+                    msg['attempts'] += 1
+                    msg['error'] = str(error)
+                    msg['claimed_until'] = 0
+                    if msg['attempts'] >= self.max_attempts:
+                        msg['status'] = STATUS_FAILED
+                        logger.error('fail:giving up after %d attempts:%s:%s:%s', msg['attempts'], msg_id, msg['subject'], error)
+                    else:
+                        msg['next_try'] = now + backoff_seconds(msg['attempts'], self.backoff, self.max_backoff)
+                        logger.warning('fail:attempt %d:%s:retry in %d seconds:%s', msg['attempts'], msg_id,
+                                       msg['next_try'] - now, error)
+                    break
+
+    def send_due(self, send, now=None, limit=None):
+        '''
+        send the due messages - the lock is not held while sending
+        send - callable(email_from, email_to, subject, body) returning the gmail message dict - raises on failure
+        returns (sent, failed) counts
+        '''
+        claimed = self.claim(now, limit)
+        sent = failed = 0
+        for idx, msg in enumerate(claimed):
+            try:
+                result = send(msg['email_from'], msg['email_to'], msg['subject'], msg['body'])
+                if not result:
+                    raise RuntimeError('no message returned')
+            except Exception as e:
+                self.fail(msg['id'], e, now)
+                failed += 1
+                # the endpoint is having trouble - leave the rest for the next pass
+                self.release(x['id'] for x in claimed[idx + 1:])
+                break
+            self.complete(msg['id'], result, now)
+            sent += 1
+            logger.info('send_due:sent:%s:%s', msg['id'], result.get('id'))
+        return sent, failed
+
+
+def gmail_send(scopes=None, file_token_json=None, file_credentials_json=None, timeout=None):
+    '''
+    send callable for the outbox - the gmail service of each sending account is built once and reused
+    '''
+    def send(email_from, email_to, subject, body):
+        import kvgmailsendsimple
+        service = kvgmailsendsimple.gmail_service(email_from, scopes, file_token_json, file_credentials_json,
+                                                  timeout or kvgmailsendsimple.HTTP_TIMEOUT)
+        return kvgmailsendsimple.gmail_send_service_message(service, email_from, email_to, subject, body)
+    return send
+
+
+class OutboxWorker(threading.Thread):
+    '''
+    thread that sends the due messages every poll_seconds until stop is called
+
+    prepare - optional callable run first in the thread (a token refresh) - errors are logged
+    '''
+
+    def __init__(self, outbox, send, poll_seconds=5.0, prepare=None):
+        super(OutboxWorker, self).__init__(name='outbox', daemon=True)
+        self.outbox = outbox
+        self.send = send
+        self.poll_seconds = poll_seconds
+        self.prepare = prepare
+        self.stopping = threading.Event()
+        self.sent = 0
+        self.failed = 0
+
+    def run(self):
+        if self.prepare is not None:
+            try:
+                self.prepare()
+            except Exception as e:
+                logger.error('run:prepare failed:%s', e)
+        while True:
+            try:
+                sent, failed = self.outbox.send_due(self.send)
+            except Exception as e:
+                # the queue file itself is the problem - try again on the next poll
+                logger.error('run:send_due failed:%s', e)
+                sent, failed = 0, 1
+            self.sent += sent
+            self.failed += failed
+            # once asked to stop - leave when nothing more can go out now
+            if self.stopping.is_set() and (failed or not self.outbox.due()):
+                break
+            self.stopping.wait(0 if sent else self.poll_seconds)
+
+    def stop(self, wait_seconds=None):
+        '''
+        finish sending what is due - waits at most wait_seconds - returns True when the worker finished
+        messages not sent stay in the queue for the next run
+        '''
+        self.stopping.set()
+        self.join(wait_seconds)
+        if self.is_alive():
+            logger.warning('stop:worker still sending after %s seconds - left to the next run', wait_seconds)
+            return False
+        logger.info('stop:sent:%d:failed:%d', self.sent, self.failed)
+        return True
+
+
+def start_worker(outbox, send, poll_seconds=5.0, prepare=None):
+    '''
+    start a worker thread for the outbox - returns the worker
+    '''
+    worker = OutboxWorker(outbox, send, poll_seconds, prepare)
+    worker.start()
+    return worker
+
+
+# ---------------------------------------------------------------------------
+if __name__ == '__main__':
+    # application variables
+    optiondictconfig = {
+        'AppVersion' : {
+            'value' : AppVersion,
+            'description' : 'defines the version number for the app',
+        },
+        'debug' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we are running in debug mode',
+        },
+        'outbox_filename' : {
+            'value' : 'villa_outbox.json',
+            'description' : 'defines the file that holds the messages waiting to be sent',
+        },
+        'loop' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we keep sending messages as they arrive (default: send what is due and stop)',
+        },
+        'poll_seconds' : {
+            'value' : 15.0,
+            'type'  : 'float',
+            'description' : 'defines the seconds between looks at the outbox when looping',
+        },
+        'scopes' : {
+            'value' : None,
+            'description' : 'defines the gmail scopes used to generate and send emails - see kvgmailsendsimple.py',
+        },
+        'file_token_json' : {
+            'value' : None,
+            'description' : 'defines the gmail filename of the json file that contains the account token (access and refresh) ',
+        },
+        'file_credentials_json' : {
+            'value' : None,
+            'description' : 'defines the gmail filename of the json file that contains the account credentials ',
+        },
+    }
+
+    # capture the command line
+    optiondict = kvutil.kv_parse_command_line( optiondictconfig, debug=False )
+
+    outbox = Outbox(optiondict['outbox_filename'])
+    send = gmail_send(optiondict['scopes'], optiondict['file_token_json'], optiondict['file_credentials_json'])
+    worker = start_worker(outbox, send, optiondict['poll_seconds'])
+    if optiondict['loop']:
+        # run until interrupted
+        try:
+            while worker.is_alive():
+                worker.join(1.0)
+        except KeyboardInterrupt:
+            pass
+    worker.stop()
+    print('sent:', worker.sent, 'failed:', worker.failed)
+
+# eof
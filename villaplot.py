@@ -1,24 +1,48 @@
 '''
 @author:   Ken Venner
 @contact:  ken@venerllc.com
-@version:  1.02
+@version:  1.09
 
 Read in the time series data created by villaecobee.py
 and generate temperature plots from these time series
 
+The file is split into lines and fields with numpy (read_plot_columns),
+the readings are binned to timedelta_minutes and pivoted into a
+(time x sensor) matrix with nan where a sensor has no reading
+(build_series) - every sensor in the file, optionally forward filled.
+With plot_date_start/plot_date_end only the lines in that window are read
+(read_plot_window - binary search of the memory mapped file).
+
+The binned readings are cached next to the file (read_plot_cached) so a
+run only parses the lines appended since the last run (plot_cache=False
+reads just the date window instead).
+
+render_windows=day,week,month,year writes the charts as png/svg files
+without a display (matplotlib Agg), each line downsampled with
+Largest-Triangle-Three-Buckets (lttb) to the pixel width.
+
+With rollup_dirname (villarollup.py) a long window is drawn from the
+coarsest 5min/hour/day rollup that still has a bin per point (plot_points
+or render_width_px) - the mean is plotted with the min/max range shaded
+and the raw file is not read.
+
 '''
 
-import kvcsv
+import kvdate
 import kvutil
+import villarollup
+import os
 import datetime
-import csv
 import sys
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 # application variables
 optiondictconfig = {
     'AppVersion' : {
-        'value' : '1.02',
+        'value' : '1.09',
         'description' : 'defines the version number for the app',
     },
     'debug' : {
@@ -57,6 +81,57 @@ optiondictconfig = {
         'value' : 55,
         'description' : 'defines the y axis lower limit for plotting',
     },
+    'sensors' : {
+        'value' : [],
+        'type' : 'liststr',
+        'description' : 'defines the sensors plotted (default: all sensors in the file)',
+    },
+    'forward_fill' : {
+        'value' : False,
+        'type' : 'bool',
+        'description' : 'defines if a missing reading is filled with the last reading of that sensor',
+    },
+    'plot_cache' : {
+        'value' : True,
+        'type' : 'bool',
+        'description' : 'defines if the binned readings are kept in a cache file (temperature_filename.plotcache.npz) so a run only parses new lines',
+    },
+    'render_windows' : {
+        'value' : [],
+        'type' : 'liststr',
+        'description' : 'defines the windows written as files without a display (day,week,month,year) - empty shows the plot',
+    },
+    'render_dir' : {
+        'value' : '.',
+        'description' : 'defines the directory the rendered files are written to',
+    },
+    'render_prefix' : {
+        'value' : 'villatemps',
+        'description' : 'defines the start of the rendered file names (prefix_window.format)',
+    },
+    'render_format' : {
+        'value' : 'png',
+        'description' : 'defines the rendered file format (png or svg)',
+    },
+    'render_width_px' : {
+        'value' : 1200,
+        'type' : 'int',
+        'description' : 'defines the rendered width in pixels - each line is downsampled to this many points',
+    },
+    'render_height_px' : {
+        'value' : 500,
+        'type' : 'int',
+        'description' : 'defines the rendered height in pixels',
+    },
+    'rollup_dirname' : {
+        'value' : '',
+        'description' : 'defines the rollup directory (villarollup.py) long windows are read from (blank - always read temperature_filename)',
+    },
+    'plot_points' : {
+        'value' : 1200,
+        'type' : 'int',
+        'description' : 'defines the points per line the interactive plot needs - picks the rollup level',
+    },
     'ylimit_high' : {
         'type' : 'int',
         'value' : 80,
@@ -83,72 +158,503 @@ def roundTime(dt=None, dateDelta=datetime.timedelta(minutes=1)):
 
 
 
-def read_plot_data(temperature_filename, datefmt, timedelta_minutes):
-    # read in the data from the txt file
-    villadata = kvcsv.readcsv2list(temperature_filename)
+# roundTime for a whole numpy datetime64 array - same rounding of the seconds within the day
+def round_datetime64(dates, timedelta_minutes):
+    import numpy as np
 
-    # create a plot dictionary keyed by "rounded time", with a dictionary of sensor:temp key value pairs
-    plotdata=dict()
+    roundTo = int(timedelta_minutes * 60)
+    seconds = dates.astype('datetime64[s]').astype(np.int64)
+    day_seconds = seconds % 86400
+    # floor((day_seconds + roundTo/2) / roundTo) * roundTo in integers
+    rounded = seconds - day_seconds + (2 * day_seconds + roundTo) // (2 * roundTo) * roundTo
+    return rounded.astype('datetime64[s]')
 
-    # not used at this time
-    sensors=[]
 
-    # step through each record read from the TXT file
-    for rec in villadata:
-        # create date/time conversions
-        rec['dt_datetime_raw'] = datetime.datetime.strptime(rec['datetime'], datefmt)
-        rec['dt_datetime'] = roundTime(rec['dt_datetime_raw'],datetime.timedelta(minutes=timedelta_minutes))
+# columns of the temperature file used for plotting
+PLOT_FIELDS = ('datetime', 'sensor', 'temp')
 
-        # stuff this value into the plotdata (either create entry or update it)
-        if rec['dt_datetime'] not in plotdata:
-            plotdata[rec['dt_datetime']] = {rec['sensor'] : rec['temp']}
-        else:
-            plotdata[rec['dt_datetime']][rec['sensor']]= rec['temp']
-        # keep a list of sensors we have seen
-        if rec['sensor'] not in sensors:
-            sensors.append(rec['sensor'])
-
-    # return the plot data we just read
-    return plotdata
-        
-
-# convert plot data for plotting
-def create_plotting_data(plotdata, start_date=None, end_date=None):
-    xaxis=[]
-    y1Main=[]
-    y2Bed=[]
-    gooddata = True
-
-    # for each plottable entry
-    for ptime in sorted(plotdata):
-        # grab the time of this plottable event
-        plottime=plotdata[ptime]
-        # skip dates that are not of interest
-        if start_date and ptime < start_date:
-            continue
-        if end_date and ptime > end_date:
-            break
-        # validate we have both plottble data points
-        if 'Villa Main' not in plottime:
-            print('Missing Main:', ptime, plottime)
-            gooddata = False
-        elif 'Villa Bedrooms' not in plottime:
-            print('Missing Bedrooms:', ptime, plottime)
-            gooddata = False
+# encoding of the temperature file
+PLOT_ENCODING = 'windows-1252'
+
+# plot cache (read_plot_cached) - file extension, format version and bytes compared to detect a rewritten file
+PLOT_CACHE_EXT = '.plotcache.npz'
+PLOT_CACHE_VERSION = 1
+PLOT_CACHE_CHECK_BYTES = 256
+
+
+def _field_matrix(buf, starts, ends, pad):
+    # (lines x widest field) uint8 array of the bytes between starts and ends - padded with pad
+    # buf must have at least the widest field of spare bytes on the end
+    import numpy as np
+
+    width = max(int((ends - starts).max()) if len(starts) else 0, 1)
+    # rows of a zero copy sliding window over the bytes
+    matrix = np.lib.stride_tricks.sliding_window_view(buf, width)[starts]
+    matrix[np.arange(width) >= (ends - starts)[:, None]] = pad
+    return matrix
+
+
+def read_plot_columns(data, header=None, fields=PLOT_FIELDS):
+    '''
+    pick the datetime, sensor and temp fields out of the bytes of a temperature file (or a piece of it)
+
+    The bytes are split on newlines and commas with numpy - no python code runs per line.
+    Lines without the header's number of fields (quoted commas, partial lines) are skipped.
+
+    data - bytes like (bytes, mmap slice) of whole lines - starting with the header line when header is None
+    header - list of field names when data does not start with the header line
+
+    returns dict:
+        dt - uint8 array (lines x width) of the datetime field - 0 padded
+        dt_len - int array - length of each datetime field
+        sensor - numpy bytes (S) array of sensor names
+        temp - float array (nan where the value does not convert)
+        bad - number of lines skipped
+    '''
+    import numpy as np
+
+    if header is None:
+        head_end = bytes(data[:4096]).find(b'\n')
+        head_end = len(data) if head_end < 0 else head_end
+        header = bytes(data[:head_end]).decode(PLOT_ENCODING).strip().split(',')
+        data = data[head_end + 1:]
+    buf = np.frombuffer(data, dtype=np.uint8)
+    columns = [header.index(x) for x in fields]
+
+    # every newline and comma in one pass - a last line without a newline is kept
+    delims = np.flatnonzero((buf == 10) | (buf == 44))
+    newline = buf[delims] == 10
+    if len(buf) and buf[-1] != 10:
+        delims = np.append(delims, len(buf))
+        newline = np.append(newline, True)
+    line_end = np.flatnonzero(newline)
+    ends = delims[line_end]
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+    # index into delims of the first comma of each line and the number of commas
+    first_comma = np.concatenate(([0], line_end[:-1] + 1))
+    comma_count = line_end - first_comma
+    # strip \r of \r\n line ends
+    filled = ends > starts
+    ends[filled] -= buf[ends[filled] - 1] == 13
+
+    # lines with the right number of commas - position of each comma
+    good = comma_count == len(header) - 1
+    bad = int((~good & filled).sum())
+    good &= filled
+    starts, ends, first_comma = starts[good], ends[good], first_comma[good]
+    comma_pos = delims[first_comma[:, None] + np.arange(len(header) - 1)]
+
+    def bounds(col):
+        return (starts if col == 0 else comma_pos[:, col - 1] + 1,
+                ends if col == len(header) - 1 else comma_pos[:, col])
+
+    # spare bytes on the end for _field_matrix
+    widest = max([1] + [int((x[1] - x[0]).max()) for x in map(bounds, columns) if len(starts)])
+    buf = np.concatenate((buf, np.zeros(widest, dtype=np.uint8)))
+    dt_start, dt_end = bounds(columns[0])
+    sensor = _field_matrix(buf, *bounds(columns[1]), 0)
+    temp = _field_matrix(buf, *bounds(columns[2]), 32)
+    temp = temp.view('S%d' % temp.shape[1]).ravel()
+    try:
+        temp = temp.astype(float)
+    except ValueError:
+        temp = np.array([_to_float(x) for x in temp])
+    return {
+        'dt': _field_matrix(buf, dt_start, dt_end, 0),
+        'dt_len': dt_end - dt_start,
+        'sensor': sensor.view('S%d' % sensor.shape[1]).ravel(),
+        'temp': temp,
+        'bad': bad,
+    }
+
+
+def column_dates(columns, datefmt):
+    '''
+    datetime64[s] array and error mask for the dt field of read_plot_columns
+    '''
+    import numpy as np
+
+    dt, dt_len = columns['dt'], columns['dt_len']
+    dates = np.full(len(dt_len), np.datetime64('NaT'), dtype='datetime64[s]')
+    done = np.zeros(len(dt_len), dtype=bool)
+    width = len(datetime.datetime(2000, 1, 1).strftime(datefmt))
+    if dt.shape[1] >= width:
+        rows = np.flatnonzero(dt_len == width)
+        try:
+            converted, ok = kvdate.datetime64_from_codes(dt[rows, :width], datefmt)
+            dates[rows[ok]] = converted[ok]
+            done[rows[ok]] = True
+        except ValueError:
+            # not a fixed width numeric format - converted below
+            pass
+    # anything else - as strings
+    rest = np.flatnonzero(~done)
+    if len(rest):
+        strings = [bytes(x).rstrip(b'\0').decode(PLOT_ENCODING) for x in dt[rest]]
+        dates[rest], errors = kvdate.datetime64_column(strings, datefmt)
+        done[rest] = ~errors
+    return dates, ~done
+
+
+def first_seen_ids(names):
+    '''
+    distinct values of a numpy bytes (S) array in first seen order and the id of each row
+    the rows are hashed to integers so the sort is on integers not strings
+    '''
+    import numpy as np
+
+    if not len(names):
+        return [], np.zeros(0, dtype=np.int64)
+    width = names.dtype.itemsize
+    padded = np.zeros((len(names), -(-width // 8) * 8), dtype=np.uint8)
+    padded[:, :width] = names.view(np.uint8).reshape(len(names), width)
+    words = padded.view(np.uint64)
+    key = words[:, 0].copy()
+    for col in range(1, words.shape[1]):
+        key = key * np.uint64(1000003) ^ words[:, col]
+    _, first, ids = np.unique(key, return_index=True, return_inverse=True)
+    ids = ids.ravel()
+    if (names[first][ids] != names).any():
+        # hash collision - sort the strings
+        _, first, ids = np.unique(names, return_index=True, return_inverse=True)
+        ids = ids.ravel()
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return [bytes(x).decode(PLOT_ENCODING) for x in names[first[order]]], rank[ids]
+
+
+def build_series(columns, datefmt, timedelta_minutes, forward_fill=False):
+    '''
+    bin the readings of read_plot_columns to timedelta_minutes and pivot them into a (time x sensor) matrix
+
+    returns dict:
+        times - datetime64[s] array - the sorted time bins that have a reading
+        sensors - list of sensor names (first seen order)
+        values - float array (times x sensors) - nan where a sensor has no reading in the bin
+                 (last reading wins when a sensor has two in a bin)
+        invalid - number of lines skipped because a field did not convert
+    '''
+    import numpy as np
+
+    # bin the timestamps - integer arithmetic on the whole column
+    dates, errors = column_dates(columns, datefmt)
+    bins = round_datetime64(dates, timedelta_minutes).astype(np.int64)
+
+    # sensor ids in first seen order
+    sensors, sensor_col = first_seen_ids(columns['sensor'])
+
+    values = columns['temp']
+    good = ~errors & ~np.isnan(values)
+    bins, values, sensor_col = bins[good], values[good], sensor_col[good]
+    if len(bins) and (np.diff(bins) >= 0).all():
+        # the file is in time order - bins change in place, no sort needed
+        change = np.concatenate(([True], bins[1:] != bins[:-1]))
+        times, time_idx = bins[change], np.cumsum(change) - 1
+    else:
+        times, time_idx = np.unique(bins, return_inverse=True)
+    matrix = np.full((len(times), len(sensors)), np.nan)
+    # last reading wins - the highest row number of each (bin, sensor) cell
+    cell = time_idx.ravel() * len(sensors) + sensor_col
+    last = np.full(matrix.size, -1, dtype=np.int64)
+    np.maximum.at(last, cell, np.arange(len(cell)))
+    filled = last >= 0
+    matrix.flat[np.flatnonzero(filled)] = values[last[filled]]
+
+    if forward_fill:
+        matrix = forward_fill_matrix(matrix)
+
+    return {
+        'times': times.astype('datetime64[s]'),
+        'sensors': sensors,
+        'values': matrix,
+        'invalid': int((~good).sum()) + columns['bad'],
+    }
+
+
+def _to_float(value):
+    # float or nan when the value does not convert
+    try:
+        return float(value)
+    except ValueError:
+        return float('nan')
+
+
+def forward_fill_matrix(matrix):
+    '''
+    fill each nan with the last reading above it in the same column (leading nans stay nan)
+    '''
+    import numpy as np
+
+    rows = np.arange(matrix.shape[0])[:, None]
+    # row of the last reading at or above each cell (-1 before the first reading)
+    last = np.maximum.accumulate(np.where(np.isnan(matrix), -1, rows), axis=0)
+    filled = matrix[np.maximum(last, 0), np.arange(matrix.shape[1])]
+    filled[last < 0] = np.nan
+    return filled
+
+
+def read_plot_series(temperature_filename, datefmt, timedelta_minutes, forward_fill=False):
+    '''
+    read the temperature file and return the build_series dict for every sensor in it
+    '''
+    with open(temperature_filename, 'rb') as t:
+        data = t.read()
+    return build_series(read_plot_columns(data), datefmt, timedelta_minutes, forward_fill)
+
+
+def _line_time(mm, pos, dt_col, datefmt):
+    # datetime of the first line at or after pos that converts - None at the end of the file
+    size = len(mm)
+    while pos < size:
+        end = mm.find(b'\n', pos)
+        end = size if end < 0 else end
+        fields = mm[pos:end].split(b',')
+        try:
+            return datetime.datetime.strptime(fields[dt_col].decode(PLOT_ENCODING).strip(), datefmt), end + 1
+        except (IndexError, ValueError):
+            pos = end + 1
+    return None, size
+
+
+def seek_time(mm, data_start, target, dt_col, datefmt):
+    '''
+    byte offset of the first line with a datetime >= target - binary search over the line starts
+
+    mm - mmap (or bytes) of a temperature file in time order
+    data_start - offset of the first line after the header
+    '''
+    lo, hi = data_start, len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # back up to the start of the line holding mid
+        start = max(mm.rfind(b'\n', data_start, mid) + 1, data_start)
+        line_time, next_start = _line_time(mm, start, dt_col, datefmt)
+        if line_time is not None and line_time < target:
+            lo = next_start
         else:
-            # if we have both - then add data to the arrays used for plotting
-            xaxis.append(ptime)
-            y1Main.append( float(plotdata[ptime]['Villa Main']) )
-            y2Bed.append( float(plotdata[ptime]['Villa Bedrooms']) )
+            hi = start
+    return lo
+
+
+def read_plot_window(temperature_filename, datefmt, timedelta_minutes, start_date=None, end_date=None,
+                     forward_fill=False, slack_minutes=60):
+    '''
+    read only the lines of the temperature file between start_date and end_date
+
+    The file is appended in time order - it is memory mapped and the byte range of
+    the window found by binary search (seek_time), so only that range is parsed.
+    The range is widened by half a bin (readings that round into the window) plus
+    slack_minutes (overlapping runs can append slightly out of order), then the
+    series is trimmed to the window.
+
+    returns the build_series dict (window_series applied) plus:
+        offsets - (start, end) byte range that was parsed
+    '''
+    import mmap
+
+    with open(temperature_filename, 'rb') as t:
+        if not os.fstat(t.fileno()).st_size:
+            return dict(build_series(read_plot_columns(b''), datefmt, timedelta_minutes), offsets=(0, 0))
+        with mmap.mmap(t.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data_start = mm.find(b'\n') + 1 or len(mm)
+            header = mm[:data_start].decode(PLOT_ENCODING).strip().split(',')
+            dt_col = header.index(PLOT_FIELDS[0])
+            widen = datetime.timedelta(minutes=slack_minutes + timedelta_minutes / 2.0)
+            lo = seek_time(mm, data_start, start_date - widen, dt_col, datefmt) if start_date else data_start
+            hi = seek_time(mm, lo, end_date + widen, dt_col, datefmt) if end_date else len(mm)
+            columns = read_plot_columns(mm[lo:hi], header=header)
+
+    series = build_series(columns, datefmt, timedelta_minutes, forward_fill)
+    return dict(window_series(series, start_date, end_date), offsets=(lo, hi))
+
+
+def merge_series(old, new):
+    '''
+    combine two build_series dicts - new readings replace old ones in the same (bin, sensor) cell
+    '''
+    import numpy as np
+
+    sensors = old['sensors'] + [x for x in new['sensors'] if x not in old['sensors']]
+    times = np.union1d(old['times'], new['times'])
+    values = np.full((len(times), len(sensors)), np.nan)
+    values[np.searchsorted(times, old['times']), :len(old['sensors'])] = old['values']
+    rows = np.searchsorted(times, new['times'])
+    for col, sensor in enumerate(new['sensors']):
+        column = new['values'][:, col]
+        filled = ~np.isnan(column)
+        values[rows[filled], sensors.index(sensor)] = column[filled]
+    return {
+        'times': times,
+        'sensors': sensors,
+        'values': values,
+        'invalid': old['invalid'] + new['invalid'],
+    }
+
+
+def load_plot_cache(cache_filename):
+    '''
+    read the plot cache - None when missing, unreadable or from another cache version
+    '''
+    import numpy as np
+
+    if not os.path.isfile(cache_filename):
+        return None
+    try:
+        with np.load(cache_filename, allow_pickle=False) as npz:
+            cache = {x: npz[x] for x in npz.files}
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning('load_plot_cache:unable to read:%s:%s', cache_filename, e)
+        return None
+    if int(cache.get('version', -1)) != PLOT_CACHE_VERSION:
+        return None
+    return cache
+
+
+def save_plot_cache(cache_filename, series, identity, offset, check, header, datefmt, timedelta_minutes):
+    '''
+    write the plot cache - temp file and rename so a reader never sees a partial file
+    '''
+    import numpy as np
+
+    tmp_filename = cache_filename + '.tmp'
+    with open(tmp_filename, 'wb') as t:
+        np.savez(t, version=PLOT_CACHE_VERSION, identity=np.array(identity, dtype=np.uint64),
+                 offset=offset, check=np.frombuffer(check, dtype=np.uint8), header=np.array(header),
+                 datefmt=datefmt, timedelta_minutes=timedelta_minutes,
+                 times=series['times'].astype(np.int64), sensors=np.array(series['sensors'], dtype=str),
+                 values=series['values'], invalid=series['invalid'])
+    os.replace(tmp_filename, cache_filename)
+
+
+def read_plot_cached(temperature_filename, datefmt, timedelta_minutes, cache_filename=None, forward_fill=False):
+    '''
+    build_series for the whole temperature file - only the lines appended since the last run are parsed
+
+    The binned series is saved in cache_filename (default temperature_filename + PLOT_CACHE_EXT)
+    with the file identity (device, inode), the byte offset parsed up to and the bytes just
+    before that offset.  A run parses the complete lines after the offset and merges them in.
+    The cache is rebuilt when the file was replaced, truncated or rewritten, or datefmt /
+    timedelta_minutes changed.
+
+    returns the build_series dict plus:
+        cache - dict:  rebuilt (bool), parsed_bytes (int)
+    '''
+    import numpy as np
+
+    cache_filename = cache_filename or temperature_filename + PLOT_CACHE_EXT
+    cache = load_plot_cache(cache_filename)
+    with open(temperature_filename, 'rb') as t:
+        stat = os.fstat(t.fileno())
+        identity = (stat.st_dev, stat.st_ino)
+        valid = (cache is not None
+                 and tuple(cache['identity'].tolist()) == identity
+                 and str(cache['datefmt']) == datefmt
+                 and float(cache['timedelta_minutes']) == float(timedelta_minutes)
+                 and int(cache['offset']) <= stat.st_size)
+        if valid:
+            offset = int(cache['offset'])
+            t.seek(offset - len(cache['check']))
+            valid = t.read(len(cache['check'])) == cache['check'].tobytes()
+        if not valid:
+            offset = 0
+            t.seek(0)
+        data = t.read()
+
+    # complete lines only - a run may be appending
+    data = data[:data.rfind(b'\n') + 1]
+    header = cache['header'].tolist() if valid else None
+    if valid:
+        series = {'times': cache['times'].astype('datetime64[s]'), 'sensors': cache['sensors'].tolist(),
+                  'values': cache['values'], 'invalid': int(cache['invalid'])}
+        if data:
+            series = merge_series(series, build_series(read_plot_columns(data, header=header), datefmt, timedelta_minutes))
+    else:
+        if data:
+            header = bytes(data[:data.find(b'\n')]).decode(PLOT_ENCODING).strip().split(',')
+        series = build_series(read_plot_columns(data), datefmt, timedelta_minutes)
+
+    if data:
+        # the bytes just before the new offset
+        check = ((cache['check'].tobytes() if valid else b'') + data[-PLOT_CACHE_CHECK_BYTES:])[-PLOT_CACHE_CHECK_BYTES:]
+        save_plot_cache(cache_filename, series, identity, offset + len(data), check, header, datefmt, timedelta_minutes)
 
-    # pass back what we determined
-    return xaxis,y1Main,y2Bed,gooddata
+    if forward_fill:
+        series = dict(series, values=forward_fill_matrix(series['values']))
+    return dict(series, cache={'rebuilt': not valid, 'parsed_bytes': len(data)})
 
-# plot this data
-def plot_temp_data(xaxis,y1Main,y2Bed,ylimit_low=55,ylimit_high=80):
+
+def load_rollup_series(rollup_dirname, timedelta_minutes, start_date, end_date=None, points=1200, forward_fill=False):
+    '''
+    build_series dict (plus min/max) for the window from the coarsest rollup level with
+    at least points bins - None when no level is coarse enough to beat timedelta_minutes
+    bins or the rollups have no readings in the window (read the temperature file)
+    '''
+    end_date = end_date or datetime.datetime.now()
+    level = villarollup.choose_level((end_date - start_date).total_seconds(), points)
+    if level is None or villarollup.LEVEL_SECONDS[level] < timedelta_minutes * 60:
+        return None
+    series = villarollup.read_rollup(rollup_dirname, level, start_date, end_date)
+    if not len(series['times']):
+        return None
+    logger.debug('load_rollup_series:level:%s:bins:%d', level, len(series['times']))
+    if forward_fill:
+        series['values'] = forward_fill_matrix(series['values'])
+    return series
+
+
+def load_plot_series(temperature_filename, datefmt, timedelta_minutes, start_date=None, end_date=None,
+                     forward_fill=False, plot_cache=True, rollup_dirname=None, points=1200):
+    '''
+    build_series dict for the window - from the rollups when the window is long enough
+    (rollup_dirname), the plot cache (only new lines parsed) or, without the cache,
+    by reading just the window (read_plot_window)
+    '''
+    if rollup_dirname and start_date:
+        series = load_rollup_series(rollup_dirname, timedelta_minutes, start_date, end_date, points, forward_fill)
+        if series is not None:
+            return series
+    if plot_cache:
+        series = read_plot_cached(temperature_filename, datefmt, timedelta_minutes, forward_fill=forward_fill)
+        return window_series(series, start_date, end_date)
+    return read_plot_window(temperature_filename, datefmt, timedelta_minutes, start_date, end_date, forward_fill)
+
+
+def window_series(series, start_date=None, end_date=None, sensors=None):
+    '''
+    the part of a series between start_date and end_date (inclusive) - optionally only the listed sensors
+    '''
+    import numpy as np
+
+    times = series['times']
+    lo = np.searchsorted(times, np.datetime64(start_date, 's'), 'left') if start_date else 0
+    hi = np.searchsorted(times, np.datetime64(end_date, 's'), 'right') if end_date else len(times)
+    columns = [series['sensors'].index(x) for x in sensors if x in series['sensors']] if sensors else list(range(len(series['sensors'])))
+    # rollup series also carry the min/max/count of each bin
+    return dict(series,
+                times=times[lo:hi],
+                sensors=[series['sensors'][x] for x in columns],
+                **{x: series[x][lo:hi][:, columns] for x in ('values', 'min', 'max', 'count') if x in series})
+
+
+def gap_report(series):
+    '''
+    dict of sensor name -> number of time bins with no reading (replaces printing every gap)
+    '''
+    import numpy as np
+
+    return dict(zip(series['sensors'], np.isnan(series['values']).sum(axis=0).tolist()))
+
+
+# plot this data - one line per sensor
+def plot_series(series, ylimit_low=55, ylimit_high=80):
     import matplotlib.pyplot as plt
-    plt.plot(xaxis,y1Main,'r--',label='Main')
-    plt.plot(xaxis,y2Bed,'b',label='Bed')
+    xaxis = series['times'].astype('datetime64[us]').tolist()
+    for idx, sensor in enumerate(series['sensors']):
+        line, = plt.plot(xaxis, series['values'][:, idx], label=sensor)
+        if 'min' in series:
+            # rollup - shade the range of the readings in each bin
+            plt.fill_between(xaxis, series['min'][:, idx], series['max'][:, idx], color=line.get_color(), alpha=0.2, linewidth=0)
     plt.legend(loc='upper left')
     plt.gcf().autofmt_xdate()
     plt.ylabel('Temperature')
@@ -156,6 +662,101 @@ def plot_temp_data(xaxis,y1Main,y2Bed,ylimit_low=55,ylimit_high=80):
     plt.show()
 
 
+# windows rendered by render_windows - name -> length
+RENDER_WINDOWS = {
+    'day': datetime.timedelta(days=1),
+    'week': datetime.timedelta(days=7),
+    'month': datetime.timedelta(days=31),
+    'year': datetime.timedelta(days=366),
+}
+
+
+def lttb(x, y, threshold):
+    '''
+    Largest-Triangle-Three-Buckets downsampling - indexes of the threshold points kept
+
+    x - increasing float array, y - float array (no nan)
+    keeps the first and last point and from each bucket in between the point making the
+    largest triangle with the point kept before it and the average of the next bucket
+    '''
+    import numpy as np
+
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    # bucket edges for the points between the first and the last
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, count - 1
+    prev = 0
+    for bucket in range(threshold - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        # average point of the next bucket (the last point for the last bucket)
+        nlo, nhi = hi, edges[bucket + 2] if bucket + 2 < len(edges) else count
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        # twice the triangle area for each candidate
+        area = np.abs((x[prev] - avg_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (avg_y - y[prev]))
+        prev = lo + int(area.argmax())
+        keep[bucket + 1] = prev
+    return keep
+
+
+def downsample_series(series, points):
+    '''
+    per sensor (x, y) arrays downsampled with lttb to at most points - gaps (nan) are dropped
+    returns list of (sensor, datetime64 array, float array)
+    '''
+    import numpy as np
+
+    seconds = series['times'].astype(np.int64).astype(float)
+    lines = []
+    for idx, sensor in enumerate(series['sensors']):
+        y = series['values'][:, idx]
+        filled = ~np.isnan(y)
+        keep = lttb(seconds[filled], y[filled], points)
+        lines.append((sensor, series['times'][filled][keep], y[filled][keep]))
+    return lines
+
+
+def render_windows(series, windows, output_dir='.', prefix='villatemps', fmt='png', end_date=None,
+                   width_px=1200, height_px=500, dpi=100, ylimit_low=55, ylimit_high=80):
+    '''
+    write one chart per window (RENDER_WINDOWS name) ending at end_date (default: last reading)
+    headless - matplotlib Agg canvas, no display needed - each line downsampled to the pixel width
+
+    returns list of the files written
+    '''
+    import numpy as np
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    os.makedirs(output_dir, exist_ok=True)
+    if end_date is None and len(series['times']):
+        end_date = series['times'][-1].astype(datetime.datetime)
+    filenames = []
+    for window in windows:
+        data = window_series(series, end_date - RENDER_WINDOWS[window], end_date) if end_date else series
+        fig = Figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        for idx, (sensor, x, y) in enumerate(downsample_series(data, width_px)):
+            line, = ax.plot(x.astype('datetime64[us]').astype(datetime.datetime), y, label=sensor, linewidth=1)
+            if 'min' in data:
+                # rollup - shade the range of the readings in each bin
+                ax.fill_between(data['times'].astype('datetime64[us]').astype(datetime.datetime), data['min'][:, idx], data['max'][:, idx],
+                                color=line.get_color(), alpha=0.2, linewidth=0)
+        ax.set_title('%s - last %s' % (prefix, window))
+        ax.set_ylabel('Temperature')
+        ax.set_ylim(ylimit_low, ylimit_high)
+        if data['sensors']:
+            ax.legend(loc='upper left', fontsize='small')
+        fig.autofmt_xdate()
+        filename = os.path.join(output_dir, '%s_%s.%s' % (prefix, window, fmt))
+        fig.savefig(filename, format=fmt)
+        filenames.append(filename)
+    return filenames
+
+
 # ---------------------------------------------------------------------------
 if __name__ == '__main__':
     # capture the command line
@@ -165,13 +766,36 @@ if __name__ == '__main__':
     debug = optiondict['debug']
     
 
-    # get the plot data
-    plotdata = read_plot_data(optiondict['temperature_filename'], optiondict['datefmt'], optiondict['timedelta_minutes'])
+    # headless batch - write a file per window - each window read on its own (from the rollup level that fits it when set)
+    if optiondict['render_windows']:
+        end_date = optiondict['plot_date_end'] or datetime.datetime.now()
+        for window in optiondict['render_windows']:
+            series = load_plot_series(optiondict['temperature_filename'], optiondict['datefmt'], optiondict['timedelta_minutes'],
+                                      end_date - RENDER_WINDOWS[window], end_date, optiondict['forward_fill'], optiondict['plot_cache'],
+                                      optiondict['rollup_dirname'], optiondict['render_width_px'])
+            series = window_series(series, sensors=optiondict['sensors'])
+            for filename in render_windows(series, [window], optiondict['render_dir'], optiondict['render_prefix'],
+                                           optiondict['render_format'], end_date, optiondict['render_width_px'], optiondict['render_height_px'],
+                                           ylimit_low=optiondict['ylimit_low'], ylimit_high=optiondict['ylimit_high']):
+                print('Created:', filename)
+        sys.exit(0)
+
+    # get the plot data - every sensor binned into a time x sensor matrix
+    series = load_plot_series(optiondict['temperature_filename'], optiondict['datefmt'], optiondict['timedelta_minutes'],
+                              optiondict['plot_date_start'], optiondict['plot_date_end'], optiondict['forward_fill'], optiondict['plot_cache'],
+                              optiondict['rollup_dirname'], optiondict['plot_points'])
+    if series['invalid']:
+        print('Skipped records that did not convert:', series['invalid'])
+
+    # select the window and sensors we are plotting
+    series = window_series(series, optiondict['plot_date_start'], optiondict['plot_date_end'], optiondict['sensors'])
 
-    # convert plot data into plottable data
-    xaxis,y1Main,y2Bed,gooddata = create_plotting_data(plotdata, start_date=optiondict['plot_date_start'], end_date=optiondict['plot_date_end'])
+    # report the gaps - one line per sensor
+    for sensor, gaps in gap_report(series).items():
+        if gaps:
+            print('Missing readings:', sensor, ':bins:', gaps, 'of', len(series['times']))
 
     # plot the results
-    plot_temp_data(xaxis,y1Main,y2Bed,optiondict['ylimit_low'],optiondict['ylimit_high'])
+    plot_series(series, optiondict['ylimit_low'], optiondict['ylimit_high'])
     
 #eof
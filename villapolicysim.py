@@ -0,0 +1,379 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.00
+
+Replay the villaecobee.py hold policy against history
+
+Uses the villa occupancy history (stays_history.txt) and the temperature
+history (villatemps.txt or the segment history directory) to replay
+the hold decision (villaecobee.hold_decision) at every recorded poll.
+The whole replay is done with numpy arrays so years of polls run in
+well under a second and a grid of settings can be compared:
+
+  sethold_hour - hour we must be past to set/remove holds on vacate/arrive days
+  hold_heat/hold_cool - the holdSetting values
+
+For each combination we report the hold set/remove runs and api calls
+that would fire, the hours spent at the hold setpoints, and the
+setback degree hours (how far the holds sit outside the normal
+thermostat setpoints times the hours held).
+
+When there is no temperature history the polls are generated every
+poll_minutes across the date range.
+
+    python villapolicysim.py sethold_hours=15,17,19 hold_heats=55,60
+
+'''
+import csv
+import time
+import datetime
+import logging
+
+import numpy as np
+
+import villahistory
+import villaoccupancy
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.00'
+
+# seconds since 1970-01-01 to date ordinal
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+
+# action codes - same decisions as villaecobee.HOLD_ACTION_*
+ACTION_NONE = 0
+ACTION_SET = 1
+ACTION_REMOVE = -1
+
+# villaecobee.holdSetting and the thermostat setpoints used when history has none
+HOLD_HEAT = 55.0
+HOLD_COOL = 80.0
+COMFORT_HEAT = 70.0
+COMFORT_COOL = 76.0
+
+# a poll covers the time to the next poll - capped at this many typical poll intervals
+MAX_POLL_GAP = 4
+
+# columns we pull from the text history
+TEXT_COLUMNS = ('datetime', 'desiredCool', 'desiredHeat', 'temp', 'holdName')
+
+
+def polls_from_readings(ts, temp, desired_cool, desired_heat, hold_on):
+    '''
+    collapse sensor readings (one per sensor per poll) into one entry per poll
+
+    returns dict of numpy arrays (sorted by ts):
+        ts - poll time (seconds since epoch - thermostat local time)
+        temp - mean sensor temperature
+        desired_cool/desired_heat - mean thermostat setpoints
+        hold_on - every reading in the poll had a hold on
+    '''
+    ts_poll, inverse, counts = np.unique(ts, return_inverse=True, return_counts=True)
+    return {
+        'ts': ts_poll,
+        'temp': np.bincount(inverse, weights=temp) / counts,
+        'desired_cool': np.bincount(inverse, weights=desired_cool) / counts,
+        'desired_heat': np.bincount(inverse, weights=desired_heat) / counts,
+        'hold_on': np.bincount(inverse, weights=hold_on) == counts,
+    }
+
+
+def load_polls_text(temperature_filename, start=None, end=None):
+    '''
+    read the text history file (villatemps.txt) into polls
+    '''
+    columns = {fld: [] for fld in TEXT_COLUMNS}
+    with open(temperature_filename, 'r', encoding='windows-1252') as t:
+        reader = csv.reader(t)
+        header = next(reader)
+        pos = [header.index(fld) for fld in TEXT_COLUMNS]
+        for row in reader:
+            if len(row) != len(header):
+                continue
+            for fld, idx in zip(TEXT_COLUMNS, pos):
+                columns[fld].append(row[idx])
+
+    ts = np.array(columns['datetime'], dtype='datetime64[s]').astype('int64')
+    keep = _window(ts, start, end)
+    return polls_from_readings(
+        ts[keep],
+        np.array(columns['temp'], dtype=float)[keep],
+        np.array(columns['desiredCool'], dtype=float)[keep],
+        np.array(columns['desiredHeat'], dtype=float)[keep],
+        (np.array(columns['holdName']) != 'None')[keep],
+    )
+
+
+def load_polls_segment(history_dirname, start=None, end=None):
+    '''
+    read the segment history (villahistory.SegmentHistory) into polls
+    '''
+    records, names = villahistory.SegmentHistory(history_dirname).read(start, end)
+    return polls_from_readings(
+        records['ts'].astype('int64'),
+        records['temp'] / 10.0,
+        records['desiredCool'] / 10.0,
+        records['desiredHeat'] / 10.0,
+        records['holdName'] != villahistory.NO_NAME,
+    )
+
+
+def synthetic_polls(start, end, poll_minutes=15):
+    '''
+    polls every poll_minutes from start through end (dates) with no readings
+    '''
+    ts = np.arange(villahistory.datetime_to_ts(start),
+                   villahistory.datetime_to_ts(end) + SECONDS_PER_DAY,
+                   poll_minutes * 60, dtype='int64')
+    nan = np.full(len(ts), np.nan)
+    return {'ts': ts, 'temp': nan, 'desired_cool': nan, 'desired_heat': nan,
+            'hold_on': np.zeros(len(ts), dtype=bool)}
+
+
+def _window(ts, start, end):
+    # mask of ts values between start and end dates (inclusive)
+    keep = np.ones(len(ts), dtype=bool)
+    if start is not None:
+        keep &= ts >= villahistory.datetime_to_ts(start)
+    if end is not None:
+        keep &= ts < villahistory.datetime_to_ts(end) + SECONDS_PER_DAY
+    return keep
+
+
+def occupied_on(villacal, day_ordinals):
+    '''
+    vectorized villacal lookup - bool array of days in the occupancy index
+    '''
+    days = np.frombuffer(villacal.days, dtype=np.uint8)
+    pos = np.asarray(day_ordinals) - villacal.base_ordinal
+    inside = (pos >= 0) & (pos < len(days))
+    result = np.zeros(len(pos), dtype=bool)
+    result[inside] = days[pos[inside]] != 0
+    return result
+
+
+def decide(occupied_today, occupied_tomorrow, hour, sethold_hour, initial_hold_on=False):
+    '''
+    vectorized villaecobee.hold_decision over every poll
+
+    the vacant day decision depends on whether our hold is already on - that is
+    the result of the last set/remove - so we carry the hold state forward
+
+    returns (action array of ACTION_*, hold_on array - hold state after each poll)
+    '''
+    late = hour > sethold_hour
+    # what the policy wants:  1 set, -1 remove, 2 set only if the hold is not on, 0 nothing
+    intent = np.zeros(len(hour), dtype=np.int8)
+    intent[occupied_today & ~occupied_tomorrow & late] = 1
+    intent[~occupied_today & occupied_tomorrow & late] = -1
+    intent[~occupied_today & ~occupied_tomorrow] = 2
+
+    # hold state after each poll - forward fill the last poll that had an intent
+    last = np.where(intent != 0, np.arange(len(intent)), -1)
+    np.maximum.accumulate(last, out=last)
+    hold_on = np.where(last >= 0, intent[last] > 0, initial_hold_on)
+    hold_before = np.concatenate(([initial_hold_on], hold_on[:-1]))
+
+    action = np.zeros(len(intent), dtype=np.int8)
+    action[(intent == 1) | ((intent == 2) & ~hold_before)] = ACTION_SET
+    action[intent == -1] = ACTION_REMOVE
+    return action, hold_on
+
+
+def poll_hours(ts):
+    '''
+    hours each poll covers - time to the next poll, capped at MAX_POLL_GAP typical intervals
+    '''
+    if len(ts) < 2:
+        return np.zeros(len(ts))
+    gaps = np.diff(ts).astype(float)
+    typical = np.median(gaps)
+    gaps = np.append(gaps, typical)
+    return np.minimum(gaps, MAX_POLL_GAP * typical) / 3600.0
+
+
+def simulate(polls, villacal, sethold_hour=17, hold_heat=HOLD_HEAT, hold_cool=HOLD_COOL,
+             thermostats=2, prepared=None):
+    '''
+    replay the hold policy over the polls
+
+    polls - dict of arrays (polls_from_readings/synthetic_polls)
+    villacal - villaoccupancy.OccupancyIndex of the stays history
+    prepared - result of prepare() - pass it in when running many settings over the same polls
+
+    returns dict of results
+    '''
+    p = prepared or prepare(polls, villacal)
+    action, hold_on = decide(p['occupied_today'], p['occupied_tomorrow'], p['hour'],
+                             sethold_hour, p['initial_hold_on'])
+    set_runs = int(np.count_nonzero(action == ACTION_SET))
+    remove_runs = int(np.count_nonzero(action == ACTION_REMOVE))
+
+    hours = p['hours']
+    held = hours[hold_on]
+    # how far the holds sit outside the normal setpoints
+    setback = max(0.0, p['comfort_heat'] - hold_heat) + max(0.0, hold_cool - p['comfort_cool'])
+    temp = polls['temp'][hold_on]
+    outside = (temp < hold_heat) | (temp > hold_cool)
+
+    return {
+        'sethold_hour': sethold_hour,
+        'hold_heat': hold_heat,
+        'hold_cool': hold_cool,
+        'polls': len(hours),
+        'days': p['days'],
+        'set_runs': set_runs,
+        'remove_runs': remove_runs,
+        'api_calls': (set_runs + remove_runs) * thermostats,
+        'hold_hours': float(held.sum()),
+        'occupied_hold_hours': float(hours[hold_on & p['occupied_today']].sum()),
+        'setback_degree_hours': float(held.sum() * setback),
+        'outside_hold_hours': float(held[outside].sum()),
+        'recorded_hold_hours': float(hours[polls['hold_on']].sum()),
+    }
+
+
+def prepare(polls, villacal):
+    '''
+    the per poll values that do not depend on the policy settings
+    '''
+    ts = polls['ts']
+    day = ts // SECONDS_PER_DAY + EPOCH_ORDINAL
+    not_held = ~polls['hold_on'] & ~np.isnan(polls['desired_heat'])
+    return {
+        'hour': (ts % SECONDS_PER_DAY) // 3600,
+        'occupied_today': occupied_on(villacal, day),
+        'occupied_tomorrow': occupied_on(villacal, day + 1),
+        'initial_hold_on': bool(polls['hold_on'][0]) if len(ts) else False,
+        'hours': poll_hours(ts),
+        'days': int(len(np.unique(day))),
+        # normal setpoints - what the thermostats run when we have no hold on
+        'comfort_heat': float(np.median(polls['desired_heat'][not_held])) if not_held.any() else COMFORT_HEAT,
+        'comfort_cool': float(np.median(polls['desired_cool'][not_held])) if not_held.any() else COMFORT_COOL,
+    }
+
+
+def sweep(polls, villacal, sethold_hours, hold_heats, hold_cools, thermostats=2):
+    '''
+    simulate every combination of settings - returns a list of results
+    '''
+    prepared = prepare(polls, villacal)
+    return [simulate(polls, villacal, sethold_hour, hold_heat, hold_cool, thermostats, prepared)
+            for sethold_hour in sethold_hours
+            for hold_heat in hold_heats
+            for hold_cool in hold_cools]
+
+
+# columns printed for each result
+REPORT_FIELDS = ('sethold_hour', 'hold_heat', 'hold_cool', 'set_runs', 'remove_runs', 'api_calls',
+                 'hold_hours', 'occupied_hold_hours', 'setback_degree_hours', 'outside_hold_hours')
+
+
+def print_report(results):
+    '''
+    display the results as a table
+    '''
+    print(' '.join('%20s' % x for x in REPORT_FIELDS))
+    for result in results:
+        print(' '.join('%20.1f' % result[x] if isinstance(result[x], float) else '%20s' % result[x]
+                       for x in REPORT_FIELDS))
+
+
+# ---------------------------------------------------------------------------
+if __name__ == '__main__':
+    import kvutil
+
+    # application variables
+    optiondictconfig = {
+        'AppVersion' : {
+            'value' : AppVersion,
+            'description' : 'defines the version number for the app',
+        },
+        'debug' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we are running in debug mode',
+        },
+        'occupy_history_filename' : {
+            'value' : 'stays_history.txt',
+            'description' : 'defines the file with the dates the villa was occupied',
+        },
+        'fldDate' : {
+            'value' : 'date',
+            'description' : 'defines the name of the date field in occupy_history_filename',
+        },
+        'temperature_filename' : {
+            'value' : 'villatemps.txt',
+            'description' : 'defines the text temperature history (blank to generate polls)',
+        },
+        'history_dirname' : {
+            'value' : None,
+            'description' : 'defines the segment history directory - used instead of temperature_filename when set',
+        },
+        'date_start' : {
+            'type' : 'date',
+            'description' : 'defines the starting date for the replay (default: earliest date)',
+        },
+        'date_end' : {
+            'type' : 'date',
+            'description' : 'defines the ending date for the replay (default: latest date)',
+        },
+        'poll_minutes' : {
+            'value' : 15,
+            'type' : 'int',
+            'description' : 'defines the minutes between polls when there is no temperature history',
+        },
+        'thermostats' : {
+            'value' : 2,
+            'type' : 'int',
+            'description' : 'defines the number of thermostats (api calls per set/remove run)',
+        },
+        'sethold_hours' : {
+            'value' : ['17'],
+            'type' : 'liststr',
+            'description' : 'defines the sethold_hour values to simulate',
+        },
+        'hold_heats' : {
+            'value' : [str(HOLD_HEAT)],
+            'type' : 'liststr',
+            'description' : 'defines the holdSetting heat values to simulate',
+        },
+        'hold_cools' : {
+            'value' : [str(HOLD_COOL)],
+            'type' : 'liststr',
+            'description' : 'defines the holdSetting cool values to simulate',
+        },
+    }
+
+    # capture the command line
+    optiondict = kvutil.kv_parse_command_line( optiondictconfig, debug=False )
+
+    start_time = time.perf_counter()
+
+    villacal = villaoccupancy.load_stays_index(optiondict['occupy_history_filename'], optiondict['fldDate'])
+    if optiondict['history_dirname']:
+        polls = load_polls_segment(optiondict['history_dirname'], optiondict['date_start'], optiondict['date_end'])
+    elif optiondict['temperature_filename']:
+        polls = load_polls_text(optiondict['temperature_filename'], optiondict['date_start'], optiondict['date_end'])
+    else:
+        dates = villacal.dates()
+        polls = synthetic_polls(optiondict['date_start'] or dates[0], optiondict['date_end'] or dates[-1],
+                                optiondict['poll_minutes'])
+    load_time = time.perf_counter()
+
+    results = sweep(polls, villacal,
+                    [int(x) for x in optiondict['sethold_hours']],
+                    [float(x) for x in optiondict['hold_heats']],
+                    [float(x) for x in optiondict['hold_cools']],
+                    optiondict['thermostats'])
+    sim_time = time.perf_counter()
+
+    print('polls:%d:days:%d:recorded_hold_hours:%.1f' % (results[0]['polls'], results[0]['days'], results[0]['recorded_hold_hours']))
+    print_report(results)
+    print('load seconds:%.3f:simulate seconds:%.3f:combinations:%d' % (load_time - start_time, sim_time - load_time, len(results)))
+
+# eof
@@ -0,0 +1,331 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.01
+
+Multi-resolution min/max/mean rollups of the temperature history
+
+Long range charts do not need every reading - a five year overview is
+a few thousand points wide.  We keep three levels of aggregates per
+sensor so a chart can be drawn from the coarsest level that still has
+a value for every pixel and never reads the raw rows:
+
+  5min - 5 minute bins, one file per month  (5min_YYYY-MM.npz)
+  hour - hourly bins, one file per year     (hour_YYYY.npz)
+  day  - daily bins, one file               (day_all.npz)
+
+Each file holds numpy arrays - the bins are rows and the sensors columns:
+  times  - int64 - bin start (seconds since 1970-01-01 of the local time)
+  sensors - sensor names (column order)
+  min, max - float32 - nan where the sensor has no reading in the bin
+  sum - float64, count - uint32 - mean is sum / count
+
+RollupHistory has the villahistory backend interface (append_rows) so
+villaecobee.py updates the rollups after each poll (MultiHistory) - only
+the files of the bins the new rows fall in are read and rewritten.
+build_rollup loads an existing villatemps.txt - it replaces only the
+rollup files, anything else in rollup_dirname is left alone.
+
+    python villarollup.py temperature_filename=villatemps.txt rollup_dirname=villarollup
+
+'''
+import os
+import glob
+import logging
+
+import kvutil
+import villahistory
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.01'
+
+# levels - name, bin seconds, numpy datetime unit of the file partition (None - one file)
+LEVELS = (
+    ('5min', 300, 'M'),
+    ('hour', 3600, 'Y'),
+    ('day', 86400, None),
+)
+LEVEL_SECONDS = {name: seconds for name, seconds, _ in LEVELS}
+
+# lock file kept in the rollup directory
+ROLLUP_LOCK_FILENAME = 'rollup.lck'
+
+# rollup file extension
+ROLLUP_EXT = '.npz'
+
+
+def rollup_filename(dirname, level, key):
+    return os.path.join(dirname, '%s_%s%s' % (level, key, ROLLUP_EXT))
+
+
+def partition_keys(bins, unit):
+    '''
+    file key of each bin start (seconds) - YYYY-MM, YYYY or all
+    '''
+    import numpy as np
+
+    if unit is None:
+        return np.full(len(bins), 'all')
+    return bins.astype('datetime64[s]').astype('datetime64[%s]' % unit).astype(str)
+
+
+def choose_level(span_seconds, points):
+    '''
+    coarsest level with at least points bins in span_seconds - None when even the finest
+    level has fewer bins than points (the raw readings should be used)
+    '''
+    for name, seconds, _ in reversed(LEVELS):
+        if span_seconds / seconds >= points:
+            return name
+    return None
+
+
+def load_partition(filename):
+    '''
+    read a rollup file - None when missing
+    '''
+    import numpy as np
+
+    if not os.path.isfile(filename):
+        return None
+    with np.load(filename, allow_pickle=False) as npz:
+        part = {x: npz[x] for x in npz.files}
+    part['sensors'] = part['sensors'].tolist()
+    return part
+
+
+def save_partition(filename, part):
+    '''
+    write a rollup file - temp file and rename so a reader never sees a partial file
+    '''
+    import numpy as np
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as t:
+        np.savez(t, times=part['times'], sensors=np.array(part['sensors'], dtype=str),
+                 min=part['min'], max=part['max'], sum=part['sum'], count=part['count'])
+    os.replace(tmp_filename, filename)
+
+
+def merge_readings(part, bins, sensor_names, temps):
+    '''
+    add readings (bin start seconds, sensor name, temp arrays) into a partition dict (None - new partition)
+    '''
+    import numpy as np
+
+    if part is None:
+        part = {'times': np.zeros(0, dtype=np.int64), 'sensors': [],
+                'min': np.zeros((0, 0), dtype=np.float32), 'max': np.zeros((0, 0), dtype=np.float32),
+                'sum': np.zeros((0, 0)), 'count': np.zeros((0, 0), dtype=np.uint32)}
+
+    sensors = part['sensors'] + [x for x in dict.fromkeys(sensor_names) if x not in part['sensors']]
+    times = np.union1d(part['times'], bins)
+    shape = (len(times), len(sensors))
+    merged = {'times': times, 'sensors': sensors,
+              'min': np.full(shape, np.nan, dtype=np.float32), 'max': np.full(shape, np.nan, dtype=np.float32),
+              'sum': np.zeros(shape), 'count': np.zeros(shape, dtype=np.uint32)}
+    # existing bins
+    rows = np.searchsorted(times, part['times'])
+    cols = len(part['sensors'])
+    for stat in ('min', 'max', 'sum', 'count'):
+        merged[stat][rows, :cols] = part[stat]
+
+    # new readings
+    sensor_ids = {x: idx for idx, x in enumerate(sensors)}
+    cell = (np.searchsorted(times, bins), np.fromiter(map(sensor_ids.__getitem__, sensor_names), dtype=np.int64, count=len(sensor_names)))
+    np.fmin.at(merged['min'], cell, temps.astype(np.float32))
+    np.fmax.at(merged['max'], cell, temps.astype(np.float32))
+    np.add.at(merged['sum'], cell, temps)
+    np.add.at(merged['count'], cell, 1)
+    return merged
+
+
+def rollup_files(dirname):
+    '''
+    the files this module keeps in dirname - rollup files and their temp files (not the lock file)
+    '''
+    files = []
+    for level, _, _ in LEVELS:
+        pattern = os.path.join(glob.escape(dirname), level + '_*' + ROLLUP_EXT)
+        files.extend(glob.glob(pattern) + glob.glob(pattern + '.tmp'))
+    return files
+
+
+def add_readings(dirname, seconds, sensor_names, temps, clear=False):
+    '''
+    add readings to every level - only the files the readings fall in are read and rewritten
+
+    seconds - int64 array - reading time (seconds since 1970-01-01 of the local time)
+    sensor_names - sequence of sensor names
+    temps - float array
+    clear - remove the existing rollup files first (under the same lock - a poll can not slip in between)
+    '''
+    import numpy as np
+
+    seconds = np.asarray(seconds, dtype=np.int64)
+    temps = np.asarray(temps, dtype=float)
+    sensor_names = np.asarray(sensor_names, dtype=str)
+    good = ~np.isnan(temps)
+    seconds, temps, sensor_names = seconds[good], temps[good], sensor_names[good]
+    if not len(seconds) and not clear:
+        return
+
+    os.makedirs(dirname, exist_ok=True)
+    with open(os.path.join(dirname, ROLLUP_LOCK_FILENAME), 'a+') as lck, kvutil.file_lock(lck):
+        if clear:
+            for filename in rollup_files(dirname):
+                os.remove(filename)
+        for level, size, unit in LEVELS:
+            bins = seconds // size * size
+            keys = partition_keys(bins, unit)
+            for key in np.unique(keys):
+                rows = keys == key
+                filename = rollup_filename(dirname, level, key)
+                part = merge_readings(load_partition(filename), bins[rows], sensor_names[rows].tolist(), temps[rows])
+                save_partition(filename, part)
+
+
+def read_rollup(dirname, level, start_date=None, end_date=None):
+    '''
+    read a level between start_date and end_date (inclusive)
+
+    returns dict (the villaplot build_series layout plus min/max/count):
+        times - datetime64[s] array of bin starts
+        sensors - list of sensor names
+        values - float array (times x sensors) - mean, nan where there is no reading
+        min, max, count - float/int arrays (times x sensors)
+        level - the level read
+        invalid - 0
+    '''
+    import numpy as np
+
+    unit = dict((x[0], x[2]) for x in LEVELS)[level]
+    start = np.datetime64(start_date, 's').astype(np.int64) if start_date else None
+    end = np.datetime64(end_date, 's').astype(np.int64) if end_date else None
+    # files whose key overlaps the range
+    first_key = partition_keys(np.array([start]), unit)[0] if start is not None else None
+    last_key = partition_keys(np.array([end]), unit)[0] if end is not None else None
+    parts = []
+    for filename in sorted(glob.glob(os.path.join(dirname, '%s_*%s' % (level, ROLLUP_EXT)))):
+        key = os.path.basename(filename)[len(level) + 1:-len(ROLLUP_EXT)]
+        if (first_key and key < first_key) or (last_key and key > last_key):
+            continue
+        parts.append(load_partition(filename))
+
+    sensors = list(dict.fromkeys(x for part in parts for x in part['sensors']))
+    count = sum(len(part['times']) for part in parts)
+    result = {'times': np.zeros(count, dtype=np.int64), 'sensors': sensors,
+              'min': np.full((count, len(sensors)), np.nan, dtype=np.float32),
+              'max': np.full((count, len(sensors)), np.nan, dtype=np.float32),
+              'sum': np.zeros((count, len(sensors))), 'count': np.zeros((count, len(sensors)), dtype=np.uint32)}
+    row = 0
+    for part in parts:
+        rows = slice(row, row + len(part['times']))
+        cols = [sensors.index(x) for x in part['sensors']]
+        result['times'][rows] = part['times']
+        for stat in ('min', 'max', 'sum', 'count'):
+            result[stat][rows, cols] = part[stat]
+        row += len(part['times'])
+
+    keep = np.ones(count, dtype=bool)
+    if start is not None:
+        keep &= result['times'] >= start
+    if end is not None:
+        keep &= result['times'] <= end
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = result['sum'][keep] / result['count'][keep]
+    return {
+        'times': result['times'][keep].astype('datetime64[s]'),
+        'sensors': sensors,
+        'values': mean,
+        'min': result['min'][keep],
+        'max': result['max'][keep],
+        'count': result['count'][keep],
+        'level': level,
+        'invalid': 0,
+    }
+
+
+class RollupHistory(object):
+    '''
+    villahistory backend that adds each poll to the rollups - use with villahistory.MultiHistory
+
+    write only - the rollups hold aggregates, read the rows from another backend (MultiHistory reads
+    the first).  The rollups can always be rebuilt from the text file (build_rollup), so a failure
+    here is logged and the poll goes on.
+    '''
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def append_rows(self, rows):
+        '''
+        rows - list of tuples in villahistory.HISTORY_FIELDS order
+        '''
+        import kvdate
+
+        if not rows:
+            return
+        try:
+            fields = villahistory.HISTORY_FIELDS
+            dt_col, sensor_col, temp_col = fields.index('datetime'), fields.index('sensor'), fields.index('temp')
+            dates, errors = kvdate.datetime64_column([str(x[dt_col]) for x in rows], villahistory.HISTORY_DATEFMT)
+            if errors.any():
+                logger.warning('RollupHistory:rows with a datetime that did not convert:%d', int(errors.sum()))
+            keep = ~errors
+            add_readings(self.dirname,
+                         dates[keep].astype('int64'),
+                         [str(x[sensor_col]) for x, ok in zip(rows, keep) if ok],
+                         [float(x[temp_col]) for x, ok in zip(rows, keep) if ok])
+        except Exception as e:
+            # derived data - never stop the poll - rebuild with: python villarollup.py
+            logger.error('RollupHistory:unable to update the rollups in:%s:%s', self.dirname, e)
+
+
+def build_rollup(temperature_filename, dirname, datefmt=villahistory.HISTORY_DATEFMT):
+    '''
+    (re)build the rollups from a text history file - returns the number of readings loaded
+    '''
+    import villaplot
+
+    with open(temperature_filename, 'rb') as t:
+        columns = villaplot.read_plot_columns(t.read())
+    dates, errors = villaplot.column_dates(columns, datefmt)
+    keep = ~errors
+    names = columns['sensor'][keep].astype(str)
+    add_readings(dirname, dates[keep].astype('int64'), names, columns['temp'][keep], clear=True)
+    return int(keep.sum())
+
+
+# ---------------------------------------------------------------------------
+if __name__ == '__main__':
+    # application variables
+    optiondictconfig = {
+        'AppVersion' : {
+            'value' : AppVersion,
+            'description' : 'defines the version number for the app',
+        },
+        'debug' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we are running in debug mode',
+        },
+        'temperature_filename' : {
+            'value' : 'villatemps.txt',
+            'description' : 'defines the name of the file that holds the temperature readings',
+        },
+        'rollup_dirname' : {
+            'value' : 'villarollup',
+            'description' : 'defines the directory the rollup files are (re)built in',
+        },
+    }
+
+    # capture the command line
+    optiondict = kvutil.kv_parse_command_line( optiondictconfig, debug=False )
+
+    count = build_rollup(optiondict['temperature_filename'], optiondict['rollup_dirname'])
+    print('Loaded readings:', count, 'into:', optiondict['rollup_dirname'])
+
+# eof
@@ -0,0 +1,296 @@
+'''
+@author:   Ken Venner
+@contact:  ken@venerllc.com
+@version:  1.02
+
+Startup time benchmark for the scheduled tools
+
+Each scheduled run starts a new python interpreter, so on the villa box
+the time spent importing modules is a large part of every run.  This
+tool imports each entry point in a fresh interpreter with -X importtime
+and reports:
+  - wall seconds for the interpreter to start and import the entry point
+  - total import time and the modules that cost the most (self time)
+
+Results can be saved as a baseline (json) and later runs compared against
+it - an entry point that got slower than regression_pct is flagged and
+the tool exits with status 1.
+
+    python villastartup.py                         - report
+    python villastartup.py save_baseline=True      - report and save the baseline
+    python villastartup.py compare=True            - report and compare to the baseline
+
+Also times kvutil.scriptinfo against the inspect.stack() version it replaced
+and (datetime_strings=1000000) kvdate.datetime_from_str before and after the
+format table was compiled once.
+
+'''
+import os
+import sys
+import json
+import time
+import tempfile
+import statistics
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# set the module version number
+AppVersion = '1.02'
+
+# the scheduled tools we measure
+ENTRY_POINTS = ['villaecobee', 'pool', 'vcconvert2', 'villaplot']
+
+# modules we load lazily (kvutil.lazy_import) - an entry point that imports one at startup is reported
+HEAVY_MODULES = ['googleapiclient', 'google_auth_oauthlib', 'openpyxl', 'xlrd', 'xlwt', 'xlutils', 'matplotlib']
+
+# directory holding the entry points
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_importtime(text):
+    '''
+    parse -X importtime output
+
+    returns list of dicts:  name, self_us, cumulative_us, depth (0 = imported by the entry point itself)
+    '''
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            # header line
+            continue
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        modules.append({
+            'name': stripped,
+            'self_us': int(parts[0]),
+            'cumulative_us': int(parts[1]),
+            'depth': (len(name) - len(stripped) - 1) // 2,
+        })
+    return modules
+
+
+def measure_startup(module, python=None, cwd=None):
+    '''
+    import module in a new interpreter with -X importtime
+
+    returns dict:  module, wall (seconds), import_us (total of the top level imports), modules (parse_importtime)
+    '''
+    code = 'import sys; sys.path.insert(0, %r); import %s' % (SCRIPT_DIR, module)
+    start = time.perf_counter()
+    result = subprocess.run([python or sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=cwd, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError('measure_startup:import failed:%s:%s' % (module, result.stderr[-2000:]))
+    modules = parse_importtime(result.stderr)
+    return {
+        'module': module,
+        'wall': wall,
+        'import_us': sum(x['cumulative_us'] for x in modules if x['depth'] == 0),
+        'modules': modules,
+    }
+
+
+def benchmark(entry_points=None, runs=5, python=None):
+    '''
+    measure each entry point runs times (after one warm up) - the median run is reported
+
+    returns dict of module -> dict:  wall, import_us, top (list of (name, self_us)), heavy (list of heavy modules imported)
+    '''
+    results = dict()
+    # run in a scratch directory - importing the tools creates log files
+    with tempfile.TemporaryDirectory() as workdir:
+        for module in entry_points or ENTRY_POINTS:
+            measure_startup(module, python, workdir)
+            samples = sorted((measure_startup(module, python, workdir) for _ in range(runs)),
+                             key=lambda x: x['wall'])
+            median = samples[len(samples) // 2]
+            names = set(x['name'].split('.')[0] for x in median['modules'])
+            results[module] = {
+                'wall': statistics.median(x['wall'] for x in samples),
+                'import_us': median['import_us'],
+                'top': [(x['name'], x['self_us']) for x in
+                        sorted(median['modules'], key=lambda x: -x['self_us'])[:10]],
+                'heavy': [x for x in HEAVY_MODULES if x in names],
+            }
+    return results
+
+
+def bench_scriptinfo(runs=1000):
+    '''
+    micro benchmark - seconds per call of kvutil.scriptinfo and the inspect.stack() version it replaced
+    scriptinfo runs at import of villaecobee/pool (log file name) and again in loggingAppStart
+    '''
+    import timeit
+    import kvutil
+
+    return {
+        'scriptinfo': timeit.timeit(kvutil.scriptinfo, number=runs) / runs,
+        'scriptinfo_inspect': timeit.timeit(kvutil.scriptinfo_inspect, number=runs) / runs,
+    }
+
+
+def datetime_strings(count, block=1000, days=3650):
+    '''
+    count date strings across the kvdate formats - in blocks of one format (a file or column is one format)
+    '''
+    import datetime
+    import random
+
+    fmts = ['%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d',
+            '%Y%m%d', '%d-%b-%Y', '%m/%d/%Y %I:%M:%S %p', '%Y-%m-%dT%H:%M:%S.%f']
+    rnd = random.Random(1)
+    start = datetime.datetime(2020, 1, 1)
+    values = []
+    while len(values) < count:
+        fmt = fmts[(len(values) // block) % len(fmts)]
+        for _ in range(min(block, count - len(values))):
+            values.append((start + datetime.timedelta(minutes=rnd.randrange(days * 1440))).strftime(fmt))
+    return values
+
+
+def bench_datetime_from_str(count=1000000, cache_size=4096):
+    '''
+    micro benchmark - seconds per call converting count mixed format strings with:
+        legacy - kvdate.datetime_from_str_legacy (format table compiled each call)
+        compiled - kvdate.datetime_from_str
+        parser - own kvdate.DatetimeParser (last matched format first)
+        cached - own kvdate.DatetimeParser with an LRU cache of cache_size
+    '''
+    import kvdate
+
+    values = datetime_strings(count)
+    timing = dict()
+    for label, func in (('legacy', kvdate.datetime_from_str_legacy),
+                        ('compiled', kvdate.datetime_from_str),
+                        ('parser', kvdate.DatetimeParser()),
+                        ('cached', kvdate.DatetimeParser(cache_size=cache_size))):
+        start = time.perf_counter()
+        for value in values:
+            func(value)
+        timing[label] = (time.perf_counter() - start) / count
+    return timing
+
+
+def compare_baseline(results, baseline, regression_pct=20.0):
+    '''
+    list of messages for entry points whose import time grew more than regression_pct over the baseline
+    '''
+    regressions = []
+    for module, result in results.items():
+        if module not in baseline:
+            continue
+        before = baseline[module]['import_us']
+        if before and (result['import_us'] - before) * 100.0 / before > regression_pct:
+            regressions.append('%s:import_us:%d:baseline:%d' % (module, result['import_us'], before))
+        for heavy in result['heavy']:
+            if heavy not in baseline[module].get('heavy', []):
+                regressions.append('%s:now imports:%s' % (module, heavy))
+    return regressions
+
+
+def print_report(results, top=5):
+    for module, result in results.items():
+        print('%-12s wall:%7.3f sec  imports:%7.1f ms  heavy:%s' % (
+            module, result['wall'], result['import_us'] / 1000.0, ','.join(result['heavy']) or '-'))
+        for name, self_us in result['top'][:top]:
+            print('    %8.1f ms  %s' % (self_us / 1000.0, name))
+
+
+# ---------------------------------------------------------------------------
+if __name__ == '__main__':
+    import kvutil
+
+    # application variables
+    optiondictconfig = {
+        'AppVersion' : {
+            'value' : AppVersion,
+            'description' : 'defines the version number for the app',
+        },
+        'debug' : {
+            'value' : False,
+            'type'  : 'bool',
+            'description' : 'defines if we are running in debug mode',
+        },
+        'entry_points' : {
+            'value' : ENTRY_POINTS,
+            'type' : 'liststr',
+            'description' : 'defines the modules we measure',
+        },
+        'runs' : {
+            'value' : 5,
+            'type' : 'int',
+            'description' : 'defines the number of measured imports per module',
+        },
+        'top' : {
+            'value' : 5,
+            'type' : 'int',
+            'description' : 'defines the number of most expensive modules listed per entry point',
+        },
+        'scriptinfo_runs' : {
+            'value' : 200,
+            'type' : 'int',
+            'description' : 'defines the number of calls timed in the kvutil.scriptinfo micro benchmark (0 to skip)',
+        },
+        'datetime_strings' : {
+            'value' : 0,
+            'type' : 'int',
+            'description' : 'defines the number of strings in the kvdate.datetime_from_str benchmark (0 to skip - 1000000 for the full run)',
+        },
+        'baseline_filename' : {
+            'value' : 'villastartup_baseline.json',
+            'description' : 'defines the json file holding the baseline results',
+        },
+        'save_baseline' : {
+            'value' : False,
+            'type' : 'bool',
+            'description' : 'defines if the results are saved as the new baseline',
+        },
+        'compare' : {
+            'value' : False,
+            'type' : 'bool',
+            'description' : 'defines if the results are compared to the baseline',
+        },
+        'regression_pct' : {
+            'value' : 20.0,
+            'type' : 'float',
+            'description' : 'defines the percent import time growth over the baseline flagged as a regression',
+        },
+    }
+
+    # capture the command line
+    optiondict = kvutil.kv_parse_command_line( optiondictconfig, debug=False )
+
+    results = benchmark(optiondict['entry_points'], optiondict['runs'])
+    print_report(results, optiondict['top'])
+
+    if optiondict['scriptinfo_runs']:
+        timing = bench_scriptinfo(optiondict['scriptinfo_runs'])
+        print('scriptinfo:%.1f us/call  scriptinfo_inspect:%.1f us/call' % (
+            timing['scriptinfo'] * 1e6, timing['scriptinfo_inspect'] * 1e6))
+
+    if optiondict['datetime_strings']:
+        timing = bench_datetime_from_str(optiondict['datetime_strings'])
+        print('datetime_from_str:', '  '.join('%s:%.2f us/call' % (k, v * 1e6) for k, v in timing.items()))
+
+    if optiondict['save_baseline']:
+        with open(optiondict['baseline_filename'], 'w') as t:
+            json.dump(results, t, indent=2)
+        print('Saved baseline:', optiondict['baseline_filename'])
+
+    if optiondict['compare']:
+        with open(optiondict['baseline_filename'], 'r') as t:
+            baseline = json.load(t)
+        regressions = compare_baseline(results, baseline, optiondict['regression_pct'])
+        for msg in regressions:
+            print('REGRESSION:', msg)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against:', optiondict['baseline_filename'])
+
+# eof